@@ -0,0 +1,293 @@
+"""Throughput and latency benchmark for the public and admin routes.
+
+Seeds a throwaway database with realistic volumes, then measures every
+scenario through the Flask test client and through a local threaded WSGI
+server. SMTP is never contacted (the mail queue and CV checks are disabled)
+and reCAPTCHA is answered by the local stand-in verifier chosen with
+--recaptcha, e.g. "pass:80" adds 80 ms per check. Results are printed as JSON.
+
+    python benchmarks/bench.py --output before.json
+    python benchmarks/bench.py --baseline before.json --output after.json
+"""
+import argparse
+import http.client
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples, errors, elapsed):
+    return {
+        "requests": len(samples) + errors,
+        "errors": errors,
+        "requests_per_second": round(len(samples) / elapsed, 1) if elapsed else None,
+        "mean_ms": round(statistics.mean(samples) * 1000, 2) if samples else None,
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 2) if samples else None,
+        "p90_ms": round(percentile(samples, 0.90) * 1000, 2) if samples else None,
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 2) if samples else None,
+        "max_ms": round(max(samples) * 1000, 2) if samples else None,
+    }
+
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+        body.write(data)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+def seed(app, db, args):
+    from werkzeug.security import generate_password_hash
+
+    from webApp import file_storage
+    from webApp.models import Candidate, Persona, Section, Setting, User, Video
+    from webApp.storage import store_upload
+
+    class Upload:
+        def __init__(self, filename, data):
+            self.filename = filename
+            self.stream = io.BytesIO(data)
+
+    rng = random.Random(42)
+    lorem = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
+             "incididunt ut labore et dolore magna aliqua. ")
+    with app.app_context():
+        db.session.add(Setting(name="email", value="hr@example.com"))
+        db.session.add(User(email="admin@example.com", name="Admin", active=True,
+                            password=generate_password_hash("admin")))
+        for context in ("index", "centrala", "prodejny", "sklady"):
+            for number in range(args.sections):
+                db.session.add(Section(
+                    title_cs=f"Odstavec {number}", title_sk=f"Odsek {number}",
+                    body_cs=f"<p>{lorem * 4}</p>", body_sk=f"<p>{lorem * 4}</p>",
+                    context=context, image_url="images/jsme-okay.png"))
+            if context != "index":
+                db.session.add(Video(video_url="https://www.youtube.com/embed/x", video_context=context))
+        for number in range(args.personas):
+            db.session.add(Persona(
+                fullname=f"Personalista {number}", position_cs="Personalista", position_sk="Personalista",
+                phone="+420 123 456 789", email=f"p{number}@example.com",
+                image_url="images/sedajova.jpg", area=rng.choice(["centrala", "prodejny", "sklady"])))
+        files = [store_upload(Upload(f"cv{number}.pdf", os.urandom(args.cv_size)), file_storage)
+                 for number in range(20)]
+        start = datetime(2021, 1, 1)
+        for number in range(args.candidates):
+            relpath, filename = rng.choice(files)
+            db.session.add(Candidate(
+                created=start + timedelta(minutes=17 * number), fullname=f"Uchazeč {number}",
+                email=f"u{number}@example.com", file=relpath, filename=filename,
+                message=lorem * rng.randint(1, 5)))
+        db.session.commit()
+        return Candidate.query.order_by(Candidate.id).first().id
+
+
+def scenarios(candidate_id, cv_size):
+    def apply_form():
+        fields = {"name": "Jan", "surname": "Novák", "email": "jan@example.com",
+                  "message": "Dobrý den, mám zájem.", "terms": "y",
+                  "g-recaptcha-response": uuid.uuid4().hex}
+        return fields, {"file": ("cv.pdf", os.urandom(cv_size))}
+
+    # The last item is the expected status and redirect target, anything else is an error.
+    # A form that fails validation answers 200, a lost admin session redirects to /admin.
+    return [
+        ("index", "GET", "/", None, False, (200, None)),
+        ("mainpage_get", "GET", "/pages/prodejny", None, False, (200, None)),
+        ("mainpage_post", "POST", "/pages/prodejny", apply_form, False, (302, "/pages/prodejny")),
+        ("candidates", "GET", "/admin/candidates", None, True, (200, None)),
+        ("candidates_search", "GET", "/admin/candidates?q=uchazec", None, True, (200, None)),
+        ("download", "GET", f"/admin/download/{candidate_id}", None, True, (200, None)),
+    ]
+
+
+def as_expected(expect, status, location):
+    if location is not None:
+        location = urlsplit(location).path
+    return (status, location) == expect
+
+
+def run_client(app, scenario, iterations, admin_session):
+    name, method, path, form, admin, expect = scenario
+    client = app.test_client()
+    if admin:
+        client.set_cookie("localhost", "session", admin_session)
+    samples, errors = [], 0
+    began = time.perf_counter()
+    for _ in range(iterations):
+        kwargs = {}
+        if form:
+            fields, files = form()
+            data = dict(fields)
+            data.update({key: (io.BytesIO(body), filename) for key, (filename, body) in files.items()})
+            kwargs.update(data=data, content_type="multipart/form-data")
+        started = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        response.get_data()
+        if as_expected(expect, response.status_code, response.headers.get("Location")):
+            samples.append(time.perf_counter() - started)
+        else:
+            errors += 1
+    return summarize(samples, errors, time.perf_counter() - began)
+
+
+def run_server(port, scenario, iterations, concurrency, admin_session):
+    name, method, path, form, admin, expect = scenario
+    samples, errors = [], [0]
+    lock = threading.Lock()
+    per_thread = max(1, iterations // concurrency)
+
+    def worker():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        for _ in range(per_thread):
+            headers = {"Cookie": f"session={admin_session}"} if admin else {}
+            body = None
+            if form:
+                body, headers["Content-Type"] = multipart(*form())
+            started = time.perf_counter()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                ok = as_expected(expect, response.status, response.getheader("Location"))
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                ok = False
+            duration = time.perf_counter() - started
+            with lock:
+                if ok:
+                    samples.append(duration)
+                else:
+                    errors[0] += 1
+        connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, errors[0], time.perf_counter() - began)
+
+
+def compare(results, baseline):
+    for key, result in results.items():
+        before = baseline.get("results", {}).get(key)
+        if not before or not before.get("p50_ms") or not result.get("p50_ms"):
+            continue
+        result["p50_change"] = round(result["p50_ms"] / before["p50_ms"] - 1, 3)
+        if before.get("requests_per_second") and result.get("requests_per_second"):
+            result["rps_change"] = round(result["requests_per_second"] / before["requests_per_second"] - 1, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--candidates", type=int, default=5000)
+    parser.add_argument("--sections", type=int, default=30, help="sections per context")
+    parser.add_argument("--personas", type=int, default=60)
+    parser.add_argument("--cv-size", type=int, default=200 * 1024)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mode", choices=["client", "server", "both"], default="both")
+    parser.add_argument("--only", action="append", help="run only the named scenario(s)")
+    parser.add_argument("--recaptcha", default="pass", help="stand-in verifier: pass, fail or down[:delay_ms]")
+    parser.add_argument("--baseline", help="earlier JSON result to compare against")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp(prefix="career-bench-")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'career.db')}",
+        "FILES_DIR": os.path.join(workdir, "files"),
+        "SECRET_KEY": "benchmark",
+        "MAIL_QUEUE_WORKERS": "0",
+        "CV_CHECK_WORKERS": "0",
+        "RECAPTCHA_VERIFIER": args.recaptcha,
+    })
+    sys.path.insert(0, root)
+    from werkzeug.serving import make_server
+
+    from webApp import app, db
+
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    candidate_id = seed(app, db, args)
+    admin_session = app.session_interface.get_signing_serializer(app).dumps({"_user_id": "1", "_fresh": True})
+
+    selected = [scenario for scenario in scenarios(candidate_id, args.cv_size)
+                if not args.only or scenario[0] in args.only]
+    # One untimed pass so first-request setup does not land in the samples
+    for scenario in selected:
+        run_client(app, scenario, 1, admin_session)
+
+    results = {}
+    if args.mode in ("client", "both"):
+        for scenario in selected:
+            results[f"client/{scenario[0]}"] = run_client(app, scenario, args.iterations, admin_session)
+    if args.mode in ("server", "both"):
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            for scenario in selected:
+                results[f"server/{scenario[0]}"] = run_server(
+                    server.server_port, scenario, args.iterations, args.concurrency, admin_session)
+        finally:
+            server.shutdown()
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline:
+            compare(results, json.load(baseline))
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = {
+        "meta": {
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "settings": {key: value for key, value in vars(args).items()
+                         if key not in ("baseline", "output", "only")},
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            out.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""Cold start: import time and first-request latency of a fresh worker.
+
+Every run is a new Python process, like a worker that gunicorn or an
+autoscaler has just spawned. Runs are repeated with the Jinja bytecode
+cache disabled, empty and filled by `flask compile-templates`, and the
+medians are printed as JSON.
+
+    python benchmarks/cold_start.py --runs 10
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = ("/", "/pages/centrala", "/admin")
+
+
+def child():
+    started = time.perf_counter()
+    from webApp import app
+    timings = {"import_ms": (time.perf_counter() - started) * 1000}
+    client = app.test_client()
+    for path in PATHS:
+        began = time.perf_counter()
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+        timings[f"first {path} ms"] = (time.perf_counter() - began) * 1000
+    timings["total_ms"] = (time.perf_counter() - started) * 1000
+    modules = sys.modules
+    timings["email_loaded"] = "email.mime.multipart" in modules
+    timings["smtplib_loaded"] = "smtplib" in modules
+    timings["pillow_loaded"] = "PIL.Image" in modules
+    print(json.dumps(timings))
+
+
+def run(env):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    workdir = tempfile.mkdtemp(prefix="career-cold-")
+    cache_dir = os.path.join(workdir, "jinja-cache")
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'career.db')}",
+               FILES_DIR=os.path.join(workdir, "files"),
+               SECRET_KEY="cold-start",
+               MAIL_QUEUE_WORKERS="0",
+               CV_CHECK_WORKERS="0",
+               PYTHONPATH=ROOT,
+               PYTHONDONTWRITEBYTECODE="")
+    # Creates and migrates the database so that no run pays for it
+    run(dict(env, JINJA_CACHE_DIR=""))
+
+    results = {}
+    for mode in ("disabled", "empty", "precompiled"):
+        samples = []
+        for _ in range(args.runs):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            mode_env = dict(env, JINJA_CACHE_DIR="" if mode == "disabled" else cache_dir)
+            if mode == "precompiled":
+                subprocess.run([sys.executable, "-m", "flask", "compile-templates"], cwd=ROOT,
+                               env=dict(mode_env, FLASK_APP="webApp"), capture_output=True, check=True)
+            samples.append(run(mode_env))
+        results[mode] = {key: round(statistics.median(sample[key] for sample in samples), 2)
+                         if isinstance(samples[0][key], float) else samples[0][key]
+                         for key in samples[0]}
+    print(json.dumps({"runs": args.runs, "python": sys.version.split()[0], "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
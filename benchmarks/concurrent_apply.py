@@ -0,0 +1,162 @@
+"""Load test: concurrent applications through mainpage against SQLite.
+
+Starts a throwaway database and fires POST /pages/centrala from several
+worker processes at once, like gunicorn workers sharing one database file.
+Every process has its own engine and connections, so SQLite's file locks
+are contended for real. Next to them `--exports` processes download the
+candidate export as slowly as an admin on a poor connection, which keeps a
+reader on the database for the whole download. Reports how many requests
+failed with "database is locked".
+
+    python benchmarks/concurrent_apply.py --processes 8 --requests 25
+    python benchmarks/concurrent_apply.py --legacy   # rollback journal, 5 s timeout
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN = {"email": "admin@example.com", "password": "load-test"}
+# The FTS triggers on candidates report a busy database as a failed vtable constructor
+LOCKED = ("database is locked", "vtable constructor failed")
+
+
+def client():
+    sys.path.insert(0, ROOT)
+    from webApp import app
+
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return app.test_client()
+
+
+def applicant(number, requests, start, results):
+    browser = client()
+    counts = {"ok": 0, "locked": 0, "other": 0}
+    start.wait()
+    for request_number in range(requests):
+        data = {
+            "name": "Jan", "surname": f"Novák {number}-{request_number}",
+            "email": "jan@example.com", "message": "Dobrý den", "terms": "y",
+            "file": (io.BytesIO(os.urandom(2048)), "cv.pdf"),
+        }
+        try:
+            response = browser.post("/pages/centrala", data=data, content_type="multipart/form-data")
+            outcome = "ok" if response.status_code == 302 else "other"
+        except Exception as err:
+            outcome = "locked" if any(message in str(err) for message in LOCKED) else "other"
+        counts[outcome] += 1
+    results.put(counts)
+
+
+def exporter(delay, start, done, results):
+    browser = client()
+    assert browser.post("/admin", data=ADMIN).status_code == 302
+    downloads = 0
+    start.wait()
+    while not done.is_set():
+        # Rows are read from a server side cursor as the chunks go out
+        response = browser.get("/admin/candidates/export")
+        for _ in response.response:
+            time.sleep(delay)
+        response.close()
+        downloads += 1
+    results.put({"exports": downloads})
+
+
+def seed(rows):
+    from webApp import db
+    from webApp.models import Candidate, Setting, User
+    from webApp.security import password_hasher
+
+    db.session.add(Setting(name="email", value="hr@example.com"))
+    db.session.add(User(email=ADMIN["email"], name="Admin", active=True,
+                        password=password_hasher.hash(ADMIN["password"])))
+    now = datetime.utcnow()
+    db.session.bulk_insert_mappings(Candidate, [
+        {"created": now, "fullname": f"Uchazeč {number}", "email": "uchazec@example.com",
+         "message": "Dobrý den", "file": f"cv-{number}.pdf", "status": "ready"}
+        for number in range(rows)])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=25, help="POSTs per process")
+    parser.add_argument("--exports", type=int, default=1, help="processes downloading the candidate export")
+    parser.add_argument("--export-delay", type=float, default=0.2, help="seconds per downloaded chunk")
+    parser.add_argument("--candidates", type=int, default=10000, help="rows in the database at the start")
+    parser.add_argument("--legacy", action="store_true",
+                        help="disable WAL and use the sqlite3 default timeout, like before")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="career-load-")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'career.db')}",
+        "FILES_DIR": os.path.join(workdir, "files"),
+        "SECRET_KEY": "load-test",
+        "MAIL_QUEUE_WORKERS": "0",
+        "CV_CHECK_WORKERS": "0",
+        "RETENTION_INTERVAL": "0",
+        # A hashing pool inside a multiprocessing child keeps it from exiting
+        "PASSWORD_HASH_WORKERS": "0",
+    })
+    if args.legacy:
+        os.environ.update({"SQLITE_WAL": "0", "SQLITE_BUSY_TIMEOUT": "5000"})
+
+    sys.path.insert(0, ROOT)
+    from webApp import app, db
+    from webApp.models import Candidate
+
+    with app.app_context():
+        seed(args.candidates)
+        db.session.remove()
+        db.engine.dispose()
+
+    # Spawned, not forked: every worker imports the app and opens its own connections
+    context = multiprocessing.get_context("spawn")
+    start = context.Barrier(args.processes + args.exports + 1)
+    done = context.Event()
+    results = context.Queue()
+    applicants = [context.Process(target=applicant, args=(number, args.requests, start, results))
+                  for number in range(args.processes)]
+    exporters = [context.Process(target=exporter, args=(args.export_delay, start, done, results))
+                 for _ in range(args.exports)]
+    for process in applicants + exporters:
+        process.start()
+    start.wait()
+    began = time.perf_counter()
+    totals = {"ok": 0, "locked": 0, "other": 0, "exports": 0}
+    for _ in applicants:
+        for outcome, count in results.get().items():
+            totals[outcome] += count
+    elapsed = time.perf_counter() - began
+    done.set()
+    for _ in exporters:
+        totals["exports"] += results.get()["exports"]
+    for process in applicants + exporters:
+        process.join()
+
+    with app.app_context():
+        stored = Candidate.query.count() - args.candidates
+    total = args.processes * args.requests
+    print(json.dumps({
+        "mode": "legacy" if args.legacy else "wal",
+        "processes": args.processes,
+        "requests": total,
+        "stored": stored,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 1),
+        **totals,
+    }, indent=2))
+    return 0 if totals["locked"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# The app is configured from the environment when webApp is imported, so a
+# throwaway database and file directory are set up before any test runs.
+WORKDIR = tempfile.mkdtemp(prefix="career-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(WORKDIR, 'career.db')}",
+    "FILES_DIR": os.path.join(WORKDIR, "files"),
+    "JINJA_CACHE_DIR": "",
+    "SECRET_KEY": "tests",
+    "MAIL_QUEUE_WORKERS": "0",
+    "CV_CHECK_WORKERS": "0",
+    "RETENTION_INTERVAL": "0",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,274 @@
+"""Local stand-ins for the external services, each one a server on 127.0.0.1."""
+import socketserver
+import struct
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+
+class S3StandIn:
+    """Path-style S3 subset: PUT, GET, HEAD, DELETE and ListObjectsV2.
+
+    Every request must carry a valid Signature Version 4 for `secret_key`,
+    in the Authorization header or as a presigned query. Listings return
+    `page_size` keys per page to exercise continuation tokens.
+    """
+
+    def __init__(self, bucket="bucket", access_key="AK", secret_key="SK", page_size=2):
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.page_size = page_size
+        self.objects = {}
+        self.requests = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _signed(self, method, path, query, headers):
+        from webApp.storage import S3Storage
+
+        signer = S3Storage(self.url, self.bucket, self.access_key, self.secret_key)
+        if "X-Amz-Signature" in query:
+            query = dict(query)
+            signature = query.pop("X-Amz-Signature")
+            expected = signer._signature(method, path, query, {"host": headers["Host"]},
+                                         "UNSIGNED-PAYLOAD", query["X-Amz-Date"])[2]
+            return signature == expected
+        auth = headers.get("Authorization", "")
+        if "SignedHeaders=" not in auth:
+            return False
+        names = auth.split("SignedHeaders=")[1].split(",")[0].split(";")
+        expected = signer._signature(method, path, query, {name: headers[name] for name in names},
+                                     headers["x-amz-content-sha256"], headers["x-amz-date"])[2]
+        return auth.split("Signature=")[1] == expected
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            last_modified = None
+
+            def reply(self, status, body=b""):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                if self.last_modified is not None:
+                    self.send_header("Last-Modified", formatdate(self.last_modified, usegmt=True))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def handle_request(self):
+                url = urlsplit(self.path)
+                query = dict(parse_qsl(url.query, keep_blank_values=True))
+                standin.requests.append((self.command, url.path, query))
+                if not standin._signed(self.command, url.path, query, self.headers):
+                    return self.reply(403, b"<Error><Code>SignatureDoesNotMatch</Code></Error>")
+                parts = url.path.split("/", 2)
+                key = unquote(parts[2]) if len(parts) > 2 else None
+                if self.command == "PUT":
+                    data = self.rfile.read(int(self.headers["Content-Length"]))
+                    standin.objects[key] = (data, time.time())
+                    return self.reply(200)
+                if key is None:
+                    return self.reply(200, standin._listing(query))
+                if key not in standin.objects:
+                    return self.reply(404, b"<Error><Code>NoSuchKey</Code></Error>")
+                if self.command == "DELETE":
+                    del standin.objects[key]
+                    return self.reply(204)
+                self.last_modified = standin.objects[key][1]
+                return self.reply(200, standin.objects[key][0])
+
+            do_GET = do_PUT = do_HEAD = do_DELETE = handle_request
+
+        return Handler
+
+    def _listing(self, query):
+        keys = sorted(key for key in self.objects if key.startswith(query.get("prefix", "")))
+        start = int(query.get("continuation-token") or 0)
+        page = keys[start:start + self.page_size]
+        truncated = start + self.page_size < len(keys)
+        items = "".join(
+            f"<Contents><Key>{escape(key)}</Key>"
+            f"<LastModified>{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.objects[key][1]))}.000Z</LastModified>"
+            f"<Size>{len(self.objects[key][0])}</Size></Contents>" for key in page)
+        token = f"<NextContinuationToken>{start + self.page_size}</NextContinuationToken>" if truncated else ""
+        return (f'<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">{items}'
+                f'<IsTruncated>{"true" if truncated else "false"}</IsTruncated>{token}</ListBucketResult>').encode()
+
+
+class SiteverifyStandIn:
+    """reCAPTCHA siteverify that answers from `answers`, one per request.
+
+    An answer is an HTTP status, 200 means success. Once the list is used
+    up every token is accepted. The posted forms are kept in `requests`.
+    """
+
+    def __init__(self):
+        self.answers = []
+        self.requests = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self._server.server_port}/recaptcha/api/siteverify"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                form = dict(parse_qsl(self.rfile.read(int(self.headers["Content-Length"])).decode()))
+                standin.requests.append(form)
+                status = standin.answers.pop(0) if standin.answers else 200
+                body = b'{"success": true}' if status == 200 else b"Service Unavailable"
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+class SMTPStandIn:
+    """Plain SMTP without TLS or authentication that keeps what it accepts.
+
+    `replies` maps a recipient to the replies its next RCPT TO commands get,
+    one per attempt, e.g. ["451 4.3.0 Try again later"]. Once the list is
+    used up the recipient is accepted. Accepted messages are stored in
+    `received` as (sender, recipients, data).
+    """
+
+    def __init__(self):
+        self.replies = {}
+        self.received = []
+        self.sessions = 0
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        standin = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                standin.sessions += 1
+                self.reply("220 stand-in ESMTP")
+                sender, recipients = None, []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode().rstrip("\r\n")
+                    verb = command[:4].upper()
+                    if verb in ("EHLO", "HELO"):
+                        self.reply("250 stand-in")
+                    elif verb == "MAIL":
+                        sender, recipients = command.split(":", 1)[1].strip(" <>"), []
+                        self.reply("250 OK")
+                    elif verb == "RCPT":
+                        recipient = command.split(":", 1)[1].strip(" <>")
+                        pending = standin.replies.get(recipient)
+                        if pending:
+                            self.reply(pending.pop(0))
+                        else:
+                            recipients.append(recipient)
+                            self.reply("250 OK")
+                    elif verb == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = []
+                        for line in self.rfile:
+                            if line == b".\r\n":
+                                break
+                            data.append(line)
+                        standin.received.append((sender, recipients, b"".join(data).decode()))
+                        self.reply("250 OK")
+                    elif verb in ("RSET", "NOOP"):
+                        sender, recipients = None, []
+                        self.reply("250 OK")
+                    elif verb == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+        return Handler
+
+
+class ClamdStandIn:
+    """clamd INSTREAM on host:port that finds `signature` in any stream containing it."""
+
+    def __init__(self, signature=b"EICAR-STANDARD-ANTIVIRUS-TEST-FILE"):
+        self.signature = signature
+        self.scanned = []
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.address = "%s:%d" % self._server.server_address
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        standin = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                if self.rfile.read(10) != b"zINSTREAM\0":
+                    self.wfile.write(b"UNKNOWN COMMAND\0")
+                    return
+                data = b""
+                while True:
+                    size = struct.unpack("!L", self.rfile.read(4))[0]
+                    if not size:
+                        break
+                    data += self.rfile.read(size)
+                standin.scanned.append(data)
+                if standin.signature in data:
+                    self.wfile.write(b"stream: Eicar-Test-Signature FOUND\0")
+                else:
+                    self.wfile.write(b"stream: OK\0")
+
+        return Handler
@@ -0,0 +1,24 @@
+from flask import url_for
+
+from webApp import app, static_assets
+from webApp.assets import build_assets
+from webApp.routes import media_url
+
+
+def test_build_leaves_upload_variants_out(tmp_path):
+    for name, data in (("css/style.css", b"body{}"), ("images/logo.png", b"png"),
+                       ("images/variants/ab/photo-320.webp", b"webp"), ("lang.json", b"{}")):
+        path = tmp_path.joinpath(*name.split("/"))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    manifest = build_assets(str(tmp_path))
+    assert sorted(manifest) == ["css/style.css", "images/logo.png"]
+    assert manifest["css/style.css"].startswith("build/css/style.")
+
+
+def test_uploaded_images_skip_the_manifest(monkeypatch):
+    monkeypatch.setattr(static_assets, "manifest", {"images/team.png": "build/images/team.0123456789ab.png"})
+    with app.test_request_context():
+        # A template asset is fingerprinted, an upload under the same name is not
+        assert url_for("static", filename="images/team.png") == "/static/build/images/team.0123456789ab.png"
+        assert media_url("images/team.png") == "/static/images/team.png"
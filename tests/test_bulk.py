@@ -0,0 +1,125 @@
+import pytest
+
+from webApp import app, db, file_storage
+from webApp.bulk import file_remover
+from webApp.models import Candidate, Section, User
+
+
+def logged_in_client(user_id):
+    client = app.test_client()
+    cookie = app.session_interface.get_signing_serializer(app).dumps({"_user_id": str(user_id), "_fresh": True})
+    client.set_cookie("localhost", "session", cookie)
+    return client
+
+
+@pytest.fixture
+def superadmin():
+    # Only the first administrator may delete applications
+    with app.app_context():
+        if User.query.get(1) is None:
+            db.session.add(User(id=1, email="super@example.com", name="Super", password="x", active=True))
+            db.session.commit()
+    return logged_in_client(1)
+
+
+@pytest.fixture
+def admin(superadmin):
+    with app.app_context():
+        user = User(email="bulk@example.com", name="Bulk", password="x", active=True)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    yield logged_in_client(user_id)
+    with app.app_context():
+        User.query.filter_by(id=user_id).delete()
+        db.session.commit()
+
+
+def csrf_token(client):
+    return client.get("/fragment?form=1").get_json()["csrf_token"]
+
+
+def add_candidates(*statuses, file="bulk-review.pdf", tmp_path=None):
+    if tmp_path is not None:
+        source = tmp_path / file
+        source.write_bytes(b"%PDF-1.4 cv")
+        file_storage.put(file, str(source))
+    with app.app_context():
+        candidates = [Candidate(fullname="Hromadný Jan", email="bulk@example.com", message="Dobrý den",
+                                file=file, filename="cv.pdf", status=status) for status in statuses]
+        db.session.add_all(candidates)
+        db.session.commit()
+        return [candidate.id for candidate in candidates]
+
+
+def candidate_statuses(ids):
+    with app.app_context():
+        return {candidate.id: candidate.status for candidate in Candidate.query.filter(Candidate.id.in_(ids))}
+
+
+def test_posts_without_a_csrf_token_are_refused(admin):
+    ids = add_candidates("review")
+    response = admin.post("/admin/bulk/candidates", json={"approve": ids})
+    assert response.status_code == 400
+    assert "CSRF" in response.get_json()["error"]
+    response = admin.post("/admin/bulk/candidates", json={"approve": ids},
+                          headers={"X-CSRFToken": "forged"})
+    assert response.status_code == 400
+
+    response = admin.post("/admin/bulk/candidates", data={"action": "approve", "ids": ids},
+                          headers={"Referer": "/admin/candidates"})
+    assert response.status_code == 302
+    assert candidate_statuses(ids) == {ids[0]: "review"}
+
+    response = admin.post("/admin/bulk/candidates", json={"approve": ids},
+                          headers={"X-CSRFToken": csrf_token(admin)})
+    assert response.get_json() == {"approved": 1}
+    assert candidate_statuses(ids) == {ids[0]: "pending"}
+
+
+def test_only_the_superadmin_deletes_candidates(admin, superadmin, tmp_path):
+    ids = add_candidates("ready", "ready", file="bulk-shared.pdf", tmp_path=tmp_path)
+    response = admin.post("/admin/bulk/candidates", json={"delete": ids},
+                          headers={"X-CSRFToken": csrf_token(admin)})
+    assert response.status_code == 403
+    response = admin.post("/admin/bulk/candidates", data={"action": "delete", "ids": ids,
+                                                           "csrf_token": csrf_token(admin)})
+    assert response.status_code == 403
+    assert len(candidate_statuses(ids)) == 2
+    assert admin.get(f"/admin/del-candidate/{ids[0]}").status_code == 403
+
+    # The CV is shared, it stays until the last application using it is gone
+    response = superadmin.post("/admin/bulk/candidates", json={"delete": ids[:1]},
+                               headers={"X-CSRFToken": csrf_token(superadmin)})
+    assert response.get_json() == {"deleted": 1}
+    file_remover.join()
+    assert file_storage.exists("bulk-shared.pdf")
+
+    response = superadmin.post("/admin/bulk/candidates", json={"delete": ids[1:]},
+                               headers={"X-CSRFToken": csrf_token(superadmin)})
+    assert response.get_json() == {"deleted": 1}
+    file_remover.join()
+    assert candidate_statuses(ids) == {}
+    assert not file_storage.exists("bulk-shared.pdf")
+
+
+def test_a_malformed_batch_changes_nothing(admin):
+    with app.app_context():
+        sections = [Section(title_cs=f"Hromadná {number}", title_sk=f"Hromadná {number}", body_cs="<p>a</p>",
+                            body_sk="<p>a</p>", context="sklady", position=number) for number in (1, 2)]
+        db.session.add_all(sections)
+        db.session.commit()
+        ids = [section.id for section in sections]
+    token = csrf_token(admin)
+    for batch in ({"order": ids[::-1], "update": [{"id": ids[0], "context": "index"}]},
+                  {"order": ids[::-1], "delete": ["1"]},
+                  {"order": ids[::-1], "drop": ids}):
+        response = admin.post("/admin/bulk/sections", json=batch, headers={"X-CSRFToken": token})
+        assert response.status_code == 400
+    response = admin.post("/admin/bulk/sections", headers={"X-CSRFToken": token}, json={
+        "order": ids[::-1], "update": [{"id": ids[0], "body_cs": "<p onclick=\"x\">nový</p>"}]})
+    assert response.get_json() == {"ordered": 2, "updated": 1}
+    with app.app_context():
+        first, second = (Section.query.get(section_id) for section_id in ids)
+        assert (first.position, second.position) == (2, 1)
+        assert first.html_cs == "<p>nový</p>"
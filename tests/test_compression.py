@@ -0,0 +1,71 @@
+import gzip
+import re
+
+import pytest
+
+from webApp import app
+from webApp import compression
+
+
+# The signed CSRF token carries a timestamp, it differs between two renders
+CSRF_TOKEN = re.compile(rb'(name="csrf_token" type="hidden" value=)"[^"]*"')
+
+
+def get(path, client=None, **headers):
+    return (client or app.test_client()).get(path, headers=headers)
+
+
+def same_page(data, other):
+    return CSRF_TOKEN.sub(rb"\1", data) == CSRF_TOKEN.sub(rb"\1", other)
+
+
+def test_gzip_when_the_client_accepts_it():
+    plain = get("/pages/sklady")
+    packed = get("/pages/sklady", **{"Accept-Encoding": "gzip, deflate"})
+    assert packed.headers["Content-Encoding"] == "gzip"
+    assert same_page(gzip.decompress(packed.data), plain.data)
+    assert int(packed.headers["Content-Length"]) == len(packed.data) < len(plain.data)
+    assert "Accept-Encoding" in packed.vary
+
+
+def test_identity_is_still_varied_on_accept_encoding():
+    for headers in ({}, {"Accept-Encoding": "identity"}, {"Accept-Encoding": "gzip;q=0"}):
+        response = get("/pages/sklady", **headers)
+        assert "Content-Encoding" not in response.headers
+        assert "Accept-Encoding" in response.vary
+        assert b"</html>" in response.data
+
+
+def test_without_brotli_br_clients_get_gzip_or_nothing(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert "Content-Encoding" not in get("/pages/sklady", **{"Accept-Encoding": "br"}).headers
+    assert get("/pages/sklady", **{"Accept-Encoding": "br, gzip"}).headers["Content-Encoding"] == "gzip"
+
+
+def test_brotli_is_preferred_when_installed():
+    brotli = pytest.importorskip("brotli")
+    plain = get("/pages/sklady")
+    packed = get("/pages/sklady", **{"Accept-Encoding": "gzip, br"})
+    assert packed.headers["Content-Encoding"] == "br"
+    assert same_page(brotli.decompress(packed.data), plain.data)
+
+
+def test_small_bodies_are_sent_as_they_are(monkeypatch):
+    response = get("/fragment", **{"Accept-Encoding": "gzip"})
+    assert len(response.data) < app.config["COMPRESS_MIN_SIZE"]
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.vary
+
+    monkeypatch.setitem(app.config, "COMPRESS_MIN_SIZE", 10**6)
+    assert "Content-Encoding" not in get("/pages/sklady", **{"Accept-Encoding": "gzip"}).headers
+
+
+def test_conditional_get_is_not_compressed():
+    client = app.test_client()
+    first = get("/pages/sklady", client, **{"Accept-Encoding": "gzip"})
+    etag, modified = first.headers["ETag"], first.headers["Last-Modified"]
+    for headers in ({"If-None-Match": etag}, {"If-Modified-Since": modified}):
+        response = get("/pages/sklady", client, **{"Accept-Encoding": "gzip"}, **headers)
+        assert response.status_code == 304
+        assert response.data == b""
+        assert "Content-Encoding" not in response.headers
@@ -0,0 +1,64 @@
+import pytest
+
+from webApp import app, db
+from webApp.models import User
+from webApp.security import HashingBusy, password_hasher
+
+
+@pytest.fixture
+def admin():
+    with app.app_context():
+        user = User(email="creds@example.com", name="Creds", password="x", active=True)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    client = app.test_client()
+    cookie = app.session_interface.get_signing_serializer(app).dumps({"_user_id": str(user_id), "_fresh": True})
+    client.set_cookie("localhost", "session", cookie)
+    yield client, user_id
+    with app.app_context():
+        User.query.filter_by(id=user_id).delete()
+        db.session.commit()
+
+
+@pytest.fixture
+def mailed(monkeypatch):
+    sent = []
+    monkeypatch.setattr(User, "send_password", staticmethod(lambda email, password: sent.append((email, password))))
+    return sent
+
+
+def stored_password(user_id):
+    with app.app_context():
+        return User.query.get(user_id).password
+
+
+def test_mailed_password_matches_the_saved_hash(admin, mailed):
+    client, user_id = admin
+    response = client.get(f"/admin/send_passwrd/{user_id}")
+    assert response.status_code == 302
+    [(email, password)] = mailed
+    assert email == "creds@example.com"
+    assert password_hasher.check(stored_password(user_id), password)
+
+
+def test_busy_hashing_mails_nothing(admin, mailed, monkeypatch):
+    client, user_id = admin
+
+    def busy(*args):
+        raise HashingBusy()
+
+    monkeypatch.setattr(password_hasher, "_run", busy)
+    response = client.get(f"/admin/send_passwrd/{user_id}")
+    assert response.status_code == 302
+    assert response.location.endswith("/admin/users")
+    assert mailed == []
+    assert stored_password(user_id) == "x"
+
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", False)
+    response = client.post("/admin/add-user", data={"email": "new@example.com", "name": "Nový"})
+    assert response.status_code == 302
+    assert response.location.endswith("/admin/add-user")
+    assert mailed == []
+    with app.app_context():
+        assert User.query.filter_by(email="new@example.com").first() is None
@@ -0,0 +1,79 @@
+import hashlib
+import io
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from webApp import app, db, file_storage
+from webApp.models import Candidate, User
+from webApp.storage import store_upload
+
+DATA = b"%PDF-1.4 " + bytes(range(256)) * 40
+
+
+@pytest.fixture
+def admin():
+    with app.app_context():
+        user = User(email="downloads@example.com", name="Downloads", password="x", active=True)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    client = app.test_client()
+    cookie = app.session_interface.get_signing_serializer(app).dumps({"_user_id": str(user_id), "_fresh": True})
+    client.set_cookie("localhost", "session", cookie)
+    yield client
+    with app.app_context():
+        User.query.filter_by(id=user_id).delete()
+        db.session.commit()
+
+
+def add_candidate(file=None):
+    if file is None:
+        file, _ = store_upload(FileStorage(stream=io.BytesIO(DATA), filename="cv.pdf"), file_storage)
+    with app.app_context():
+        candidate = Candidate(fullname="Stažený Jan", email="download@example.com", message="Dobrý den",
+                              file=file, filename="Životopis.pdf", status="ready")
+        db.session.add(candidate)
+        db.session.commit()
+        return candidate.id
+
+
+def test_download_answers_ranges_and_conditional_requests(admin):
+    url = f"/admin/download/{add_candidate()}"
+    response = admin.get(url)
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers["ETag"] == f'"{hashlib.sha256(DATA).hexdigest()}"'
+    assert "attachment" in response.headers["Content-Disposition"]
+    assert "private" in response.headers["Cache-Control"]
+
+    partial = admin.get(url, headers={"Range": "bytes=100-199"})
+    assert partial.status_code == 206
+    assert partial.data == DATA[100:200]
+    assert partial.headers["Content-Range"] == f"bytes 100-199/{len(DATA)}"
+    assert partial.headers["Accept-Ranges"] == "bytes"
+
+    assert admin.get(url, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    # A resumed download of a file that changed meanwhile starts over
+    resumed = admin.get(url, headers={"Range": "bytes=100-", "If-Range": '"stale"'})
+    assert (resumed.status_code, resumed.data) == (200, DATA)
+
+
+def test_x_accel_leaves_the_bytes_to_nginx(admin, monkeypatch):
+    monkeypatch.setitem(app.config, "FILES_SENDFILE", "x-accel")
+    candidate_id = add_candidate()
+    response = admin.get(f"/admin/download/{candidate_id}")
+    with app.app_context():
+        key = Candidate.query.get(candidate_id).file
+    assert response.status_code == 200
+    assert response.data == b""
+    assert response.headers["X-Accel-Redirect"] == app.config["FILES_ACCEL_PREFIX"] + key
+    assert response.mimetype == "application/pdf"
+    assert admin.get(f"/admin/download/{candidate_id}",
+                     headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_missing_file_goes_back_to_the_list(admin):
+    response = admin.get(f"/admin/download/{add_candidate('ab/cd/chybi.pdf')}")
+    assert response.status_code == 302
+    assert response.location.endswith("/admin/candidates")
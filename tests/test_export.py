@@ -0,0 +1,98 @@
+import csv
+import io
+import zipfile
+from datetime import datetime
+from xml.etree import ElementTree
+
+from webApp import app, db
+from webApp import export
+from webApp.export import Link, csv_stream, xlsx_stream
+from webApp.models import Candidate, User
+
+SHEET = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+HEADER = ["Jméno", "Zpráva", "Životopis"]
+HOSTILE = ["=cmd|' /C calc'!A0", "+1+1", "-2+3", "@SUM(A1:A2)", "\t=1", "\r=1"]
+
+
+def read_csv(chunks):
+    text = b"".join(chunks).decode("utf-8")
+    assert text.startswith("\ufeff")
+    return list(csv.reader(io.StringIO(text[1:]), delimiter=";"))
+
+
+def read_xlsx(chunks):
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert archive.testzip() is None
+    # Every part has to parse, Excel refuses the whole file otherwise
+    parts = {name: ElementTree.fromstring(archive.read(name)) for name in archive.namelist()}
+    return parts, parts["xl/worksheets/sheet1.xml"].iter(SHEET + "row")
+
+
+def cells(row):
+    values = []
+    for cell in row:
+        text = cell.find(f"{SHEET}is/{SHEET}t")
+        values.append(text.text if text is not None else cell.find(SHEET + "v").text)
+    return values
+
+
+def test_csv_quotes_formulas():
+    rows = [[value, "Dobrý den", "-"] for value in HOSTILE] + [["Jan Novák", "=1", Link("https://x/1", "cv.pdf")]]
+    header, *written = read_csv(csv_stream(HEADER, rows))
+    assert header == HEADER
+    assert [row[0] for row in written[:-1]] == ["'" + value for value in HOSTILE]
+    assert written[-1] == ["Jan Novák", "'=1", "https://x/1"]
+
+
+def test_csv_chunks_join_into_one_table(monkeypatch):
+    monkeypatch.setattr(export, "ROWS_PER_CHUNK", 3)
+    rows = [[f"Uchazeč {number}", datetime(2021, 6, 1, 8, 30), number] for number in range(10)]
+    chunks = list(csv_stream(HEADER, rows))
+    assert len(chunks) == 4
+    header, *written = read_csv(chunks)
+    assert written == [[f"Uchazeč {number}", "01.06.2021 08:30", str(number)] for number in range(10)]
+
+
+def test_xlsx_is_well_formed_with_hostile_text(monkeypatch):
+    monkeypatch.setattr(export, "ROWS_PER_CHUNK", 3)
+    # A bare \r is read back as \n by any XML parser, it is left out here
+    hostile = HOSTILE[:-1] + ['<b>"&amp;</b>', "nul\x00 a \x0b vertikální", "x" * 40000]
+    rows = [[value, datetime(2021, 6, 1, 12), Link('https://x/"1"', 'cv "a" <b>.pdf')] for value in hostile]
+    parts, sheet_rows = read_xlsx(xlsx_stream("Uchazeči <&>", HEADER, rows))
+
+    header, *written = sheet_rows
+    assert cells(header) == HEADER
+    assert [cells(row)[0] for row in written] == hostile[:-3] + [
+        '<b>"&amp;</b>', "nul a  vertikální", "x" * export.MAX_CELL]
+    # Candidate text is never a formula, only the link built by the export is
+    formulas = [cell.find(SHEET + "f").text for row in written for cell in row if cell.find(SHEET + "f") is not None]
+    assert formulas == ['HYPERLINK("https://x/""1""","cv ""a"" <b>.pdf")'] * len(hostile)
+    assert [cells(row)[1] for row in written] == ["44348.500000"] * len(hostile)
+    sheet = parts["xl/workbook.xml"].find(f"{SHEET}sheets/{SHEET}sheet")
+    assert sheet.get("name") == "Uchazeči <&>"
+
+
+def test_export_route_escapes_candidate_fields():
+    with app.app_context():
+        user = User(email="export@example.com", name="Export", password="x", active=True)
+        db.session.add(user)
+        db.session.add(Candidate(fullname="=HYPERLINK(\"http://evil\") Exportovaný", email="exp@example.com",
+                                 message="+420 777 123 456", file="cv-export.pdf", filename="cv.pdf",
+                                 status="ready"))
+        db.session.commit()
+        user_id = user.id
+    client = app.test_client()
+    cookie = app.session_interface.get_signing_serializer(app).dumps({"_user_id": str(user_id), "_fresh": True})
+    client.set_cookie("localhost", "session", cookie)
+
+    response = client.get("/admin/candidates/export?q=Exportovaný")
+    assert response.mimetype == "text/csv"
+    header, row = read_csv([response.data])
+    assert row[1:3] == ["'=HYPERLINK(\"http://evil\") Exportovaný", "exp@example.com"]
+    assert row[4] == "'+420 777 123 456"
+
+    response = client.get("/admin/candidates/export?q=Exportovaný&format=xlsx")
+    assert response.headers["Content-Disposition"].endswith(".xlsx")
+    parts, (header, row) = read_xlsx([response.data])
+    assert cells(row)[1] == "=HYPERLINK(\"http://evil\") Exportovaný"
+    assert row[1].get("t") == "inlineStr"
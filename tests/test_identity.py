@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from sqlalchemy import event, text
+
+from webApp import app, db
+from webApp.identity import identity_cache
+from webApp.models import User
+
+
+def logged_in_client(user_id):
+    client = app.test_client()
+    cookie = app.session_interface.get_signing_serializer(app).dumps({"_user_id": str(user_id), "_fresh": True})
+    client.set_cookie("localhost", "session", cookie)
+    return client
+
+
+def new_user(email):
+    with app.app_context():
+        user = User(email=email, name="Node", password="x", active=True)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def deactivate_on_another_node(user_id):
+    # What switch() on another node leaves in the shared database
+    with app.app_context(), db.engine.begin() as connection:
+        connection.execute(text("UPDATE users SET active = :active, revoked_at = :now WHERE id = :id"),
+                           {"active": False, "now": datetime.utcnow(), "id": user_id})
+
+
+def test_deactivation_on_another_node_logs_out_after_the_check_interval(monkeypatch):
+    user_id = new_user("node@example.com")
+    client = logged_in_client(user_id)
+    assert client.get("/admin/settings").status_code == 200
+    deactivate_on_another_node(user_id)
+
+    # Within the interval the snapshot in the session still serves current_user
+    monkeypatch.setattr(identity_cache, "check_interval", 3600)
+    assert client.get("/admin/settings").status_code == 200
+
+    monkeypatch.setattr(identity_cache, "check_interval", 0)
+    response = client.get("/admin/settings")
+    assert response.status_code == 302
+    assert "/admin" in response.location
+
+
+def test_cached_identity_needs_no_query(monkeypatch):
+    client = logged_in_client(new_user("quiet@example.com"))
+    assert client.get("/admin/settings").status_code == 200
+    monkeypatch.setattr(identity_cache, "check_interval", 3600)
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        assert client.get("/admin/settings").status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert not [statement for statement in statements if "FROM users" in statement]
+
+
+def test_invalidate_bumps_the_shared_stamp():
+    with app.test_request_context():
+        user = User(email="stamp@example.com", name="Stamp", password="x", active=True)
+        db.session.add(user)
+        db.session.commit()
+        assert user.revoked_at is None
+        identity_cache.invalidate(user.id)
+        db.session.expire_all()
+        assert User.query.get(user.id).revoked_at is not None
@@ -0,0 +1,50 @@
+import json
+import os
+
+import pytest
+
+from webApp.images import make_variants
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def save(static_root, image_url, mode, color, size=(400, 300)):
+    path = static_root / image_url
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new(mode, size, color).save(path)
+
+
+def files(variants):
+    return [url for source in variants["sources"] for _, url in source["entries"]] + [
+        url for _, url in variants["fallback"]]
+
+
+def test_same_name_with_another_extension_keeps_its_own_variants(tmp_path):
+    save(tmp_path, "images/foo.png", "RGBA", (255, 0, 0, 128))
+    save(tmp_path, "images/foo.jpg", "RGB", (0, 0, 255))
+    _, _, png = make_variants(str(tmp_path), "images/foo.png", (160, 320, 560))
+    width, height, jpg = make_variants(str(tmp_path), "images/foo.jpg", (160, 320, 560))
+    png, jpg = json.loads(png), json.loads(jpg)
+
+    assert (width, height) == (400, 300)
+    assert not set(files(png)) & set(files(jpg))
+    assert [url for _, url in png["fallback"]] == ["images/variants/foo.png-160w.png",
+                                                   "images/variants/foo.png-320w.png",
+                                                   "images/variants/foo.png-400w.png"]
+    assert [url for _, url in jpg["fallback"]][-1] == "images/variants/foo.jpg-400w.jpg"
+    # Both sets are still on disk and show their own picture
+    with Image.open(tmp_path / png["fallback"][0][1]) as variant:
+        assert variant.mode == "RGBA" and variant.size == (160, 120)
+    with Image.open(tmp_path / jpg["fallback"][0][1]) as variant:
+        assert variant.getpixel((0, 0))[2] > 200
+
+
+def test_reuse_skips_variants_newer_than_the_original(tmp_path):
+    save(tmp_path, "images/bar.jpg", "RGB", (0, 128, 0))
+    _, _, variants = make_variants(str(tmp_path), "images/bar.jpg", (160,))
+    target = tmp_path / json.loads(variants)["fallback"][0][1]
+    os.utime(target, (4102444800, 4102444800))
+    make_variants(str(tmp_path), "images/bar.jpg", (160,), reuse=True)
+    assert target.stat().st_mtime == 4102444800
+    make_variants(str(tmp_path), "images/bar.jpg", (160,))
+    assert target.stat().st_mtime < 4102444800
@@ -0,0 +1,64 @@
+import json
+import os
+
+import pytest
+
+from webApp.lang import LocaleStore
+
+TABLE = {"alerts": {"email_sent": {"cs": "Odesláno", "sk": "Odoslané"}},
+         "menu": {"home": {"cs": "Domů"}}, "phone": "+420 777 123 456"}
+
+
+def write(path, table, mtime_ns):
+    path.write_text(json.dumps(table), encoding="utf-8")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / "lang.json"
+    write(path, TABLE, 10**18)
+    return path, LocaleStore(str(path), check_interval=3600)
+
+
+def test_each_language_gets_its_resolved_view(store):
+    path, locales = store
+    assert locales.get("sk") == {"alerts": {"email_sent": "Odoslané"}, "menu": {"home": "Domů"},
+                                 "phone": "+420 777 123 456"}
+    assert locales.get("cs")["alerts"]["email_sent"] == "Odesláno"
+    assert locales.get("de") is locales.get("cs")
+    assert locales.version == 10**18
+
+
+def test_the_file_is_read_again_only_after_it_changed(store, monkeypatch):
+    path, locales = store
+    view = locales.get("cs")
+    write(path, {**TABLE, "phone": "nové"}, 2 * 10**18)
+    # Within the check interval nothing touches the disk
+    assert locales.get("cs") is view
+
+    monkeypatch.setattr(locales, "check_interval", 0)
+    assert locales.get("cs")["phone"] == "nové"
+    assert locales.version == 2 * 10**18
+    view = locales.get("cs")
+    assert locales.get("cs") is view
+
+
+def test_a_broken_file_keeps_the_last_good_table(store, monkeypatch):
+    path, locales = store
+    locales.get("cs")
+    monkeypatch.setattr(locales, "check_interval", 0)
+    path.write_text('{"alerts": ', encoding="utf-8")
+    assert locales.get("cs")["phone"] == "+420 777 123 456"
+    assert locales.raw == json.dumps(TABLE)
+
+
+def test_save_checks_the_json_before_writing(store):
+    path, locales = store
+    with pytest.raises(ValueError):
+        locales.save('{"phone": ')
+    assert json.loads(path.read_text(encoding="utf-8")) == TABLE
+
+    locales.save(json.dumps({**TABLE, "phone": "uloženo"}))
+    assert locales.get("sk")["phone"] == "uloženo"
+    assert sorted(os.listdir(path.parent)) == ["lang.json"]
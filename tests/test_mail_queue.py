@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from webApp import app, db
+from webApp.mail import MailQueue
+from webApp.mailer import Mailer
+from webApp.models import OutboxMessage
+from standins import SMTPStandIn
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    standin = SMTPStandIn().start()
+    mailer = Mailer(standin.host, standin.port, starttls=False, timeout=5)
+    monkeypatch.setattr("webApp.mail.mailer", mailer)
+    with app.app_context():
+        OutboxMessage.query.delete()
+        db.session.commit()
+    yield standin
+    mailer.close()
+    standin.stop()
+
+
+def queue_messages(*recipients):
+    with app.app_context():
+        for recipient in recipients:
+            db.session.add(OutboxMessage(sender="jan@example.com", recipient=recipient,
+                                         subject="Jan Novák má zájem o práci", body="Dobrý den"))
+        db.session.commit()
+
+
+def outbox():
+    with app.app_context():
+        try:
+            return {message.recipient: message for message in OutboxMessage.query}
+        finally:
+            db.session.expunge_all()
+            db.session.remove()
+
+
+def make_due():
+    # Stands in for waiting out the backoff
+    with app.app_context():
+        OutboxMessage.query.filter_by(status="pending").update({"next_attempt": datetime.utcnow()})
+        db.session.commit()
+
+
+def test_claimed_messages_are_not_sent_twice(smtp):
+    queue_messages("hr@example.com")
+    first, second = MailQueue(workers=0), MailQueue(workers=0)
+    with app.app_context():
+        assert [message.recipient for message in first._claim()] == ["hr@example.com"]
+        db.session.remove()
+    # The first worker holds the lease, the second one finds nothing to send
+    assert second.run_pending() == 0
+    assert smtp.received == []
+
+    # The first worker died, once the lease runs out the message is sent by the other one
+    make_due()
+    assert second.run_pending() == 1
+    assert [recipients for _, recipients, _ in smtp.received] == [["hr@example.com"]]
+    message = outbox()["hr@example.com"]
+    assert (message.status, message.attempts) == ("sent", 2)
+
+
+def test_retry_with_backoff_then_permanent_failure(smtp):
+    smtp.replies = {
+        "busy@example.com": ["451 4.3.0 Try again later"],
+        "gone@example.com": ["550 5.1.1 No such user"] * 3,
+    }
+    queue_messages("hr@example.com", "busy@example.com", "gone@example.com")
+    queue = MailQueue(workers=0, max_attempts=3, retry_base=30)
+
+    started = datetime.utcnow()
+    assert queue.run_pending() == 3
+    messages = outbox()
+    assert messages["hr@example.com"].status == "sent"
+    for recipient in ("busy@example.com", "gone@example.com"):
+        message = messages[recipient]
+        assert (message.status, message.attempts) == ("pending", 1)
+        assert "SMTPRecipientsRefused" in message.last_error
+        assert started + timedelta(seconds=29) < message.next_attempt < datetime.utcnow() + timedelta(seconds=31)
+    # Nothing is due until the backoff is over
+    assert queue.run_pending() == 0
+
+    make_due()
+    started = datetime.utcnow()
+    assert queue.run_pending() == 2
+    messages = outbox()
+    assert messages["busy@example.com"].status == "sent"
+    gone = messages["gone@example.com"]
+    assert (gone.status, gone.attempts) == ("pending", 2)
+    assert started + timedelta(seconds=59) < gone.next_attempt < datetime.utcnow() + timedelta(seconds=61)
+
+    make_due()
+    assert queue.run_pending() == 1
+    gone = outbox()["gone@example.com"]
+    assert (gone.status, gone.attempts) == ("failed", 3)
+    assert "550" in gone.last_error
+    make_due()
+    assert queue.run_pending() == 0
+
+    assert sorted(recipients[0] for _, recipients, _ in smtp.received) == ["busy@example.com", "hr@example.com"]
+    # Refused recipients do not cost a new SMTP session
+    assert smtp.sessions == 1
@@ -0,0 +1,38 @@
+from flask import Response
+from werkzeug.exceptions import NotFound
+
+from webApp import app
+from webApp import metrics
+
+
+def scrape(remote_addr="127.0.0.1", **headers):
+    with app.test_request_context("/metrics", environ_base={"REMOTE_ADDR": remote_addr}, headers=headers):
+        try:
+            return metrics.metrics().status_code
+        except NotFound:
+            return 404
+
+
+def test_without_a_token_only_local_scrapers_get_metrics(monkeypatch):
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", None)
+    assert scrape("127.0.0.1") == 200
+    assert scrape("::1") == 200
+    assert scrape("10.0.0.7") == 404
+    # Passed on by nginx on the same host
+    assert scrape("127.0.0.1", **{"X-Forwarded-For": "203.0.113.9"}) == 404
+
+
+def test_with_a_token_every_scraper_has_to_send_it(monkeypatch):
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "s3cret")
+    assert scrape("10.0.0.7", Authorization="Bearer s3cret") == 200
+    assert scrape("10.0.0.7", Authorization="Bearer wrong") == 404
+    assert scrape("127.0.0.1") == 404
+
+
+def test_request_timing_leaves_mail_to_the_queue():
+    with app.test_request_context("/pages/sklady"):
+        metrics.start_request()
+        response = metrics.finish_request(Response("ok"))
+    timing = response.headers["Server-Timing"]
+    assert timing.startswith("app;dur=") and "db;dur=" in timing and "tpl;dur=" in timing
+    assert "mail" not in timing
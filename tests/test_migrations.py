@@ -0,0 +1,23 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+from webApp.migrations import MIGRATIONS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_workers_starting_together_migrate_once(tmp_path):
+    # Every worker upgrades at import, like gunicorn starting several at once
+    database = tmp_path / "career.db"
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}", FILES_DIR=str(tmp_path / "files"),
+               DB_AUTO_UPGRADE="1", PYTHONPATH=ROOT)
+    workers = [subprocess.Popen([sys.executable, "-c", "import webApp"], env=env, cwd=ROOT,
+                                stderr=subprocess.PIPE, text=True) for _ in range(4)]
+    for worker in workers:
+        _, errors = worker.communicate(timeout=120)
+        assert worker.returncode == 0, errors
+    with sqlite3.connect(database) as connection:
+        applied = [name for name, in connection.execute("SELECT name FROM schema_migrations")]
+    assert sorted(applied) == sorted(name for name, _ in MIGRATIONS)
@@ -0,0 +1,61 @@
+from sqlalchemy import event
+
+from webApp import app, db
+from webApp.models import Persona, Section, Video, load_page
+from webApp.pagecache import page_cache
+
+
+def statements_for(path):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        assert app.test_client().get(path).status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return [statement for statement in statements if statement.lstrip().upper().startswith("SELECT")]
+
+
+def add_content(count):
+    with app.app_context():
+        for number in range(count):
+            db.session.add(Section(title_cs=f"Dotaz {number}", title_sk=f"Dotaz {number}", body_cs="<p>a</p>",
+                                   body_sk="<p>a</p>", html_cs="<p>a</p>", html_sk="<p>a</p>",
+                                   context="centrala", image_url=f"images/dotaz-{number}.png"))
+            db.session.add(Section(title_cs=f"Úvod {number}", title_sk=f"Úvod {number}", body_cs="<p>a</p>",
+                                   body_sk="<p>a</p>", html_cs="<p>a</p>", html_sk="<p>a</p>", context="index"))
+            db.session.add(Persona(fullname=f"Personalista {number}", position_cs="HR", position_sk="HR",
+                                   phone="+420 777 123 456", email=f"hr{number}@example.com",
+                                   area="centrala", image_url=f"images/hr-{number}.png"))
+        if Video.query.filter_by(video_context="centrala").first() is None:
+            db.session.add(Video(video_context="centrala", video_url="https://www.youtube.com/embed/x"))
+        db.session.commit()
+
+
+def test_query_count_does_not_grow_with_the_content(monkeypatch):
+    monkeypatch.setitem(app.config, "PAGE_CACHE_ENABLED", False)
+    # Only the render is counted, the cache stamps and Last-Modified stay as they are
+    monkeypatch.setattr(page_cache, "check_interval", 3600)
+    add_content(1)
+    for path in ("/", "/pages/centrala"):
+        statements_for(path)
+    before = {path: len(statements_for(path)) for path in ("/", "/pages/centrala")}
+    add_content(10)
+    after = {path: len(statements_for(path)) for path in ("/", "/pages/centrala")}
+    assert after == before
+
+
+def test_load_page_keeps_the_admin_order():
+    with app.app_context():
+        sections = [Section(title_cs=f"Pořadí {number}", title_sk="x", body_cs="", body_sk="",
+                            context="sklady", position=position) for number, position in enumerate((2, 1, 2))]
+        db.session.add_all(sections)
+        db.session.commit()
+        expected = [sections[1].id, sections[0].id, sections[2].id]
+        loaded = [section.id for section in load_page("sklady").sections if section.title_cs.startswith("Pořadí")]
+        assert loaded == expected
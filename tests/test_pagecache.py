@@ -0,0 +1,77 @@
+import time
+
+from sqlalchemy import event, text
+
+from webApp import app, db
+from webApp.models import CacheStamp
+from webApp.pagecache import ALL_CONTEXTS, PAGE_CONTEXTS, page_cache
+
+
+def other_node_invalidates(context):
+    # What PageCache.invalidate on another node leaves in the shared database
+    with db.engine.begin() as connection:
+        updated = connection.execute(text("UPDATE cache_stamps SET stamp = :stamp WHERE name = :name"),
+                                     {"stamp": time.time_ns(), "name": context}).rowcount
+        if not updated:
+            connection.execute(text("INSERT INTO cache_stamps (name, stamp) VALUES (:name, :stamp)"),
+                               {"stamp": time.time_ns(), "name": context})
+
+
+def test_edit_on_another_node_drops_the_cached_page(monkeypatch):
+    monkeypatch.setattr(page_cache, "check_interval", 0)
+    key = ("mainpage", "sklady", "cs", 0)
+    with app.app_context():
+        page_cache.set(key, "sklady", "<html>old</html>")
+        assert page_cache.get(key, "sklady") == "<html>old</html>"
+
+        other_node_invalidates("prodejny")
+        assert page_cache.get(key, "sklady") == "<html>old</html>"
+
+        other_node_invalidates("sklady")
+        assert page_cache.get(key, "sklady") is None
+
+        page_cache.set(key, "sklady", "<html>new</html>")
+        other_node_invalidates(ALL_CONTEXTS)
+        assert page_cache.get(key, "sklady") is None
+
+
+def test_invalidate_is_visible_to_other_nodes():
+    with app.app_context():
+        page_cache.invalidate("centrala")
+        first = db.session.execute(text("SELECT stamp FROM cache_stamps WHERE name = 'centrala'")).scalar()
+        page_cache.invalidate("centrala")
+        second = db.session.execute(text("SELECT stamp FROM cache_stamps WHERE name = 'centrala'")).scalar()
+    assert first and second > first
+
+
+def test_unknown_pages_are_a_404_and_leave_no_trace():
+    client = app.test_client()
+    for context in ("nope", "index", "x" * 200):
+        assert client.get(f"/pages/{context}").status_code == 404
+    assert client.get("/pages/sklady").status_code == 200
+    with app.app_context():
+        page_cache.invalidate("nope")
+        assert set(page_cache._modified) <= set(PAGE_CONTEXTS)
+        assert set(page_cache.stamps(fresh=True)) <= set(PAGE_CONTEXTS + (ALL_CONTEXTS,))
+        assert CacheStamp.query.get("nope") is None
+
+
+def test_stamps_are_loaded_outside_the_entry_lock(monkeypatch):
+    monkeypatch.setattr(page_cache, "check_interval", 0)
+    held = []
+
+    def record(conn, cursor, statement, *args):
+        if "cache_stamps" in statement:
+            held.append(page_cache._lock.locked())
+
+    with app.app_context():
+        engine = db.engine
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            key = ("mainpage", "prodejny", "cs", 0)
+            page_cache.set(key, "prodejny", "<html></html>")
+            page_cache.get(key, "prodejny")
+            page_cache.last_modified("prodejny", lambda context: None)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+    assert held and not any(held)
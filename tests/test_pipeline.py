@@ -0,0 +1,133 @@
+import io
+import zipfile
+import zlib
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from webApp import app, db, file_storage
+from webApp.models import Candidate, OutboxMessage, Setting
+from webApp.pipeline import (DOCX, PDF, CVPipeline, ClamdScanner, Rejected, default_stages, extract_text,
+                             run_stages, sniff_type, validate_structure)
+from webApp.storage import store_upload
+from standins import ClamdStandIn
+
+TEXT = zlib.compress(b"BT /F1 12 Tf (Jan Nov\\341k) Tj [(Sklad) -250 (n\\355k)] TJ ET")
+CV = (b"%PDF-1.4\n1 0 obj << /Type /Catalog >> endobj\n"
+      b"2 0 obj << /Length " + str(len(TEXT)).encode() + b" /Filter /FlateDecode >>\nstream\n" + TEXT +
+      b"\nendstream\nendobj\ntrailer << /Root 1 0 R >>\n%%EOF\n")
+EICAR = CV.replace(b"%%EOF", b"EICAR-STANDARD-ANTIVIRUS-TEST-FILE\n%%EOF")
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def docx(tmp_path, name, **extra):
+    path = tmp_path / name
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("word/document.xml", (
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+            '<w:p><w:r><w:t>Jan Novák</w:t></w:r></w:p><w:p><w:r><w:t>Skladník</w:t></w:r></w:p>'
+            '</w:body></w:document>'))
+        for member, data in extra.items():
+            archive.writestr(member, data)
+    return str(path)
+
+
+def test_stages_accept_a_pdf_and_read_its_text(tmp_path):
+    result = run_stages(write(tmp_path, "cv.pdf", CV), default_stages())
+    assert result == {"type": PDF, "text": "Jan Novák Skladník"}
+    result = run_stages(docx(tmp_path, "cv.docx"), default_stages())
+    assert result == {"type": DOCX, "text": "Jan Novák\nSkladník"}
+
+
+def test_stages_reject_what_must_not_reach_hr(tmp_path):
+    for path, reason in (
+        (write(tmp_path, "cv.exe", b"MZ\x90\x00"), "Nepodporovaný formát souboru."),
+        (write(tmp_path, "cut.pdf", CV[:-20]), "Neplatný nebo neúplný PDF soubor."),
+        (write(tmp_path, "broken.docx", b"PK\x03\x04broken"), "Poškozený ZIP archiv."),
+        (docx(tmp_path, "macro.docx", **{"word/vbaProject.bin": b"\x00"}), "Dokument obsahuje makra."),
+    ):
+        with pytest.raises(Rejected) as rejected:
+            run_stages(path, [sniff_type, validate_structure, extract_text])
+        assert rejected.value.reason == reason
+
+
+def test_clamd_scanner(tmp_path):
+    clamd = ClamdStandIn().start()
+    try:
+        scanner = ClamdScanner(clamd.address, timeout=5)
+        scanner(write(tmp_path, "cv.pdf", CV), {})
+        with pytest.raises(Rejected) as rejected:
+            scanner(write(tmp_path, "virus.pdf", EICAR), {})
+        assert rejected.value.infected
+        assert rejected.value.reason == "Antivirus: Eicar-Test-Signature FOUND"
+        assert clamd.scanned == [CV, EICAR]
+    finally:
+        clamd.stop()
+    with pytest.raises(OSError):
+        ClamdScanner(clamd.address, timeout=1)(write(tmp_path, "cv.pdf", CV), {})
+
+
+@pytest.fixture
+def applications():
+    with app.app_context():
+        # Applications left behind by other tests are not checked here
+        Candidate.query.filter_by(status="pending").update({"status": "review"})
+        OutboxMessage.query.delete()
+        if Setting.query.filter_by(name="email").first() is None:
+            db.session.add(Setting(name="email", value="hr@example.com"))
+        db.session.commit()
+
+    def add(data, fullname):
+        key, _ = store_upload(FileStorage(stream=io.BytesIO(data), filename="cv.pdf"), file_storage)
+        with app.app_context():
+            candidate = Candidate(fullname=fullname, email="pipeline@example.com", message="Dobrý den",
+                                  file=key, filename="cv.pdf", status="pending")
+            db.session.add(candidate)
+            db.session.commit()
+            return candidate.id, key
+    return add
+
+
+def outcome(candidate_id):
+    with app.app_context():
+        candidate = Candidate.query.get(candidate_id)
+        message = OutboxMessage.query.filter_by(subject=f"{candidate.fullname} má zájem o práci").first()
+        return candidate.status, candidate.status_note, message and message.attachment_key
+
+
+def test_pipeline_mails_clean_cvs_and_holds_back_infected_ones(applications):
+    clamd = ClamdStandIn().start()
+    try:
+        clean_id, clean_key = applications(CV, "Čistý Jan")
+        infected_id, infected_key = applications(EICAR, "Nakažený Jan")
+        assert CVPipeline(default_stages(clamd.address), workers=0).run_pending() == 2
+    finally:
+        clamd.stop()
+    assert outcome(clean_id) == ("ready", None, clean_key)
+    assert outcome(infected_id) == ("rejected", "Antivirus: Eicar-Test-Signature FOUND", None)
+    assert not file_storage.exists(infected_key)
+    with app.app_context():
+        assert Candidate.query.get(clean_id).file_text == "Jan Novák Skladník"
+
+
+def test_crashing_checks_are_retried_then_given_up(applications):
+    def crash(path, result):
+        raise OSError("scanner down")
+
+    candidate_id, key = applications(CV + b"crash", "Nezkontrolovaný Jan")
+    pipeline = CVPipeline([crash], workers=0, max_attempts=2)
+    assert pipeline.run_pending() == 1
+    assert outcome(candidate_id) == ("pending", None, None)
+    # Not before the lease runs out
+    assert pipeline.run_pending() == 0
+    with app.app_context():
+        Candidate.query.filter_by(id=candidate_id).update({"lease_until": None})
+        db.session.commit()
+    assert pipeline.run_pending() == 1
+    assert outcome(candidate_id) == ("unchecked", "Kontrola selhala 2×.", None)
+    assert file_storage.exists(key)
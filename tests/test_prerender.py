@@ -0,0 +1,53 @@
+import os
+
+from webApp import app, db
+from webApp import prerender
+from webApp.models import Section
+from webApp.prerender import StaticExporter
+
+
+def add_section(**fields):
+    with app.app_context():
+        section = Section(title_cs="Bez obrázku", title_sk="Bez obrázka", body_cs="<p>text</p>",
+                          body_sk="<p>text</p>", context="sklady", **fields)
+        db.session.add(section)
+        db.session.commit()
+        return section.id
+
+
+def test_section_without_an_image_renders():
+    add_section(image_url=None)
+    assert app.test_client().get("/pages/sklady").status_code == 200
+    assert "Bez obrázku" in prerender.render_page("sklady", "cs")
+
+
+def test_export_leaves_the_admin_session_alone(tmp_path):
+    section_id = add_section(image_url=None)
+    exporter = StaticExporter(str(tmp_path))
+    with app.test_request_context():
+        section = Section.query.get(section_id)
+        session = db.session()
+        exporter.export("sklady")
+        exporter.join()
+        assert db.session() is session
+        assert section in db.session
+        assert section.id == section_id
+    assert os.path.exists(prerender.page_path(str(tmp_path), "cs", "sklady"))
+    assert exporter.failed == {}
+
+
+def test_failed_export_is_kept_until_it_succeeds(tmp_path, monkeypatch):
+    exporter = StaticExporter(str(tmp_path))
+
+    def broken(root, contexts=None):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(prerender, "export_pages", broken)
+    exporter.export("centrala")
+    exporter.join()
+    assert exporter.failed == {"centrala": "OSError: disk full"}
+
+    monkeypatch.undo()
+    exporter.export("centrala")
+    exporter.join()
+    assert exporter.failed == {}
@@ -0,0 +1,135 @@
+import io
+import types
+
+import pytest
+
+from webApp import app
+from webApp import recaptcha
+from webApp.models import Candidate
+from webApp.recaptcha import (REJECTED, UNAVAILABLE, VERIFIED, CircuitBreaker, RecaptchaClient,
+                              ReplayCache, StandInVerifier)
+from standins import SiteverifyStandIn
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(recaptcha, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def siteverify():
+    standin = SiteverifyStandIn().start()
+    yield standin
+    standin.stop()
+
+
+def test_breaker_opens_then_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failures=3, cooldown=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    # Open
+    assert not breaker.allow()
+    clock[0] += 29
+    assert not breaker.allow()
+
+    # Half-open: one trial, everyone else waits for its outcome
+    clock[0] += 1
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_success_resets_the_count(clock):
+    breaker = CircuitBreaker(failures=2, cooldown=30)
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    assert breaker.allow()
+
+
+def test_client_stops_calling_siteverify_while_open(clock, siteverify):
+    client = RecaptchaClient(siteverify.url, "secret", timeout=2,
+                             breaker=CircuitBreaker(failures=2, cooldown=30))
+    siteverify.answers = [503, 500]
+    assert client.verify("a", "10.0.0.1") == UNAVAILABLE
+    assert client.verify("b", "10.0.0.1") == UNAVAILABLE
+    assert client.verify("c", "10.0.0.1") == UNAVAILABLE
+    assert [form["response"] for form in siteverify.requests] == ["a", "b"]
+
+    clock[0] += 30
+    siteverify.answers = [503]
+    assert client.verify("d", "10.0.0.1") == UNAVAILABLE
+    assert client.verify("e", "10.0.0.1") == UNAVAILABLE
+    assert len(siteverify.requests) == 3
+
+    clock[0] += 30
+    assert client.verify("f", "10.0.0.1") == VERIFIED
+    assert client.verify("g", "10.0.0.1") == VERIFIED
+    assert siteverify.requests[-1] == {"secret": "secret", "response": "g", "remoteip": "10.0.0.1"}
+
+
+def test_unreachable_siteverify_is_unavailable(clock):
+    client = RecaptchaClient("http://127.0.0.1:9/siteverify", "secret", timeout=1)
+    assert client.verify("a", "10.0.0.1") == UNAVAILABLE
+
+
+def test_replay_cache_accepts_a_token_once(clock):
+    cache = ReplayCache(ttl=300, max_entries=3)
+    assert not cache.seen("token")
+    assert cache.seen("token")
+    clock[0] += 301
+    assert not cache.seen("token")
+    for token in ("a", "b", "c"):
+        cache.seen(token)
+    # The oldest entry makes room
+    assert not cache.seen("token")
+
+
+def apply(client, token, surname):
+    return client.post("/pages/centrala", content_type="multipart/form-data", data={
+        "name": "Jan", "surname": surname, "email": "captcha@example.com", "message": "Dobrý den",
+        "terms": "y", "g-recaptcha-response": token, "file": (io.BytesIO(b"%PDF-1.4 cv"), "cv.pdf")})
+
+
+def statuses(surname):
+    with app.app_context():
+        return [candidate.status for candidate in Candidate.query.filter_by(fullname=f"{surname} Jan")]
+
+
+@pytest.fixture
+def form(monkeypatch):
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", False)
+    monkeypatch.setitem(app.config, "RECAPTCHA_VERIFIER", "pass")
+    monkeypatch.setattr(recaptcha, "replay_cache", ReplayCache())
+    return app.test_client()
+
+
+def test_replayed_token_is_rejected(form, monkeypatch):
+    monkeypatch.setattr(recaptcha, "verifier", StandInVerifier(VERIFIED))
+    assert apply(form, "token-1", "Replay").status_code == 302
+    response = apply(form, "token-1", "Replay")
+    assert response.status_code == 200
+    assert "nejste robot" in response.get_data(as_text=True)
+    assert statuses("Replay") == ["pending"]
+
+
+def test_rejected_and_unavailable_verification(form, monkeypatch):
+    monkeypatch.setattr(recaptcha, "verifier", StandInVerifier(REJECTED))
+    assert apply(form, "token-2", "Robot").status_code == 200
+    assert statuses("Robot") == []
+
+    # Held for review instead of turning applicants away
+    monkeypatch.setattr(recaptcha, "verifier", StandInVerifier(UNAVAILABLE))
+    assert apply(form, "token-3", "Degraded").status_code == 302
+    assert statuses("Degraded") == ["review"]
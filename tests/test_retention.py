@@ -0,0 +1,44 @@
+import io
+import os
+import time
+
+from webApp import app, db
+from webApp.models import Candidate
+from webApp.retention import sweep_files
+from webApp.storage import LocalStorage, store_upload
+
+
+class Upload:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.stream = io.BytesIO(data)
+
+
+def aged(storage, key):
+    old = time.time() - 7200
+    os.utime(storage.path(key), (old, old))
+
+
+def test_cv_uploaded_again_during_the_sweep_is_kept(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    with app.app_context():
+        duplicate, _ = store_upload(Upload("cv.pdf", b"same CV"), storage)
+        orphan, _ = store_upload(Upload("old.pdf", b"nobody's CV"), storage)
+        aged(storage, duplicate)
+        aged(storage, orphan)
+
+        listing = storage.list
+
+        def list_then_upload(prefix=""):
+            # The sweep has its snapshot, then the same CV is submitted again
+            files = list(listing(prefix))
+            key, filename = store_upload(Upload("cv.pdf", b"same CV"), storage)
+            db.session.add(Candidate(fullname="Nový Uchazeč", email="novy@example.com", message="Dobrý den",
+                                     file=key, filename=filename))
+            db.session.commit()
+            return files
+
+        storage.list = list_then_upload
+        assert sweep_files(storage, grace=3600)[0] == 1
+        assert storage.exists(duplicate)
+        assert not storage.exists(orphan)
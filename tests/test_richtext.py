@@ -0,0 +1,81 @@
+from webApp import app, db
+from webApp.models import Section
+from webApp.richtext import clean_html, process_section, text_html
+
+SCRIPT_URLS = [
+    "javascript:alert(1)",
+    "JaVaScRiPt:alert(1)",
+    "java\tscript:alert(1)",
+    "&#106;avascript:alert(1)",
+    " &#x6A;avascript:alert(1)",
+    "javascript&colon;alert(1)",
+    "\x01javascript:alert(1)",
+    "vbscript:msgbox(1)",
+    "data:text/html,<script>alert(1)</script>",
+]
+
+
+def test_script_urls_are_dropped():
+    for url in SCRIPT_URLS:
+        assert clean_html(f'<a href="{url}">odkaz</a>') == "<a>odkaz</a>", url
+        assert clean_html(f'<img src="{url}" alt="x">') == '<img alt="x">', url
+    assert clean_html('<a href="/pages/sklady">x</a><a href="mailto:hr@example.com">y</a>') == (
+        '<a href="/pages/sklady">x</a><a href="mailto:hr@example.com">y</a>')
+
+
+def test_event_handlers_and_styles_are_dropped():
+    assert clean_html('<img src="/a.png" onerror="alert(1)" ONLOAD=alert(1)>') == '<img src="/a.png">'
+    assert clean_html('<p onclick="alert(1)" style="text-align: Center;">a</p>') == (
+        '<p style="text-align:center">a</p>')
+    assert clean_html('<p style="text-align:left;background:url(javascript:alert(1))">a</p>') == "<p>a</p>"
+    assert clean_html('<span class="x" id="y" srcset="javascript:1">a</span>') == "<span>a</span>"
+
+
+def test_attribute_values_cannot_break_out():
+    assert clean_html("""<a href="https://x" title='"><script>alert(1)</script>' target="_blank">x</a>""") == (
+        '<a href="https://x" title="&quot;&gt;&lt;script&gt;alert(1)&lt;/script&gt;" target="_blank"'
+        ' rel="noopener noreferrer">x</a>')
+    assert clean_html('<img src="https://x/a.png" width="10" height="1 onerror=alert(1)">') == (
+        '<img src="https://x/a.png" width="10">')
+
+
+def test_dropped_containers_take_their_content_along():
+    for source in (
+        "<script><script></script>alert(1)</script>",
+        "<textarea><img src=x onerror=alert(1)></textarea>",
+        "<noscript><p title=\"</noscript><img src=x onerror=alert(1)>\">",
+        "<svg><style><img src=x onerror=alert(1)></style></svg>",
+        "<iframe src=\"javascript:alert(1)\"></iframe>",
+        "<!--<img src=x onerror=alert(1)>-->",
+        "<![CDATA[<script>alert(1)</script>]]>",
+    ):
+        cleaned = clean_html(source)
+        assert "<img" not in cleaned and "<script" not in cleaned, source
+    assert clean_html("<math><mtext><table><mglyph><style><img src=x onerror=alert(1)>") == "<table></table>"
+
+
+def test_nesting_is_balanced():
+    assert clean_html("<b><i>x</b>y</i>") == "<b><i>x</i></b>y"
+    assert clean_html("<ul><li>a</li><li>b") == "<ul><li>a</li><li>b</li></ul>"
+    assert clean_html("<div><p>a</div></p>b") == "<p>a</p>b"
+    assert clean_html("&lt;script&gt; <em>a</em>") == "&lt;script&gt; <em>a</em>"
+
+
+def test_candidate_text_is_escaped():
+    assert text_html("<b>Dobrý den</b>\r\n<script>\n\nS pozdravem") == (
+        "<p>&lt;b&gt;Dobrý den&lt;/b&gt;<br>&lt;script&gt;</p><p>S pozdravem</p>")
+
+
+def test_sanitized_body_is_what_the_page_shows():
+    with app.app_context():
+        section = Section(title_cs="Bezpečný text", title_sk="Bezpečný text", context="prodejny",
+                          body_cs='<p onmouseover="alert(1)">Ahoj <a href="javascript:alert(1)">sem</a></p>',
+                          body_sk="<script>alert(1)</script><p>Ahoj</p>")
+        process_section(section, images=False)
+        db.session.add(section)
+        db.session.commit()
+        assert section.html_cs == "<p>Ahoj <a>sem</a></p>"
+        assert section.html_sk == "<p>Ahoj</p>"
+    page = app.test_client().get("/pages/prodejny").get_data(as_text=True)
+    assert "<p>Ahoj <a>sem</a></p>" in page
+    assert "javascript:alert" not in page and "onmouseover" not in page
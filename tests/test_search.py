@@ -0,0 +1,38 @@
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy.dialects import postgresql
+
+from webApp import app, db
+from webApp.models import Candidate, User
+
+
+def test_postgresql_search_matches_the_gin_index():
+    # The expression has to be spelled like ix_candidates_search_cv in migrations.candidate_cv_check
+    with app.app_context(), mock.patch.object(type(db.engine.dialect), "name", "postgresql"):
+        clause = Candidate.search_clause("jan novak")
+    sql = str(clause.compile(dialect=postgresql.dialect()))
+    document = sql.split(" @@ ")[0].replace("(", "").replace(")", "")
+    assert document == ("to_tsvector'simple', candidates.fullname || ' ' || candidates.email || ' ' "
+                        "|| candidates.message || ' ' || coalescecandidates.file_text, ''")
+    assert "plainto_tsquery('simple', " in sql
+
+
+def test_message_of_a_row_without_html_is_escaped_on_the_fly():
+    with app.app_context():
+        user = User(email="message@example.com", name="Message", password="x", active=True)
+        db.session.add(user)
+        # Like the benchmark seed and other bulk inserts, message_html stays empty
+        db.session.bulk_insert_mappings(Candidate, [{
+            "created": datetime.utcnow(), "fullname": "Hromadný Jan", "email": "seed@example.com",
+            "message": "<script>alert(1)</script>\n\nDobrý den", "file": "cv-seed.pdf", "status": "ready"}])
+        db.session.commit()
+        user_id = user.id
+        candidate_id = Candidate.query.filter_by(email="seed@example.com").one().id
+    client = app.test_client()
+    cookie = app.session_interface.get_signing_serializer(app).dumps({"_user_id": str(user_id), "_fresh": True})
+    client.set_cookie("localhost", "session", cookie)
+
+    response = client.get(f"/admin/candidate-message/{candidate_id}")
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == "<p>&lt;script&gt;alert(1)&lt;/script&gt;</p><p>Dobrý den</p>"
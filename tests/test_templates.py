@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+from webApp import app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMPILE = """
+from webApp import app
+result = app.test_cli_runner().invoke(args=["compile-templates"])
+assert result.exit_code == 0, result.output
+print(result.output)
+"""
+# A worker started after the deploy must not compile anything
+RENDER = """
+import jinja2
+from webApp import app
+
+def compile(*args, **kwargs):
+    raise AssertionError("template compiled at runtime")
+
+jinja2.Environment.compile = compile
+for path in ("/", "/pages/centrala", "/admin"):
+    assert app.test_client().get(path).status_code == 200, path
+"""
+
+
+def test_compile_templates_needs_the_cache():
+    result = app.test_cli_runner().invoke(args=["compile-templates"])
+    assert result.exit_code != 0
+    assert "JINJA_CACHE_DIR is empty" in result.output
+
+
+def test_workers_load_templates_compiled_at_deploy(tmp_path):
+    cache = tmp_path / "jinja-cache"
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'career.db'}", FILES_DIR=str(tmp_path / "files"),
+               JINJA_CACHE_DIR=str(cache), PYTHONPATH=ROOT)
+
+    def run(script):
+        process = subprocess.run([sys.executable, "-c", script], env=env, cwd=ROOT,
+                                 capture_output=True, text=True, timeout=120)
+        assert process.returncode == 0, process.stderr
+        return process.stdout
+
+    assert "Compiled" in run(COMPILE)
+    templates = app.jinja_env.list_templates(extensions=["html", "xml", "txt"])
+    assert len(os.listdir(cache)) == len(templates)
+    run(RENDER)
@@ -0,0 +1,71 @@
+import hashlib
+import io
+import os
+
+from werkzeug.datastructures import FileStorage
+
+from webApp import app, db, file_storage
+from webApp import storage as storage_module
+from webApp.models import Candidate
+from webApp.storage import LocalStorage, store_upload
+
+
+class ChunkedStream(io.BytesIO):
+    # Records the size of every read, an upload must never be read whole
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return super().read(size)
+
+
+def upload(data, filename="Životopis Jan.PDF"):
+    return FileStorage(stream=ChunkedStream(data), filename=filename)
+
+
+def test_uploads_are_hashed_in_chunks_and_stored_by_content(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    data = os.urandom(3 * storage_module.CHUNK_SIZE + 5)
+    file = upload(data)
+    key, filename = store_upload(file, storage)
+
+    digest = hashlib.sha256(data).hexdigest()
+    assert key == f"{digest[:2]}/{digest[2:4]}/{digest}.pdf"
+    assert filename == "Zivotopis_Jan.PDF"
+    assert set(file.stream.reads) == {storage_module.CHUNK_SIZE}
+    with storage.open(key) as stored:
+        assert stored.read() == data
+    # Nothing but the stored file is left behind
+    assert [key for key, _, _ in storage.list()] == [key]
+
+
+def test_the_same_cv_is_stored_once(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    first, _ = store_upload(upload(b"%PDF-1.4 stejny"), storage)
+    os.utime(storage.path(first), (1, 1))
+    second, filename = store_upload(upload(b"%PDF-1.4 stejny", "jiny.pdf"), storage)
+    assert (second, filename) == (first, "jiny.pdf")
+    # Storing it again counts as a fresh use for the retention sweep
+    assert storage.stat(first)[1] > 1
+    assert len(list(storage.list())) == 1
+
+
+def test_two_applications_share_one_file(monkeypatch):
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", False)
+    # Testing mode without RECAPTCHA_VERIFIER skips the reCAPTCHA check
+    monkeypatch.setattr(app, "testing", True)
+    client = app.test_client()
+    data = b"%PDF-1.4 sdileny zivotopis"
+    for name in ("První", "Druhý"):
+        response = client.post("/pages/sklady", content_type="multipart/form-data", data={
+            "name": name, "surname": "Sdílený", "email": "shared@example.com", "message": "Dobrý den",
+            "terms": "y", "file": (io.BytesIO(data), "cv.pdf")})
+        assert response.status_code == 302
+    with app.app_context():
+        keys = {candidate.file for candidate in Candidate.query.filter_by(email="shared@example.com")}
+        db.session.remove()
+    digest = hashlib.sha256(data).hexdigest()
+    assert keys == {f"{digest[:2]}/{digest[2:4]}/{digest}.pdf"}
+    assert file_storage.exists(keys.pop())
@@ -5,10 +5,24 @@ from flask_bootstrap import Bootstrap
 from flask_ckeditor import CKEditor
 from flask_login import LoginManager
 from flask_sqlalchemy import SQLAlchemy
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from webApp.assets import StaticAssets
+from webApp.database import database_uri, engine_options
+from webApp.lang import LocaleStore
+from webApp.storage import check_separate, make_storage
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY")
+# Compiled templates are kept on disk and shared by all workers, fill the
+# cache at deploy time with `flask compile-templates`. Empty disables it.
+app.config['JINJA_CACHE_DIR'] = os.environ.get("JINJA_CACHE_DIR", os.path.join(app.instance_path, "jinja-cache"))
+if app.config['JINJA_CACHE_DIR']:
+    os.makedirs(app.config['JINJA_CACHE_DIR'], exist_ok=True)
+    app.jinja_options = {**app.jinja_options,
+                         "bytecode_cache": FileSystemBytecodeCache(app.config['JINJA_CACHE_DIR'])}
 ckeditor = CKEditor(app)
 Bootstrap(app)
 
@@ -16,17 +30,135 @@ Bootstrap(app)
 app.config['RECAPTCHA_USE_SSL'] = False
 app.config['RECAPTCHA_PUBLIC_KEY'] = '6LdWtgwdAAAAAHTJUO2uRAT3vXzibvojmT--lgwz'
 app.config['RECAPTCHA_PRIVATE_KEY'] = os.environ.get("RECAPTCHA_PRIVATE_KEY")
+# Verification uses pooled connections with a timeout, answers are refused
+# for RECAPTCHA_COOLDOWN seconds after RECAPTCHA_FAILURES failures in a row and
+# applications are then held for review. RECAPTCHA_VERIFIER "pass", "fail" or
+# "down", optionally with a delay in ms like "pass:50", is a local stand-in.
+app.config['RECAPTCHA_VERIFY_URL'] = os.environ.get("RECAPTCHA_VERIFY_URL", "https://www.google.com/recaptcha/api/siteverify")
+app.config['RECAPTCHA_TIMEOUT'] = float(os.environ.get("RECAPTCHA_TIMEOUT", 3))
+app.config['RECAPTCHA_POOL_SIZE'] = int(os.environ.get("RECAPTCHA_POOL_SIZE", 4))
+app.config['RECAPTCHA_FAILURES'] = int(os.environ.get("RECAPTCHA_FAILURES", 3))
+app.config['RECAPTCHA_COOLDOWN'] = int(os.environ.get("RECAPTCHA_COOLDOWN", 30))
+app.config['RECAPTCHA_VERIFIER'] = os.environ.get("RECAPTCHA_VERIFIER", "")
 
-# Initialize database
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///career.db'
-# app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///career'
+# Initialize database, e.g. DATABASE_URL=postgresql:///career for production
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+# Seconds a logged-in user is served from the session without a database lookup
+app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get("IDENTITY_CACHE_TTL", 300))
+# Seconds until an account change made on another node or worker logs the user out
+app.config['IDENTITY_CHECK_INTERVAL'] = float(os.environ.get("IDENTITY_CHECK_INTERVAL", 5))
+
+# Password hashing runs in a bounded process pool, stored hashes are upgraded on login
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:260000")
+app.config['PASSWORD_SALT_LENGTH'] = int(os.environ.get("PASSWORD_SALT_LENGTH", 16))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get("PASSWORD_HASH_QUEUE", 8))
+app.config['LOGIN_IP_ATTEMPTS'] = int(os.environ.get("LOGIN_IP_ATTEMPTS", 20))
+app.config['LOGIN_ACCOUNT_FAILURES'] = int(os.environ.get("LOGIN_ACCOUNT_FAILURES", 5))
+
+# Reverse proxies in front of the app, e.g. 1 behind nginx. Their X-Forwarded-*
+# headers give the client address the login throttle and reCAPTCHA see.
+# Keep 0 when clients connect directly, the headers could be forged then.
+app.config['TRUSTED_PROXIES'] = int(os.environ.get("TRUSTED_PROXIES", 0))
+if app.config['TRUSTED_PROXIES']:
+    proxies = app.config['TRUSTED_PROXIES']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+app.config['LOGIN_WINDOW'] = int(os.environ.get("LOGIN_WINDOW", 300))
 
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 25))
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") == "1"
 SMTP_USER = os.environ.get("SMTP_USER")
 SMTP_PASS = os.environ.get("SMTP_PASS")
+app.config['SMTP_POOL_SIZE'] = int(os.environ.get("SMTP_POOL_SIZE", 2))
+app.config['SMTP_IDLE_TIMEOUT'] = int(os.environ.get("SMTP_IDLE_TIMEOUT", 60))
+
+# Outgoing applications are delivered by background workers from the outbox table
+app.config['MAIL_QUEUE_WORKERS'] = int(os.environ.get("MAIL_QUEUE_WORKERS", 2))
+app.config['MAIL_MAX_ATTEMPTS'] = int(os.environ.get("MAIL_MAX_ATTEMPTS", 6))
+app.config['MAIL_RETRY_BASE'] = int(os.environ.get("MAIL_RETRY_BASE", 30))
+app.config['MAIL_BATCH_SIZE'] = int(os.environ.get("MAIL_BATCH_SIZE", 10))
+
+# Language table is parsed once per process and reloaded when lang.json changes
+locales = LocaleStore(os.path.join(app.static_folder, "lang.json"))
+
+# Uploaded CVs are stored content-addressed in this directory
+app.config['FILES_DIR'] = os.environ.get("FILES_DIR", os.path.join(app.root_path, "files"))
+# Hand CV downloads to the front server: "" (Flask streams), "x-sendfile" or "x-accel"
+app.config['FILES_SENDFILE'] = os.environ.get("FILES_SENDFILE", "")
+app.config['FILES_ACCEL_PREFIX'] = os.environ.get("FILES_ACCEL_PREFIX", "/protected-files/")
+app.config['USE_X_SENDFILE'] = app.config['FILES_SENDFILE'] == "x-sendfile"
+# CVs and uploaded images stay on this node by default (FILES_DIR, static/images).
+# With several nodes set "s3://bucket/prefix" for an S3-compatible service:
+# CV downloads become presigned redirects valid for STORAGE_URL_TTL seconds and
+# images are linked through IMAGES_PUBLIC_URL. `flask migrate-files` copies
+# the existing local files over.
+app.config['FILES_STORAGE'] = os.environ.get("FILES_STORAGE", "")
+app.config['IMAGES_STORAGE'] = os.environ.get("IMAGES_STORAGE", "")
+app.config['IMAGES_PUBLIC_URL'] = os.environ.get("IMAGES_PUBLIC_URL")
+app.config['S3_ENDPOINT'] = os.environ.get("S3_ENDPOINT", "https://s3.amazonaws.com")
+app.config['S3_REGION'] = os.environ.get("S3_REGION", "us-east-1")
+app.config['S3_ACCESS_KEY'] = os.environ.get("S3_ACCESS_KEY")
+app.config['S3_SECRET_KEY'] = os.environ.get("S3_SECRET_KEY")
+app.config['STORAGE_URL_TTL'] = int(os.environ.get("STORAGE_URL_TTL", 300))
+file_storage = make_storage(app.config['FILES_STORAGE'], app.config['FILES_DIR'], app.config)
+image_storage = make_storage(app.config['IMAGES_STORAGE'], app.static_folder, app.config,
+                             public_url=app.config['IMAGES_PUBLIC_URL'])
+check_separate(file_storage, image_storage)
+# New CVs are sniffed, validated, optionally virus scanned and indexed in a
+# process pool before they are mailed. CV_SCAN_SOCKET is a clamd unix socket
+# path or host:port, scanning is skipped when it is empty. A CV whose check
+# keeps failing is mailed without it after CV_CHECK_ATTEMPTS tries.
+app.config['CV_CHECK_WORKERS'] = int(os.environ.get("CV_CHECK_WORKERS", os.cpu_count() or 1))
+app.config['CV_CHECK_ATTEMPTS'] = int(os.environ.get("CV_CHECK_ATTEMPTS", 5))
+app.config['CV_SCAN_SOCKET'] = os.environ.get("CV_SCAN_SOCKET", "")
+# Applications older than RETENTION_DAYS are purged (0 keeps them forever) and
+# stored files nobody refers to are removed, by `flask retention` or every
+# RETENTION_INTERVAL seconds in the background (0 leaves it to cron)
+app.config['RETENTION_DAYS'] = int(os.environ.get("RETENTION_DAYS", 0))
+app.config['RETENTION_INTERVAL'] = int(os.environ.get("RETENTION_INTERVAL", 24 * 3600))
+app.config['RETENTION_BATCH'] = int(os.environ.get("RETENTION_BATCH", 500))
+app.config['RETENTION_GRACE'] = int(os.environ.get("RETENTION_GRACE", 3600))
+
+# Fingerprinted static files, built with `flask build-assets` at deploy time
+static_assets = StaticAssets(app)
+
+# Rendered public pages are cached for anonymous visitors
+app.config['PAGE_CACHE_ENABLED'] = os.environ.get("PAGE_CACHE_ENABLED", "1") == "1"
+app.config['PAGE_CACHE_SIZE'] = int(os.environ.get("PAGE_CACHE_SIZE", 64))
+
+# Public pages are also written to STATIC_EXPORT_DIR by `flask prerender` and
+# after every admin edit, for the front server to serve them directly.
+# Logged-in administrators get the STATIC_EXPORT_COOKIE and bypass them.
+# Edits made on other nodes are picked up every STATIC_EXPORT_POLL seconds.
+app.config['STATIC_EXPORT_DIR'] = os.environ.get("STATIC_EXPORT_DIR", "")
+app.config['STATIC_EXPORT_COOKIE'] = os.environ.get("STATIC_EXPORT_COOKIE", "live")
+app.config['STATIC_EXPORT_POLL'] = int(os.environ.get("STATIC_EXPORT_POLL", 5))
+
+# Dynamic responses are compressed here unless the front server already does it
+app.config['COMPRESS_ENABLED'] = os.environ.get("COMPRESS_ENABLED", "1") == "1"
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 5))
+
+# Opt-in request timing, Server-Timing headers and a Prometheus /metrics endpoint.
+# /metrics is a 404 for everyone but scrapers on this host, or any scraper
+# sending "Authorization: Bearer <METRICS_TOKEN>" when a token is set.
+app.config['METRICS_ENABLED'] = os.environ.get("METRICS_ENABLED", "0") == "1"
+app.config['METRICS_TOKEN'] = os.environ.get("METRICS_TOKEN")
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get("SLOW_REQUEST_MS", 500))
+
+from webApp import routes, commands, metrics, compression, prerender
+from webApp.migrations import upgrade
 
-from webApp import routes
+# Brings an existing database up to date with models.py. Workers starting together
+# take turns, see migrations.migration_lock; DB_AUTO_UPGRADE=0 leaves it to
+# `flask upgrade-db` once per deploy.
+if os.environ.get("DB_AUTO_UPGRADE", "1") == "1":
+    upgrade()
@@ -0,0 +1,119 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+BUILD_DIR = "build"
+MANIFEST = "manifest.json"
+# Responsive variants of uploaded images are rewritten under the same names
+UPLOAD_DIRS = ("images/variants/",)
+SKIPPED = (BUILD_DIR + "/", "lang.json") + UPLOAD_DIRS
+COMPRESSIBLE = (".css", ".js", ".svg", ".json", ".ico", ".txt", ".html")
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def build_assets(static_root):
+    """Copy every shipped static file to build/ under a content-hashed name.
+
+    `css/style.css` becomes `build/css/style.<hash>.css`, text assets also
+    get `.gz` (and `.br` when the brotli package is installed) siblings.
+    The mapping is written to build/manifest.json. Returns the mapping.
+    """
+    build_root = os.path.join(static_root, BUILD_DIR)
+    if os.path.isdir(build_root):
+        shutil.rmtree(build_root)
+    manifest = {}
+    for directory, dirnames, filenames in os.walk(static_root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, static_root).replace(os.sep, "/")
+            if name.startswith(SKIPPED):
+                continue
+            with open(path, "rb") as source:
+                data = source.read()
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            stem, extension = os.path.splitext(name)
+            hashed = f"{BUILD_DIR}/{stem}.{digest}{extension}"
+            target = os.path.join(static_root, *hashed.split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as out:
+                out.write(data)
+            if extension.lower() in COMPRESSIBLE:
+                with open(target + ".gz", "wb") as out:
+                    out.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(target + ".br", "wb") as out:
+                        out.write(brotli.compress(data))
+            manifest[name] = hashed
+    with open(os.path.join(build_root, MANIFEST), "w", encoding="utf-8") as out:
+        json.dump(manifest, out, indent=1, sort_keys=True)
+    return manifest
+
+
+class StaticAssets:
+    """Resolves url_for('static') through the build manifest.
+
+    The manifest is read once at startup; without a build the plain file
+    names are used. Hashed files are served with a one year immutable
+    Cache-Control, and precompressed siblings are picked by Accept-Encoding.
+    Uploaded images share images/ with the shipped ones and can be replaced
+    under the same name, their URLs pass `fingerprint=False` to skip the
+    manifest.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.manifest = {}
+        self.load()
+        app.url_defaults(self.hashed_url)
+        app.view_functions["static"] = self.send_static_file
+
+    def load(self):
+        path = os.path.join(self.app.static_folder, BUILD_DIR, MANIFEST)
+        try:
+            with open(path, encoding="utf-8") as manifest:
+                self.manifest = json.load(manifest)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def hashed_url(self, endpoint, values):
+        if endpoint == "static" and not values.pop("fingerprint", True):
+            return
+        if endpoint == "static" and self.manifest and "filename" in values:
+            filename = values["filename"].lstrip("/")
+            values["filename"] = self.manifest.get(filename, values["filename"])
+
+    def send_static_file(self, filename):
+        if not filename.startswith(BUILD_DIR + "/"):
+            return self.app.send_static_file(filename)
+
+        accepted = request.accept_encodings
+        encoding = None
+        for candidate, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if accepted[candidate] and os.path.isfile(
+                    os.path.join(self.app.static_folder, *(filename + suffix).split("/"))):
+                encoding = candidate
+                break
+        if encoding:
+            suffix = ".br" if encoding == "br" else ".gz"
+            mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            response = send_from_directory(self.app.static_folder, filename + suffix,
+                                           mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+            response.headers["Content-Encoding"] = encoding
+        else:
+            response = send_from_directory(self.app.static_folder, filename, max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add("Accept-Encoding")
+        return response
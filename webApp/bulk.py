@@ -0,0 +1,232 @@
+import queue
+import threading
+from types import SimpleNamespace
+
+from sqlalchemy import case
+
+from webApp import app, db, file_storage
+from webApp.models import Candidate, OutboxMessage, Persona, Section
+from webApp.pagecache import page_cache
+from webApp.pipeline import cv_pipeline
+from webApp.richtext import process_section
+
+
+OPERATIONS = {
+    "candidates": ("delete", "approve"),
+    "sections": ("delete", "order", "update"),
+    "personas": ("delete", "order", "update"),
+}
+FIELDS = {
+    "sections": ("title_cs", "title_sk", "body_cs", "body_sk"),
+    "personas": ("fullname", "position_cs", "position_sk", "phone", "email", "area"),
+}
+AREAS = ("centrala", "prodejny", "sklady")
+
+
+class BulkError(ValueError):
+    """The batch is malformed, none of it was applied."""
+
+
+class FileRemover:
+    """Deletes stored files in a background thread once nothing refers to them.
+
+    Keys are re-checked against candidates and pending mail right before the
+    delete, so a CV that another application or a queued message still uses
+    is kept. Whatever is missed here is left to the retention sweep.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def remove(self, keys):
+        keys = sorted(set(keys))
+        if not keys:
+            return
+        self._queue.put(keys)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="file-remover", daemon=True)
+                self._thread.start()
+
+    def join(self):
+        # Blocks until every queued key was handled
+        self._queue.join()
+
+    def remove_now(self, keys):
+        with app.app_context():
+            try:
+                referenced = {row.file for row in db.session.query(Candidate.file).filter(
+                    Candidate.file.in_(keys))}
+                referenced.update(row.attachment_key for row in db.session.query(
+                    OutboxMessage.attachment_key).filter(
+                        OutboxMessage.status == "pending", OutboxMessage.attachment_key.in_(keys)))
+            finally:
+                db.session.remove()
+        removed = 0
+        for key in keys:
+            if key in referenced:
+                continue
+            try:
+                self.storage.delete(key)
+                removed += 1
+            except OSError:
+                app.logger.warning("Stored file %s could not be removed", key, exc_info=True)
+        return removed
+
+    def _run(self):
+        while True:
+            keys = self._queue.get()
+            try:
+                self.remove_now(keys)
+            except Exception:
+                app.logger.exception("Removing %d stored files failed", len(keys))
+            finally:
+                self._queue.task_done()
+
+
+file_remover = FileRemover(file_storage)
+
+
+### Parsing, JSON bodies and admin forms end up in the same shape
+
+def _ids(values):
+    if not isinstance(values, list) or not all(type(value) is int for value in values):
+        raise BulkError("Očekáván seznam čísel záznamů.")
+    return values
+
+
+def _fields(kind, values):
+    model = Section if kind == "sections" else Persona
+    fields = {}
+    for name, value in values.items():
+        if name not in FIELDS[kind]:
+            raise BulkError(f"Pole {name} nelze hromadně měnit.")
+        if not isinstance(value, str) or not value.strip():
+            raise BulkError(f"Pole {name} musí být vyplněno.")
+        length = model.__table__.c[name].type.length
+        if length and len(value) > length:
+            raise BulkError(f"Pole {name} může mít nejvýše {length} znaků.")
+        if name == "area" and value not in AREAS:
+            raise BulkError(f"Neznámá oblast {value}.")
+        fields[name] = value
+    return fields
+
+
+def parse_json(kind, data):
+    """{"delete": [ids], "approve": [ids], "order": [ids], "update": [{"id": 1, field: value}]}"""
+    if not isinstance(data, dict):
+        raise BulkError("Očekáván JSON objekt.")
+    unknown = set(data) - set(OPERATIONS[kind])
+    if unknown:
+        raise BulkError(f"Neznámá operace {', '.join(sorted(unknown))}.")
+    batch = {operation: _ids(data[operation]) for operation in ("delete", "approve", "order") if operation in data}
+    if "update" in data:
+        if not isinstance(data["update"], list) or not all(isinstance(row, dict) for row in data["update"]):
+            raise BulkError("Očekáván seznam změn.")
+        batch["update"] = {}
+        for row in data["update"]:
+            row = dict(row)
+            row_id = _ids([row.pop("id", None)])[0]
+            batch["update"][row_id] = _fields(kind, row)
+    return batch
+
+
+def parse_form(kind, form):
+    # One action for the checked `ids`, an update sets the filled in fields on all of them
+    action = form.get("action")
+    if action not in OPERATIONS[kind]:
+        raise BulkError("Neznámá operace.")
+    ids = form.getlist("ids", type=int)
+    if action != "update":
+        return {action: ids}
+    fields = _fields(kind, {name: form[name] for name in FIELDS[kind] if form.get(name, "").strip()})
+    return {"update": {row_id: fields for row_id in ids}}
+
+
+### Operations, each returns the counts and what has to happen after the commit
+
+def _update_rows(model, rows):
+    # One UPDATE ... SET column = CASE id WHEN .. END for per-row values, `rows` maps ids to {column: value}
+    names = sorted({name for values in rows.values() for name in values})
+    values = {}
+    for name in names:
+        whens = {row_id: row[name] for row_id, row in rows.items() if name in row}
+        values[name] = case(whens, value=model.id, else_=getattr(model, name))
+    return model.query.filter(model.id.in_(list(rows))).update(values, synchronize_session=False)
+
+
+def _candidates(batch):
+    counts, files = {}, []
+    if batch.get("approve"):
+        counts["approved"] = Candidate.query.filter(
+            Candidate.id.in_(batch["approve"]), Candidate.status == "review"
+        ).update({"status": "pending"}, synchronize_session=False)
+    if batch.get("delete"):
+        files = [row.file for row in db.session.query(Candidate.file).filter(
+            Candidate.id.in_(batch["delete"])).distinct()]
+        counts["deleted"] = Candidate.query.filter(
+            Candidate.id.in_(batch["delete"])).delete(synchronize_session=False)
+    return counts, files, set()
+
+
+def _content(model, context_column, batch):
+    ids = set(batch.get("delete", [])) | set(batch.get("order", [])) | set(batch.get("update", {}))
+    if not ids:
+        return {}, [], set()
+    columns = [model.id, context_column]
+    if model is Section:
+        columns += [Section.body_cs, Section.body_sk]
+    rows = {row.id: row for row in db.session.query(*columns).filter(model.id.in_(ids))}
+    counts = {}
+    if batch.get("update"):
+        changes = {}
+        for row_id, fields in batch["update"].items():
+            if row_id not in rows:
+                continue
+            changes[row_id] = dict(fields)
+            if model is Section and ("body_cs" in fields or "body_sk" in fields):
+                section = SimpleNamespace(body_cs=fields.get("body_cs", rows[row_id].body_cs),
+                                          body_sk=fields.get("body_sk", rows[row_id].body_sk))
+                process_section(section)
+                changes[row_id].update(html_cs=section.html_cs, html_sk=section.html_sk)
+        counts["updated"] = _update_rows(model, changes) if changes else 0
+    if batch.get("order"):
+        # Listed rows get positions 1..n in the given order, send the whole page to reorder it
+        positions = {row_id: {"position": position}
+                     for position, row_id in enumerate(batch["order"], 1) if row_id in rows}
+        counts["ordered"] = _update_rows(model, positions) if positions else 0
+    if batch.get("delete"):
+        counts["deleted"] = model.query.filter(model.id.in_(batch["delete"])).delete(synchronize_session=False)
+    if model is Persona:
+        # Personalists are listed on the index, their area only links to a page
+        return counts, [], {"index"} if rows else set()
+    return counts, [], {row.context for row in rows.values()}
+
+
+def run_batch(kind, batch):
+    """Apply a parsed batch in one transaction and return the affected row counts.
+
+    Every operation is a single UPDATE or DELETE over all of its rows. Page
+    caches are dropped and removed candidates' CVs are handed to
+    `file_remover` only after the commit.
+    """
+    try:
+        if kind == "candidates":
+            counts, files, contexts = _candidates(batch)
+        elif kind == "sections":
+            counts, files, contexts = _content(Section, Section.context, batch)
+        else:
+            counts, files, contexts = _content(Persona, Persona.area, batch)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    for context in sorted(contexts):
+        page_cache.invalidate(context)
+    if counts.get("approved"):
+        cv_pipeline.notify()
+    file_remover.remove(files)
+    return counts
@@ -0,0 +1,131 @@
+import os
+
+import click
+from sqlalchemy.orm import load_only
+
+from webApp import app, db, file_storage, image_storage, static_assets
+from webApp.assets import build_assets
+from webApp.images import PERSONA_WIDTHS, SECTION_WIDTHS, process_stored_image
+from webApp.migrations import MIGRATIONS, SchemaMigration, upgrade
+from webApp.models import Candidate, Persona, Section
+from webApp.pagecache import page_cache
+from webApp.pipeline import cv_pipeline
+from webApp.prerender import export_pages
+from webApp.retention import run_retention
+from webApp.storage import LocalStorage
+from webApp.richtext import process_candidate, process_section
+
+
+@app.cli.command("upgrade-db")
+def upgrade_db():
+    """Create missing tables and apply pending schema migrations."""
+    upgrade()
+    applied = {migration.name for migration in SchemaMigration.query.all()}
+    for name, step in MIGRATIONS:
+        click.echo(f"{'applied' if name in applied else 'pending'}  {name}")
+
+
+@app.cli.command("process-images")
+def process_images():
+    """Generate responsive variants for every section and persona image."""
+    done = failed = 0
+    for model, widths in ((Section, SECTION_WIDTHS), (Persona, PERSONA_WIDTHS)):
+        for item in model.query.filter(model.image_url.isnot(None)):
+            if process_stored_image(item, image_storage, widths):
+                done += 1
+            else:
+                failed += 1
+                click.echo(f"Skipped {model.__tablename__} {item.id}: {item.image_url}")
+        db.session.commit()
+    click.echo(f"Processed {done} images, {failed} skipped.")
+
+
+@app.cli.command("build-assets")
+def build_static_assets():
+    """Fingerprint and precompress everything under static/."""
+    manifest = build_assets(app.static_folder)
+    static_assets.load()
+    click.echo(f"Built {len(manifest)} static assets.")
+
+
+@app.cli.command("compile-templates")
+def compile_templates():
+    """Compile every template into the bytecode cache, run once per deploy."""
+    if app.jinja_env.bytecode_cache is None:
+        raise click.ClickException("JINJA_CACHE_DIR is empty, the bytecode cache is disabled.")
+    names = app.jinja_env.list_templates(extensions=["html", "xml", "txt"])
+    for name in names:
+        app.jinja_env.get_template(name)
+    click.echo(f"Compiled {len(names)} templates into {app.config['JINJA_CACHE_DIR']}.")
+
+
+@app.cli.command("check-cvs")
+def check_cvs():
+    """Check, index and mail every CV that is still pending."""
+    click.echo(f"Processed {cv_pipeline.run_pending()} pending CVs.")
+
+
+@app.cli.command("retention")
+@click.option("--days", type=int, default=None, help="Purge applications older than this, default RETENTION_DAYS.")
+@click.option("--dry-run", is_flag=True, help="Only report what would be removed.")
+def retention(days, dry_run):
+    """Purge old applications and remove stored files nobody refers to."""
+    report = run_retention(days, app.config["RETENTION_BATCH"], app.config["RETENTION_GRACE"], dry_run)
+    click.echo(f"{'Would purge' if dry_run else 'Purged'} {report['candidates']} applications, "
+               f"{report['files']} files, {report['bytes'] / 2**20:.1f} MB.")
+
+
+@app.cli.command("prerender")
+@click.option("--output", default=None, help="Target directory, default STATIC_EXPORT_DIR.")
+def prerender(output):
+    """Render every public page in every language to static HTML, run once per deploy."""
+    output = output or app.config["STATIC_EXPORT_DIR"]
+    if not output:
+        raise click.ClickException("Set STATIC_EXPORT_DIR or pass --output.")
+    click.echo(f"Rendered public pages into {output}, {export_pages(output)} files changed.")
+
+
+@app.cli.command("rich-text")
+@click.option("--batch", type=int, default=500, help="Candidates per transaction.")
+def rich_text(batch):
+    """Re-process section bodies and candidate messages, images included."""
+    sections = Section.query.all()
+    for section in sections:
+        process_section(section)
+    db.session.commit()
+    candidates = last_id = 0
+    while True:
+        rows = Candidate.query.options(load_only(Candidate.id, Candidate.message)).filter(
+            Candidate.id > last_id).order_by(Candidate.id).limit(batch).all()
+        if not rows:
+            break
+        for candidate in rows:
+            process_candidate(candidate)
+        db.session.commit()
+        candidates += len(rows)
+        last_id = rows[-1].id
+    page_cache.invalidate()
+    click.echo(f"Processed {len(sections)} sections and {candidates} candidate messages.")
+
+
+@app.cli.command("migrate-files")
+@click.option("--dry-run", is_flag=True, help="Only report what would be copied.")
+def migrate_files(dry_run):
+    """Copy local CVs and uploaded images into FILES_STORAGE and IMAGES_STORAGE."""
+    pairs = ((LocalStorage(app.config["FILES_DIR"]), file_storage, ""),
+             (LocalStorage(app.static_folder), image_storage, "images/"))
+    for source, target, prefix in pairs:
+        if target.local:
+            click.echo(f"{source.root} is the configured storage already, skipped.")
+            continue
+        # Safe to repeat, objects that are there with the same size are skipped
+        existing = {key: size for key, size, _ in target.list(prefix)}
+        copied = skipped = 0
+        for key, size, _ in source.list(prefix):
+            if existing.get(key) == size or os.path.basename(key).startswith("."):
+                skipped += 1
+                continue
+            if not dry_run:
+                target.put(key, source.path(key), move=False)
+            copied += 1
+        click.echo(f"{'Would copy' if dry_run else 'Copied'} {copied} files from {source.root}, {skipped} skipped.")
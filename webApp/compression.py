@@ -0,0 +1,48 @@
+import gzip
+
+from flask import request
+
+from webApp import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+
+
+def _encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress_response(response):
+    # Static files are precompressed and file downloads are streamed, both
+    # are passed through. So are small bodies where headers would dominate.
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers or "Content-Range" in response.headers
+            or not (response.mimetype or "").startswith(COMPRESSIBLE)
+            or response.cache_control.no_transform):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = _encoding()
+    data = response.get_data()
+    if encoding is None or len(data) < app.config["COMPRESS_MIN_SIZE"]:
+        return response
+    if encoding == "br":
+        data = brotli.compress(data, quality=app.config["COMPRESS_BROTLI_QUALITY"])
+    else:
+        data = gzip.compress(data, compresslevel=app.config["COMPRESS_GZIP_LEVEL"], mtime=0)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+if app.config["COMPRESS_ENABLED"]:
+    app.after_request(compress_response)
@@ -0,0 +1,40 @@
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def database_uri():
+    uri = os.environ.get("DATABASE_URL", "sqlite:///career.db")
+    # Heroku style URLs are not accepted by SQLAlchemy 1.4
+    if uri.startswith("postgres://"):
+        uri = "postgresql://" + uri[len("postgres://"):]
+    return uri
+
+
+def engine_options(uri):
+    if uri.startswith("sqlite"):
+        # busy_timeout in seconds for the sqlite3 driver, see also set_sqlite_pragmas
+        return {"connect_args": {"timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 15000)) / 1000}}
+    return {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "1") == "1",
+    }
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run next to the single writer, the busy timeout makes
+    # concurrent writers wait for the lock instead of failing straight away
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    if os.environ.get("SQLITE_WAL", "1") == "1":
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT', 15000))}")
+    cursor.close()
@@ -0,0 +1,163 @@
+import csv
+import io
+import re
+import zipfile
+from collections import namedtuple
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from webApp.storage import _ZipBuffer
+
+
+ROWS_PER_CHUNK = 500
+MAX_CELL = 32767
+EXCEL_EPOCH = datetime(1899, 12, 30)
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+ILLEGAL_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+Link = namedtuple("Link", ["url", "text"])
+
+
+### CSV
+
+def _csv_value(value):
+    if isinstance(value, Link):
+        return value.url
+    if isinstance(value, datetime):
+        return value.strftime("%d.%m.%Y %H:%M")
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # Candidates write these fields, Excel must not run them as formulas
+        return "'" + value
+    return value
+
+
+def csv_stream(header, rows):
+    # Semicolons and a BOM, so that Czech Excel splits the columns and keeps diacritics
+    buffer = io.StringIO()
+    buffer.write("\ufeff")
+    writer = csv.writer(buffer, delimiter=";")
+    writer.writerow(header)
+    for number, row in enumerate(rows, 1):
+        writer.writerow([_csv_value(value) for value in row])
+        if number % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+### XLSX, a single sheet with inline strings written straight into the zip
+
+XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '<Relationship Id="rId2" Target="styles.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+        '</Relationships>'),
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd.mm.yyyy hh:mm"/></numFmts>'
+        '<fonts count="3"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font>'
+        '<font><u/><sz val="11"/><color rgb="FF0563C1"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="4"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+        '<xf numFmtId="0" fontId="2" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'),
+}
+DATE_STYLE, HEADER_STYLE, LINK_STYLE = 1, 2, 3
+
+
+def _column(index):
+    name = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(65 + remainder) + name
+    return name
+
+
+def _text(value):
+    return escape(ILLEGAL_XML.sub("", value[:MAX_CELL]))
+
+
+def _xlsx_cell(ref, value, style=0):
+    styled = f' s="{style}"' if style else ""
+    if value is None:
+        return ""
+    if isinstance(value, Link):
+        url = _text(value.url).replace('"', '""')
+        text = _text(value.text).replace('"', '""')
+        return (f'<c r="{ref}" s="{LINK_STYLE}" t="str">'
+                f'<f>HYPERLINK("{url}","{text}")</f><v>{_text(value.text)}</v></c>')
+    if isinstance(value, datetime):
+        serial = (value - EXCEL_EPOCH).total_seconds() / 86400
+        return f'<c r="{ref}" s="{DATE_STYLE}"><v>{serial:.6f}</v></c>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}"{styled}><v>{value}</v></c>'
+    return f'<c r="{ref}"{styled} t="inlineStr"><is><t xml:space="preserve">{_text(str(value))}</t></is></c>'
+
+
+def _xlsx_row(number, values, style=0):
+    cells = "".join(_xlsx_cell(f"{_column(index)}{number}", value, style) for index, value in enumerate(values))
+    return f'<row r="{number}">{cells}</row>'
+
+
+def xlsx_stream(sheet_name, header, rows):
+    """Yield an XLSX workbook with one sheet while the rows are being read.
+
+    The sheet XML is deflated straight into a streamed zip, so memory use
+    does not depend on the number of rows.
+    """
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{_text(sheet_name)}" sheetId="1" r:id="rId1"/></sheets></workbook>'))
+        yield buffer.drain()
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+                'activePane="bottomLeft" state="frozen"/></sheetView></sheetViews><sheetData>'
+                + _xlsx_row(1, header, HEADER_STYLE)).encode("utf-8"))
+            for number, row in enumerate(rows, 2):
+                sheet.write(_xlsx_row(number, row).encode("utf-8"))
+                if number % ROWS_PER_CHUNK == 0:
+                    yield buffer.drain()
+            sheet.write(b"</sheetData></worksheet>")
+        yield buffer.drain()
+    yield buffer.drain()
@@ -1,9 +1,11 @@
 from flask_ckeditor import CKEditorField
-from flask_wtf import FlaskForm, RecaptchaField, Recaptcha
+from flask_wtf import FlaskForm, RecaptchaField
 from flask_wtf.file import FileAllowed, FileField, FileRequired, FileSize
 from wtforms import BooleanField, PasswordField, SelectField, StringField, SubmitField, TextAreaField
 from wtforms.validators import URL, DataRequired, EqualTo, Email
 
+from webApp.recaptcha import PooledRecaptcha
+
 
 ### Contact form for candidates
 
@@ -13,7 +15,7 @@ class ContactForm(FlaskForm):
     email = StringField("Email", validators=[Email(), DataRequired()])
     file = FileField("Životopis", validators=[FileRequired(), FileSize(max_size=5242880, message="Příloha formuláře níže musí být menší než 5 MB.")])
     message = TextAreaField("Váš vzkaz", validators=[DataRequired()], render_kw={"rows": 8})
-    recaptcha = RecaptchaField(validators=[Recaptcha(message="Prosím potvrďte ve formuláři níže, že nejste robot.")])
+    recaptcha = RecaptchaField(validators=[PooledRecaptcha(message="Prosím potvrďte ve formuláři níže, že nejste robot.")])
     terms = BooleanField("Souhlas", validators=[DataRequired()])
     submit = SubmitField("Odeslat")
 
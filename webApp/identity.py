@@ -0,0 +1,122 @@
+import threading
+import time
+from datetime import datetime
+
+from flask import session
+from flask_login import UserMixin
+
+from webApp import app, db
+
+
+class CachedUser(UserMixin):
+    # Detached snapshot of a User, enough for current_user in views and templates
+    def __init__(self, id, name, email, active):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.active = active
+
+    @property
+    def is_active(self):
+        return self.active
+
+
+class IdentityCache:
+    """Keeps a snapshot of the logged-in user in the session for `ttl` seconds.
+
+    Each snapshot records the user's revoked_at. Routes that change an
+    account bump it in the shared database. Every process re-reads the
+    stamps of all users in one query at most every `check_interval` seconds,
+    so a request normally needs no database access at all. An account
+    changed on another node or worker is reloaded, and a deactivated admin
+    rejected, within `check_interval` seconds. The worker that made the
+    change applies it straight away.
+    """
+
+    key = "_identity"
+
+    def __init__(self, ttl=300, check_interval=5.0):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._refresh = threading.Lock()
+        self._stamps = {}
+        self._checked = None
+
+    def stamps(self):
+        # Only one thread reloads, the others keep using the stamps they have
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.check_interval:
+            return self._stamps
+        if not self._refresh.acquire(blocking=self._checked is None):
+            return self._stamps
+        try:
+            # models imports this module for load_user, so User is looked up here
+            from webApp.models import User
+
+            stamps = {row.id: row.revoked_at.isoformat() if row.revoked_at else ""
+                      for row in db.session.query(User.id, User.revoked_at)}
+            with self._lock:
+                self._stamps = stamps
+                self._checked = now
+        finally:
+            self._refresh.release()
+        return self._stamps
+
+    def _lookup(self, user_id):
+        # An account created since the last reload, or one that is gone
+        from webApp.models import User
+
+        row = db.session.query(User.revoked_at).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        stamp = row.revoked_at.isoformat() if row.revoked_at else ""
+        with self._lock:
+            self._stamps = {**self._stamps, user_id: stamp}
+        return stamp
+
+    def get(self, user_id, load):
+        snapshot = session.get(self.key)
+        stamp = self.stamps().get(user_id)
+        if stamp is None:
+            stamp = self._lookup(user_id)
+        if stamp is None:
+            session.pop(self.key, None)
+            return None
+        if (snapshot and snapshot["id"] == user_id and snapshot["stamp"] == stamp
+                and snapshot["expires"] > time.time()):
+            user = CachedUser(snapshot["id"], snapshot["name"], snapshot["email"], snapshot["active"])
+        else:
+            user = load()
+            if user is None:
+                session.pop(self.key, None)
+                return None
+            session[self.key] = {
+                "id": user.id,
+                "name": user.name,
+                "email": user.email,
+                "active": bool(user.active),
+                "stamp": stamp,
+                "expires": time.time() + self.ttl,
+            }
+        # Deactivated accounts are logged out on their next request
+        if not user.active:
+            return None
+        return user
+
+    def invalidate(self, user_id):
+        # Commits on its own, call it after the account change is committed
+        from webApp.models import User
+
+        revoked_at = datetime.utcnow()
+        User.query.filter(User.id == user_id).update({"revoked_at": revoked_at}, synchronize_session=False)
+        db.session.commit()
+        with self._lock:
+            self._stamps = {**self._stamps, user_id: revoked_at.isoformat()}
+        snapshot = session.get(self.key)
+        if snapshot and snapshot["id"] == user_id:
+            session.pop(self.key)
+
+
+identity_cache = IdentityCache(ttl=app.config["IDENTITY_CACHE_TTL"],
+                               check_interval=app.config["IDENTITY_CHECK_INTERVAL"])
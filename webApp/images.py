@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import tempfile
+
+from werkzeug.utils import secure_filename
+
+
+SECTION_WIDTHS = (320, 560, 840, 1120)
+PERSONA_WIDTHS = (150, 300)
+
+# Modern formats first, browsers pick the first <source> they understand
+FORMATS = (
+    ("avif", "image/avif", {"quality": 50}),
+    ("webp", "image/webp", {"quality": 80, "method": 6}),
+)
+FALLBACKS = {
+    "jpeg": {"quality": 82, "optimize": True, "progressive": True},
+    "png": {"optimize": True},
+}
+
+
+def _supported(fmt):
+    from PIL import Image
+
+    Image.init()
+    return fmt.upper() in Image.SAVE
+
+
+def make_variants(static_root, image_url, widths, reuse=False):
+    """Write resized, metadata-free variants of a static image.
+
+    Variants go to `images/variants/<name>-<width>w.<ext>` next to the
+    original, in AVIF (when Pillow can write it), WebP and a JPEG or PNG
+    fallback. `<name>` keeps the original's extension, so foo.png and foo.jpg
+    get separate variants. Widths larger than the original are skipped.
+    Returns the JSON stored in `image_variants` together with the original
+    dimensions. With `reuse`, variants newer than the original are not
+    encoded again.
+    """
+    # Pillow is only needed when an image is uploaded, not on every worker start
+    from PIL import Image, ImageOps
+
+    source_path = os.path.join(static_root, *image_url.split("/"))
+    directory, name = os.path.split(image_url)
+    target_dir = os.path.join(static_root, *directory.split("/"), "variants")
+    os.makedirs(target_dir, exist_ok=True)
+
+    source_mtime = os.stat(source_path).st_mtime
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    width, height = image.size
+    sizes = sorted({min(size, width) for size in widths})
+
+    fallback = "png" if has_alpha else "jpeg"
+    formats = [(fmt, mime, options) for fmt, mime, options in FORMATS if _supported(fmt)]
+    formats.append((fallback, f"image/{fallback}", FALLBACKS[fallback]))
+
+    sources = []
+    for fmt, mime, options in formats:
+        entries = []
+        for size in sizes:
+            extension = "jpg" if fmt == "jpeg" else fmt
+            variant_name = f"{name}-{size}w.{extension}"
+            target = os.path.join(target_dir, variant_name)
+            if not (reuse and os.path.exists(target) and os.stat(target).st_mtime >= source_mtime):
+                resized = image if size == width else image.resize(
+                    (size, round(height * size / width)), Image.LANCZOS)
+                resized.save(target, fmt.upper(), **options)
+            entries.append([size, "/".join(filter(None, [directory, "variants", variant_name]))])
+        sources.append({"type": mime, "entries": entries})
+
+    variants = {"sources": sources[:-1], "fallback": sources[-1]["entries"]}
+    return width, height, json.dumps(variants)
+
+
+def process_image(item, static_root, widths):
+    # Fills the image columns of a Section or Persona from its image_url
+    if not item.image_url:
+        return False
+    try:
+        item.image_width, item.image_height, item.image_variants = make_variants(
+            static_root, item.image_url, widths)
+    except (OSError, ValueError):
+        item.image_width = item.image_height = item.image_variants = None
+        return False
+    return True
+
+
+def process_stored_image(item, storage, widths, upload=None):
+    """Like process_image, for an image kept in `storage`.
+
+    With `upload` the file is saved first as images/<name>. Local storage is
+    processed in place. Otherwise the work happens in a scratch directory and
+    the new files are uploaded.
+    """
+    if upload is not None:
+        item.image_url = f"images/{secure_filename(upload.filename)}"
+    if storage.local:
+        if upload is not None:
+            path = storage.path(item.image_url)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            upload.save(path)
+        return process_image(item, storage.root, widths)
+
+    workdir = tempfile.mkdtemp(prefix=".images-")
+    try:
+        source = os.path.join(workdir, *item.image_url.split("/"))
+        os.makedirs(os.path.dirname(source), exist_ok=True)
+        if upload is not None:
+            upload.save(source)
+        else:
+            with storage.open(item.image_url) as stored, open(source, "wb") as out:
+                shutil.copyfileobj(stored, out)
+        done = process_image(item, workdir, widths)
+        for directory, _, names in os.walk(workdir):
+            for name in names:
+                path = os.path.join(directory, name)
+                if upload is not None or path != source:
+                    storage.put(os.path.relpath(path, workdir).replace(os.sep, "/"), path)
+        return done
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from flask import request
+
+
+LANGUAGES = ("cs", "sk")
+DEFAULT_LANGUAGE = "cs"
+
+
+def negotiate_language():
+    return request.accept_languages.best_match(LANGUAGES) or DEFAULT_LANGUAGE
+
+
+class LocaleStore:
+    """Process-wide cache of lang.json with per-language resolved views.
+
+    The file is parsed once and re-read only when its mtime changes. The
+    mtime itself is checked at most every `check_interval` seconds, so the
+    request path normally touches neither the disk nor the JSON parser.
+    """
+
+    def __init__(self, path, languages=LANGUAGES, check_interval=2.0):
+        self.path = path
+        self.languages = tuple(languages)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0.0
+        self._raw = ""
+        self._views = {}
+
+    def _resolve(self, node, lang):
+        if isinstance(node, dict):
+            if node and set(node) <= set(self.languages):
+                return node.get(lang, node.get(DEFAULT_LANGUAGE))
+            return {key: self._resolve(value, lang) for key, value in node.items()}
+        return node
+
+    def _load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, encoding="utf-8") as json_data:
+            raw = json_data.read()
+        data = json.loads(raw)
+        self._views = {lang: self._resolve(data, lang) for lang in self.languages}
+        self._raw = raw
+        self._mtime = mtime
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._mtime is not None and now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            if self._mtime is not None and now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            try:
+                if os.stat(self.path).st_mtime_ns == self._mtime:
+                    return
+                self._load()
+            except ValueError:
+                # Keep serving the last good table if someone broke the file by hand
+                if self._mtime is None:
+                    raise
+
+    def get(self, lang):
+        self._refresh()
+        return self._views.get(lang, self._views[DEFAULT_LANGUAGE])
+
+    @property
+    def version(self):
+        self._refresh()
+        return self._mtime
+
+    @property
+    def raw(self):
+        self._refresh()
+        return self._raw
+
+    def save(self, raw):
+        # Raises ValueError on invalid JSON before anything touches the disk
+        json.loads(raw)
+        directory = os.path.dirname(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".lang-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as json_data:
+                json_data.write(raw)
+                json_data.flush()
+                os.fsync(json_data.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._load()
+            self._checked = time.monotonic()
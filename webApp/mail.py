@@ -0,0 +1,148 @@
+import threading
+from datetime import datetime, timedelta
+
+from webApp import app, db
+from webApp.mailer import mailer
+from webApp.models import OutboxMessage
+
+
+class MailQueue:
+    """Background delivery of messages stored in the outbox table.
+
+    Workers claim a due message by pushing its `next_attempt` forward by
+    `lease` seconds with a conditional UPDATE, so several threads or worker
+    processes never send the same message twice. A message whose worker
+    died is picked up again once the lease runs out. Failed deliveries are
+    retried with exponential backoff until `max_attempts` is reached. Up to
+    `batch_size` messages are sent over one pooled SMTP session.
+    """
+
+    def __init__(self, workers=2, max_attempts=6, retry_base=30, lease=600, poll_interval=15, batch_size=10):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _claim(self):
+        now = datetime.utcnow()
+        due = OutboxMessage.query.filter(
+            OutboxMessage.status == "pending",
+            OutboxMessage.next_attempt <= now
+        ).order_by(OutboxMessage.next_attempt).limit(self.batch_size).all()
+        claimed = []
+        for message in due:
+            updated = OutboxMessage.query.filter_by(
+                id=message.id, status="pending", next_attempt=message.next_attempt
+            ).update({
+                "next_attempt": now + timedelta(seconds=self.lease),
+                "attempts": OutboxMessage.attempts + 1
+            }, synchronize_session=False)
+            if updated:
+                claimed.append(message.id)
+        db.session.commit()
+        if not claimed:
+            return []
+        return OutboxMessage.query.filter(OutboxMessage.id.in_(claimed)).all()
+
+    def process_batch(self):
+        claimed = self._claim()
+        messages = []
+        envelopes = []
+        for message in claimed:
+            try:
+                envelopes.append((message.sender, message.recipient, message.as_string()))
+            except FileNotFoundError as err:
+                # Attachment is gone, there is nothing to retry
+                self._failed(message, err, permanent=True)
+                continue
+            except OSError as err:
+                # Shared storage is unreachable, try again later
+                self._failed(message, err)
+                continue
+            messages.append(message)
+        results = mailer.send_many(envelopes) if envelopes else []
+        for message, error in zip(messages, results):
+            if error is None:
+                message.status = "sent"
+                message.last_error = None
+            else:
+                self._failed(message, error)
+        db.session.commit()
+        return len(claimed)
+
+    def _failed(self, message, err, permanent=False):
+        message.last_error = f"{type(err).__name__}: {err}"
+        if permanent or message.attempts >= self.max_attempts:
+            message.status = "failed"
+            app.logger.error("Giving up on outbox message %s: %s", message.id, message.last_error)
+        else:
+            delay = self.retry_base * 2 ** (message.attempts - 1)
+            message.next_attempt = datetime.utcnow() + timedelta(seconds=delay)
+            app.logger.warning("Outbox message %s failed, retrying in %ss: %s",
+                               message.id, delay, message.last_error)
+
+    def run_pending(self):
+        # Drains everything that is due right now, used by tests and CLI
+        processed = 0
+        with app.app_context():
+            try:
+                while True:
+                    count = self.process_batch()
+                    if not count:
+                        break
+                    processed += count
+            finally:
+                db.session.remove()
+        return processed
+
+    def _run(self):
+        while not self._stop.is_set():
+            with app.app_context():
+                try:
+                    busy = self.process_batch()
+                except Exception:
+                    app.logger.exception("Mail queue worker failed")
+                    busy = False
+                finally:
+                    db.session.remove()
+            if not busy:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"mail-queue-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        self._wake.set()
+
+
+mail_queue = MailQueue(
+    workers=app.config["MAIL_QUEUE_WORKERS"],
+    max_attempts=app.config["MAIL_MAX_ATTEMPTS"],
+    retry_base=app.config["MAIL_RETRY_BASE"],
+    batch_size=app.config["MAIL_BATCH_SIZE"])
+
+
+@app.before_first_request
+def start_mail_queue():
+    mail_queue.start()
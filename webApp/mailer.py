@@ -0,0 +1,146 @@
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+
+from flask.signals import Namespace
+
+from webApp import app
+from webApp import SMTP_HOST, SMTP_PASS, SMTP_PORT, SMTP_STARTTLS, SMTP_USER
+
+
+signals = Namespace()
+# Sent after every batch with the time spent talking to the SMTP server
+mail_sent = signals.signal("mail-sent")
+
+
+class Mailer:
+    """Small pool of authenticated SMTP sessions shared by all outgoing mail.
+
+    A session is reused until it has been idle for `idle_timeout` seconds or
+    the server drops it, in which case the message is retried once over a
+    fresh connection. At most `pool_size` sessions are open at a time.
+    """
+
+    def __init__(self, host, port, starttls=True, user=None, password=None,
+                 pool_size=2, idle_timeout=60, timeout=30):
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.user = user
+        self.password = password
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.handshakes = 0
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def _connect(self):
+        # smtplib and ssl are imported with the first message, not at startup
+        import smtplib
+
+        mailserver = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                mailserver.starttls()
+            if self.user:
+                mailserver.login(user=self.user,
+                                 password=self.password)
+        except Exception:
+            self._close(mailserver)
+            raise
+        with self._lock:
+            self.handshakes += 1
+        return mailserver
+
+    @staticmethod
+    def _close(mailserver):
+        try:
+            mailserver.quit()
+        except Exception:
+            mailserver.close()
+
+    def _checkout(self):
+        now = time.monotonic()
+        stale = []
+        mailserver = None
+        with self._lock:
+            while self._idle:
+                candidate, last_used = self._idle.pop()
+                if now - last_used < self.idle_timeout:
+                    mailserver = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            self._close(candidate)
+        return mailserver or self._connect()
+
+    def _checkin(self, mailserver):
+        with self._lock:
+            self._idle.append((mailserver, time.monotonic()))
+
+    @contextmanager
+    def session(self):
+        self._slots.acquire()
+        # The connection is checked out lazily by send_many, so a refused
+        # connection is reported per message instead of escaping from here
+        holder = [None]
+        try:
+            yield holder
+        finally:
+            if holder[0] is not None:
+                self._checkin(holder[0])
+            self._slots.release()
+
+    def send_many(self, messages):
+        # messages are (from_addr, to_addrs, text) tuples, the result holds
+        # None or the exception for each of them in the same order
+        import smtplib
+
+        results = []
+        started = time.perf_counter()
+        with self.session() as holder:
+            for from_addr, to_addrs, text in messages:
+                for retry in (False, True):
+                    try:
+                        if holder[0] is None:
+                            holder[0] = self._checkout()
+                        holder[0].sendmail(from_addr=from_addr, to_addrs=to_addrs, msg=text)
+                    except smtplib.SMTPException as err:
+                        # SMTPException is an OSError too. A refused recipient or
+                        # message fails on its own and the session stays usable.
+                        if not isinstance(err, smtplib.SMTPServerDisconnected):
+                            results.append(err)
+                            break
+                        broken = err
+                    except OSError as err:
+                        broken = err
+                    else:
+                        results.append(None)
+                        break
+                    # Broken session, drop it and try once more on a new one
+                    if holder[0] is not None:
+                        holder[0].close()
+                        holder[0] = None
+                    if retry:
+                        results.append(broken)
+        mail_sent.send(self, duration=time.perf_counter() - started, messages=len(results))
+        return results
+
+    def send(self, from_addr, to_addrs, text):
+        error = self.send_many([(from_addr, to_addrs, text)])[0]
+        if error is not None:
+            raise error
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for mailserver, last_used in idle:
+            self._close(mailserver)
+
+
+mailer = Mailer(
+    SMTP_HOST, SMTP_PORT, starttls=SMTP_STARTTLS, user=SMTP_USER, password=SMTP_PASS,
+    pool_size=app.config["SMTP_POOL_SIZE"], idle_timeout=app.config["SMTP_IDLE_TIMEOUT"])
+atexit.register(mailer.close)
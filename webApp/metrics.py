@@ -0,0 +1,156 @@
+import hmac
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, abort, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from webApp import app
+from webApp.mailer import mail_sent
+
+
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """Prometheus style counters and histograms of this worker process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self.counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self.histograms.setdefault((name, labels), [[0] * len(DURATION_BUCKETS), 0, 0.0])
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{self._labels(labels)} {value:g}")
+            for (name, labels), (buckets, count, total) in sorted(self.histograms.items()):
+                for bound, bucket in zip(DURATION_BUCKETS, buckets):
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {bucket}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+                lines.append(f"{name}_sum{self._labels(labels)} {total:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _timing():
+    if has_request_context():
+        return g.get("_timing")
+    return None
+
+
+def start_request():
+    g._timing = {"start": time.perf_counter(), "queries": [], "db": 0.0, "template": 0.0}
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+    registry.inc("career_db_queries_total")
+    registry.inc("career_db_query_seconds_total", value=duration)
+    timing = _timing()
+    if timing is not None:
+        timing["db"] += duration
+        timing["queries"].append((duration, statement))
+
+
+def template_started(sender, template, context, **extra):
+    timing = _timing()
+    if timing is not None:
+        timing.setdefault("template_start", []).append(time.perf_counter())
+
+
+def template_finished(sender, template, context, **extra):
+    timing = _timing()
+    if timing is not None and timing.get("template_start"):
+        duration = time.perf_counter() - timing["template_start"].pop()
+        timing["template"] += duration
+        registry.observe("career_template_render_seconds", (("template", template.name),), duration)
+
+
+def mail_finished(sender, duration, messages, **extra):
+    # Mail goes out from the queue workers, not from requests
+    registry.inc("career_mail_messages_total", value=messages)
+    registry.inc("career_mail_send_seconds_total", value=duration)
+
+
+def finish_request(response):
+    timing = g.pop("_timing", None)
+    if timing is None:
+        return response
+    total = time.perf_counter() - timing["start"]
+    endpoint = request.endpoint or "unknown"
+    registry.inc("career_requests_total", (("endpoint", endpoint), ("status", response.status_code)))
+    registry.observe("career_request_duration_seconds", (("endpoint", endpoint),), total)
+    response.headers.add("Server-Timing", ", ".join((
+        f"app;dur={total * 1000:.1f}",
+        f'db;dur={timing["db"] * 1000:.1f};desc="{len(timing["queries"])} queries"',
+        f"tpl;dur={timing['template'] * 1000:.1f}",
+    )))
+    if total * 1000 >= app.config["SLOW_REQUEST_MS"]:
+        slowest = sorted(timing["queries"], reverse=True)[:10]
+        app.logger.warning(
+            "Slow request %s %s: %.0f ms, %d queries (%.0f ms), templates %.0f ms%s",
+            request.method, request.full_path, total * 1000, len(timing["queries"]),
+            timing["db"] * 1000, timing["template"] * 1000,
+            "".join(f"\n  {duration * 1000:.1f} ms  {statement}" for duration, statement in slowest))
+    return response
+
+
+def metrics():
+    # Without a token only a scraper on this host gets an answer. A request the
+    # front server passed on is not local even when it comes from 127.0.0.1.
+    token = app.config["METRICS_TOKEN"]
+    if token:
+        allowed = hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+    else:
+        allowed = request.remote_addr in LOCAL_ADDRESSES and "X-Forwarded-For" not in request.headers
+    if not allowed:
+        abort(404)
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def install():
+    # Nothing is hooked when instrumentation is off, so it costs nothing
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+    before_render_template.connect(template_started, app)
+    template_rendered.connect(template_finished, app)
+    mail_sent.connect(mail_finished)
+    app.add_url_rule("/metrics", "metrics", metrics)
+
+
+if app.config["METRICS_ENABLED"]:
+    install()
@@ -0,0 +1,258 @@
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import bindparam, inspect, text
+
+from webApp import db
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = "schema_migrations"
+    name = db.Column(db.String(100), primary_key=True)
+    applied = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+### Helpers, every step must be safe to run against a freshly created schema
+
+def has_column(table, name):
+    return name in {column["name"] for column in inspect(db.engine).get_columns(table)}
+
+
+def add_column(table, name, definition):
+    if not has_column(table, name):
+        db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}"))
+
+
+def drop_column(table, name):
+    if has_column(table, name):
+        db.session.execute(text(f"ALTER TABLE {table} DROP COLUMN {name}"))
+
+
+def create_index(name, table, columns):
+    db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def widen_column(table, name, definition):
+    # SQLite does not enforce VARCHAR lengths and cannot alter a column, nothing to do there
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text(f"ALTER TABLE {table} ALTER COLUMN {name} TYPE {definition}"))
+
+
+### Steps, append only
+
+def candidate_filename():
+    add_column("candidates", "filename", "VARCHAR(250)")
+
+
+def candidate_created():
+    add_column("candidates", "created", "TIMESTAMP")
+    if has_column("candidates", "timestamp"):
+        rows = db.session.execute(text(
+            "SELECT id, timestamp FROM candidates WHERE created IS NULL")).fetchall()
+        for row_id, timestamp in rows:
+            try:
+                created = datetime.strptime(timestamp, "%d-%m-%Y %H:%M")
+            except (TypeError, ValueError):
+                created = datetime(1970, 1, 1)
+            db.session.execute(
+                text("UPDATE candidates SET created = :created WHERE id = :id").bindparams(
+                    bindparam("created", type_=db.DateTime)),
+                {"created": created, "id": row_id})
+        db.session.commit()
+        drop_column("candidates", "timestamp")
+    create_index("ix_candidates_created_id", "candidates", "created, id")
+
+
+def candidate_fts(columns):
+    # External content FTS5 table over `columns` of candidates, kept in sync by triggers
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    for trigger in ("insert", "delete", "update"):
+        db.session.execute(text(f"DROP TRIGGER IF EXISTS candidates_fts_{trigger}"))
+    db.session.execute(text("DROP TABLE IF EXISTS candidates_fts"))
+    for statement in (
+        f"CREATE VIRTUAL TABLE candidates_fts USING fts5("
+        f"{names}, content='candidates', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER candidates_fts_insert AFTER INSERT ON candidates BEGIN "
+        f"INSERT INTO candidates_fts(rowid, {names}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER candidates_fts_delete AFTER DELETE ON candidates BEGIN "
+        f"INSERT INTO candidates_fts(candidates_fts, rowid, {names}) "
+        f"VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER candidates_fts_update AFTER UPDATE OF {names} ON candidates BEGIN "
+        f"INSERT INTO candidates_fts(candidates_fts, rowid, {names}) "
+        f"VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO candidates_fts(rowid, {names}) VALUES (new.id, {new}); END",
+        "INSERT INTO candidates_fts(candidates_fts) VALUES ('rebuild')",
+    ):
+        db.session.execute(text(statement))
+
+
+def candidate_search():
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        candidate_fts(["fullname", "email", "message"])
+    elif dialect == "postgresql":
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_candidates_search ON candidates USING gin "
+            "(to_tsvector('simple', fullname || ' ' || email || ' ' || message))"))
+
+
+def image_variants():
+    for table in ("sections", "personalists"):
+        add_column(table, "image_width", "INTEGER")
+        add_column(table, "image_height", "INTEGER")
+        add_column(table, "image_variants", "TEXT")
+
+
+def page_indexes():
+    create_index("ix_sections_context_id", "sections", "context, id")
+    create_index("ix_videos_context_id", "videos", "video_context, id")
+    create_index("ix_personalists_area_id", "personalists", "area, id")
+
+
+def candidate_cv_check():
+    # Candidates stored before the CV pipeline existed were mailed already
+    add_column("candidates", "status", "VARCHAR(20) NOT NULL DEFAULT 'ready'")
+    add_column("candidates", "status_note", "VARCHAR(250)")
+    add_column("candidates", "file_type", "VARCHAR(100)")
+    add_column("candidates", "file_text", "TEXT")
+    add_column("candidates", "lease_until", "TIMESTAMP")
+    create_index("ix_candidates_status", "candidates", "status")
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        candidate_fts(["fullname", "email", "message", "file_text"])
+    elif dialect == "postgresql":
+        db.session.execute(text("DROP INDEX IF EXISTS ix_candidates_search"))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_candidates_search_cv ON candidates USING gin "
+            "(to_tsvector('simple', fullname || ' ' || email || ' ' || message "
+            "|| ' ' || coalesce(file_text, '')))"))
+
+
+def content_updated():
+    now = datetime.utcnow()
+    for table in ("sections", "personalists", "videos"):
+        add_column(table, "updated", "TIMESTAMP")
+        db.session.execute(
+            text(f"UPDATE {table} SET updated = :now WHERE updated IS NULL").bindparams(
+                bindparam("now", type_=db.DateTime)),
+            {"now": now})
+
+
+def rich_text():
+    # Sanitized HTML for existing rows, `flask rich-text` adds the image variants later
+    from webApp.richtext import clean_html, text_html
+
+    add_column("sections", "html_cs", "TEXT")
+    add_column("sections", "html_sk", "TEXT")
+    add_column("candidates", "message_html", "TEXT")
+    for row_id, body_cs, body_sk in db.session.execute(text(
+            "SELECT id, body_cs, body_sk FROM sections WHERE html_cs IS NULL OR html_sk IS NULL")).fetchall():
+        db.session.execute(text("UPDATE sections SET html_cs = :cs, html_sk = :sk WHERE id = :id"),
+                           {"cs": clean_html(body_cs), "sk": clean_html(body_sk), "id": row_id})
+    last_id = 0
+    while True:
+        rows = db.session.execute(text(
+            "SELECT id, message FROM candidates WHERE message_html IS NULL AND id > :id ORDER BY id LIMIT 500"),
+            {"id": last_id}).fetchall()
+        if not rows:
+            break
+        db.session.execute(text("UPDATE candidates SET message_html = :html WHERE id = :id"),
+                           [{"html": text_html(message), "id": row_id} for row_id, message in rows])
+        last_id = rows[-1][0]
+
+
+def outbox_attachment_key():
+    add_column("outbox", "attachment_key", "VARCHAR(250)")
+
+
+def positions():
+    # Existing rows keep the order they had, which was by id
+    for table, index, columns in (("sections", "ix_sections_context_position", "context, position, id"),
+                                  ("personalists", "ix_personalists_position", "position, id")):
+        add_column(table, "position", "INTEGER")
+        db.session.execute(text(f"UPDATE {table} SET position = id WHERE position IS NULL"))
+        create_index(index, table, columns)
+
+
+def candidate_attempts():
+    add_column("candidates", "attempts", "INTEGER NOT NULL DEFAULT 0")
+
+
+def user_password_length():
+    widen_column("users", "password", "VARCHAR(255)")
+
+
+def user_revoked_at():
+    add_column("users", "revoked_at", "TIMESTAMP")
+
+
+MIGRATIONS = [
+    ("0001_candidate_filename", candidate_filename),
+    ("0002_candidate_created", candidate_created),
+    ("0003_candidate_search", candidate_search),
+    ("0004_image_variants", image_variants),
+    ("0005_page_indexes", page_indexes),
+    ("0006_candidate_cv_check", candidate_cv_check),
+    ("0007_content_updated", content_updated),
+    ("0008_rich_text", rich_text),
+    ("0009_outbox_attachment_key", outbox_attachment_key),
+    ("0010_positions", positions),
+    ("0011_candidate_attempts", candidate_attempts),
+    ("0012_user_password_length", user_password_length),
+    ("0013_user_revoked_at", user_revoked_at),
+]
+
+
+# pg_advisory_lock key of upgrade(), any constant shared by all workers
+MIGRATION_LOCK = 2021_0611
+
+
+@contextmanager
+def migration_lock():
+    """Lets one worker at a time run upgrade(), the others wait for it.
+
+    PostgreSQL takes an advisory lock on a connection of its own. SQLite
+    databases live on one host, a flock on a file next to the database
+    keeps the workers' ALTER TABLE and FTS rebuilds apart.
+    """
+    dialect = db.engine.dialect.name
+    database = db.engine.url.database
+    if dialect == "postgresql":
+        with db.engine.connect() as connection:
+            connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK})
+            try:
+                yield
+            finally:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK})
+    elif dialect == "sqlite" and database and database != ":memory:" and os.name == "posix":
+        import fcntl
+
+        with open(f"{database}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        yield
+
+
+def upgrade():
+    # New tables are created as a whole, existing ones are altered by the steps.
+    # Every worker runs this at startup, the lock makes the later ones find nothing to do.
+    with migration_lock():
+        try:
+            db.create_all()
+            applied = {migration.name for migration in SchemaMigration.query.all()}
+            for name, step in MIGRATIONS:
+                if name in applied:
+                    continue
+                step()
+                db.session.add(SchemaMigration(name=name))
+                db.session.commit()
+        finally:
+            db.session.remove()
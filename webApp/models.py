@@ -1,21 +1,23 @@
+import json
 import os
-import smtplib
 import string
-from email import encoders
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from collections import namedtuple
+from datetime import datetime
 from random import sample
 
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash
+from sqlalchemy import and_, func, literal_column, or_, text
 
-from webApp import db, login_manager
-from webApp import SMTP_USER, SMTP_PASS
+from webApp import db, file_storage, login_manager
+from webApp import SMTP_USER
+from webApp.identity import identity_cache
+from webApp.mailer import mailer
+from webApp.security import password_hasher
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    return identity_cache.get(user_id, lambda: User.query.get(user_id))
 
 
 class Setting(db.Model):
@@ -25,18 +27,36 @@ class Setting(db.Model):
     value = db.Column(db.String(250), nullable=False)
 
 
+class CacheStamp(db.Model):
+    # Bumped on every admin edit and shared by all nodes, see pagecache.PageCache
+    __tablename__ = "cache_stamps"
+    name = db.Column(db.String(100), primary_key=True)
+    stamp = db.Column(db.BigInteger, nullable=False)
+
+
 class User(UserMixin, db.Model):
     __tablename__ = "users"
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(100), unique=True, nullable=False)
-    password = db.Column(db.String(100), nullable=False)
+    # Hashes with the full salt and the method prefix go past 100 characters
+    password = db.Column(db.String(255), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     active = db.Column(db.Boolean(100), nullable=False)
+    # Bumped by every account change, ends cached sessions on all nodes, see webApp.identity
+    revoked_at = db.Column(db.DateTime, nullable=True)
 
     @staticmethod
-    def generate_password(email):
+    def generate_password():
+        # The hash comes first, HashingBusy leaves nothing mailed or saved
         chars = string.ascii_letters + string.digits
         new_password = "".join(sample(chars, 8))
+        return new_password, password_hasher.hash(new_password)
+
+    @staticmethod
+    def send_password(email, new_password):
+        # Called once the hash is committed, the mailed password always works
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
 
         msg = MIMEMultipart()
         msg["From"] = SMTP_USER
@@ -48,33 +68,47 @@ class User(UserMixin, db.Model):
             f"Po přihlášení si jej prosím změňte.", "plain"))
         text_msg = msg.as_string()
 
-        with smtplib.SMTP("smtp.gmail.com") as mailserver:
-            mailserver.starttls()
-            mailserver.login(user=SMTP_USER,
-                            password=SMTP_PASS)
-            mailserver.sendmail(
-                from_addr=SMTP_USER,
-                to_addrs=email,
-                msg=text_msg
-            )
-        hashed_password = generate_password_hash(
-            new_password, method="pbkdf2:sha256", salt_length=8)
-        return hashed_password
-
-
-class Section(db.Model):
+        mailer.send(SMTP_USER, email, text_msg)
+
+
+class ImageMixin:
+    # Dimensions and responsive variants of image_url, see webApp.images
+    image_width = db.Column(db.Integer, nullable=True)
+    image_height = db.Column(db.Integer, nullable=True)
+    image_variants = db.Column(db.Text, nullable=True)
+
+    @property
+    def image_sources(self):
+        return json.loads(self.image_variants) if self.image_variants else None
+
+
+class UpdatedMixin:
+    # Newest of these feeds Last-Modified of the public pages, see pagecache
+    updated = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Section(ImageMixin, UpdatedMixin, db.Model):
     __tablename__ = "sections"
+    __table_args__ = (db.Index("ix_sections_context_id", "context", "id"),
+                      db.Index("ix_sections_context_position", "context", "position", "id"))
     id = db.Column(db.Integer, primary_key=True)
     title_cs = db.Column(db.String(100), nullable=False)
     title_sk = db.Column(db.String(100), nullable=False)
     body_cs = db.Column(db.Text, nullable=False)
     body_sk = db.Column(db.Text, nullable=False)
+    # Sanitized and minified bodies rendered on the pages, see webApp.richtext
+    html_cs = db.Column(db.Text, nullable=True)
+    html_sk = db.Column(db.Text, nullable=True)
     context = db.Column(db.String(100), nullable=False)
     image_url = db.Column(db.String(250), nullable=True)
+    # Order on the page, set with next_position and changed in bulk, see webApp.bulk
+    position = db.Column(db.Integer, nullable=True)
 
 
-class Persona(db.Model):
+class Persona(ImageMixin, UpdatedMixin, db.Model):
     __tablename__ = "personalists"
+    __table_args__ = (db.Index("ix_personalists_area_id", "area", "id"),
+                      db.Index("ix_personalists_position", "position", "id"))
     id = db.Column(db.Integer, primary_key=True)
     fullname = db.Column(db.String(100), nullable=False)
     position_cs = db.Column(db.String(100), nullable=False)
@@ -83,47 +117,148 @@ class Persona(db.Model):
     email = db.Column(db.String(50), nullable=False)
     image_url = db.Column(db.String(250), nullable=True)
     area = db.Column(db.String(50), nullable=False)
+    position = db.Column(db.Integer, nullable=True)
 
 
-class Video(db.Model):
+class Video(UpdatedMixin, db.Model):
     __tablename__ = "videos"
+    __table_args__ = (db.Index("ix_videos_context_id", "video_context", "id"),)
     id = db.Column(db.Integer, primary_key=True)
     video_url = db.Column(db.String(100), nullable=False)
     video_context = db.Column(db.String(100), nullable=False)
 
 
+PageData = namedtuple("PageData", ["sections", "video", "persona_list"])
+
+
+def next_position(column, *criteria):
+    # Position after the last row matching `criteria`, new rows are appended
+    return (db.session.query(func.max(column)).filter(*criteria).scalar() or 0) + 1
+
+
+def load_page(context, with_personas=False):
+    # One indexed, ordered query per table, so the count does not grow with the content
+    sections = Section.query.filter_by(context=context).order_by(Section.position, Section.id).all()
+    if with_personas:
+        return PageData(sections, None, Persona.query.order_by(Persona.position, Persona.id).all())
+    video = Video.query.filter_by(video_context=context).order_by(Video.id).first()
+    return PageData(sections, video, [])
+
+
+def page_modified(context):
+    # Newest edit among the rows load_page returns for the context, in one query
+    newest = [db.session.query(func.max(Section.updated)).filter(Section.context == context)]
+    if context == "index":
+        newest.append(db.session.query(func.max(Persona.updated)))
+    else:
+        newest.append(db.session.query(func.max(Video.updated)).filter(Video.video_context == context))
+    row = db.session.query(*(query.scalar_subquery() for query in newest)).one()
+    return max((value for value in row if value is not None), default=None)
+
+
 class Candidate(db.Model):
     __tablename__ = "candidates"
+    __table_args__ = (db.Index("ix_candidates_created_id", "created", "id"),
+                      db.Index("ix_candidates_status", "status"))
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.String(100), nullable=False)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.now)
     fullname = db.Column(db.String(250), nullable=False)
     email = db.Column(db.String(100), nullable=False)
     file = db.Column(db.String(250), nullable=False)
+    filename = db.Column(db.String(250), nullable=True)
     message = db.Column(db.Text, nullable=False)
+    message_html = db.Column(db.Text, nullable=True)
+    # pending until webApp.pipeline has checked the CV, then ready, rejected or unchecked
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    status_note = db.Column(db.String(250), nullable=True)
+    file_type = db.Column(db.String(100), nullable=True)
+    file_text = db.Column(db.Text, nullable=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def download_name(self):
+        # Rows stored before content addressing only have the name in `file`
+        return self.filename or self.file
+
+    @staticmethod
+    def search_clause(term):
+        # Full-text match over fullname, email, message and the CV text, see migrations.candidate_cv_text
+        words = [word for word in term.split() if word]
+        dialect = db.engine.dialect.name
+        if dialect == "sqlite":
+            match = " ".join('"{}"*'.format(word.replace('"', '""')) for word in words)
+            return Candidate.id.in_(
+                text("SELECT rowid FROM candidates_fts WHERE candidates_fts MATCH :match")
+                .bindparams(match=match).columns(rowid=db.Integer))
+        if dialect == "postgresql":
+            # Literals instead of bind parameters, the planner only uses ix_candidates_search_cv
+            # when the expression is spelled exactly like the index
+            space, config = literal_column("' '"), literal_column("'simple'")
+            document = func.to_tsvector(
+                config, Candidate.fullname.op("||")(space).op("||")(Candidate.email).op("||")(space)
+                .op("||")(Candidate.message).op("||")(space)
+                .op("||")(func.coalesce(Candidate.file_text, literal_column("''"))))
+            return document.op("@@")(func.plainto_tsquery(config, " ".join(words)))
+        return and_(*(or_(Candidate.fullname.ilike(f"%{word}%"),
+                          Candidate.email.ilike(f"%{word}%"),
+                          Candidate.message.ilike(f"%{word}%"),
+                          Candidate.file_text.ilike(f"%{word}%")) for word in words))
+
+    def send_by_email(self, recipient, file_key, note=None):
+        # Only queues the message, it is delivered later by the mail queue
+        body = f"Zpráva od:\n\n{self.fullname}\n{self.email}\n\n{self.message}"
+        if note:
+            body += f"\n\n{note}"
+        message = OutboxMessage(
+            sender=self.email,
+            recipient=recipient,
+            subject=f"{self.fullname} má zájem o práci",
+            body=body,
+            attachment_key=file_key,
+            attachment_name=self.download_name
+        )
+        db.session.add(message)
+        return message
+
+
+class OutboxMessage(db.Model):
+    __tablename__ = "outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sender = db.Column(db.String(100), nullable=False)
+    recipient = db.Column(db.String(100), nullable=False)
+    subject = db.Column(db.String(250), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    # A key in file_storage, attachment_path is only set on messages queued before it
+    attachment_key = db.Column(db.String(250), nullable=True)
+    attachment_path = db.Column(db.String(500), nullable=True)
+    attachment_name = db.Column(db.String(250), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default="pending", index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    def as_string(self):
+        # The email package is loaded by the mail queue, not at startup
+        from email import encoders
+        from email.mime.base import MIMEBase
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
 
-    def send_by_email(self, recipient, path_to_file):
         msg = MIMEMultipart()
-        msg["From"] = self.email
-        msg["To"] = recipient
-        msg["Subject"] = f"{self.fullname} má zájem o práci"
-        msg.attach(
-            MIMEText(f"Zpráva od:\n\n{self.fullname}\n{self.email}\n\n{self.message}", "plain"))
-
-        payload = MIMEBase("application", "octate-stream")
-        with open(path_to_file, "rb") as file:
-            payload.set_payload(file.read())
-            encoders.encode_base64(payload)
-            payload.add_header('Content-Disposition',
-                               'attachement', filename=self.file)
-            msg.attach(payload)
-        text = msg.as_string()
-
-        with smtplib.SMTP("smtp.gmail.com") as mailserver:
-            mailserver.starttls()
-            mailserver.login(user=SMTP_USER,
-                             password=SMTP_PASS)
-            mailserver.sendmail(
-                from_addr=self.email,
-                to_addrs=recipient,
-                msg=text
-            )
+        msg["From"] = self.sender
+        msg["To"] = self.recipient
+        msg["Subject"] = self.subject
+        msg.attach(MIMEText(self.body, "plain"))
+
+        if self.attachment_key or self.attachment_path:
+            payload = MIMEBase("application", "octate-stream")
+            with (file_storage.open(self.attachment_key) if self.attachment_key
+                  else open(self.attachment_path, "rb")) as file:
+                payload.set_payload(file.read())
+                encoders.encode_base64(payload)
+                payload.add_header('Content-Disposition',
+                                   'attachement', filename=self.attachment_name)
+                msg.attach(payload)
+        return msg.as_string()
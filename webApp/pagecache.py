@@ -0,0 +1,220 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import g, make_response, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy.exc import IntegrityError
+
+from webApp import app, db, locales
+from webApp.assets import BUILD_DIR, MANIFEST
+from webApp.lang import negotiate_language
+from webApp.models import CacheStamp, page_modified
+
+
+CSRF_PLACEHOLDER = "__PAGE_CACHE_CSRF_TOKEN__"
+ALL_CONTEXTS = "_all"
+PUBLIC_CONTEXTS = ("centrala", "prodejny", "sklady")
+PAGE_CONTEXTS = ("index",) + PUBLIC_CONTEXTS
+
+
+class PageCache:
+    """Bounded LRU of rendered public pages keyed by (endpoint, context, lang).
+
+    Invalidation bumps a per-context row in cache_stamps, so every worker
+    process on every node drops its copy of the page, not only the one that
+    handled the admin edit. All stamps are re-read in one query at most
+    every `check_interval` seconds. Callables in `listeners` are called with
+    the context after every invalidation on this node.
+
+    Only the pages in `contexts` are cached, which also bounds the stamps and
+    Last-Modified values kept per context.
+    """
+
+    def __init__(self, max_entries=64, check_interval=2.0, contexts=PAGE_CONTEXTS):
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self.contexts = tuple(contexts)
+        self._lock = threading.Lock()
+        self._refresh = threading.Lock()
+        self._entries = OrderedDict()
+        self._stamps = {}
+        self._checked = None
+        self._modified = {}
+        self.listeners = []
+
+    def stamps(self, fresh=False):
+        # The query runs outside _lock, one thread reloads while the others keep
+        # serving with the stamps they have
+        now = time.monotonic()
+        if not fresh and self._checked is not None and now - self._checked < self.check_interval:
+            return self._stamps
+        if not self._refresh.acquire(blocking=fresh or self._checked is None):
+            return self._stamps
+        try:
+            stamps = dict(db.session.query(CacheStamp.name, CacheStamp.stamp).filter(
+                CacheStamp.name.in_(self.contexts + (ALL_CONTEXTS,))))
+            with self._lock:
+                self._stamps = stamps
+                self._checked = now
+        finally:
+            self._refresh.release()
+        return self._stamps
+
+    def _generation(self, context):
+        stamps = self.stamps()
+        return stamps.get(context, 0), stamps.get(ALL_CONTEXTS, 0)
+
+    def get(self, key, context):
+        generation = self._generation(context)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != generation:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, context, html):
+        if context not in self.contexts:
+            return
+        generation = self._generation(context)
+        with self._lock:
+            self._entries[key] = (generation, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def last_modified(self, context, load, deployed=0):
+        """Newest of the content rows, the edit stamps, lang.json and `deployed`.
+
+        The stamps are touched by every admin edit, deletes included, so the
+        value is recomputed only when the generation changes. The database
+        side keeps it correct when cache_stamps starts out empty.
+        """
+        generation = self._generation(context) + (locales.version,)
+        with self._lock:
+            cached = self._modified.get(context)
+            if cached and cached[0] == generation:
+                return cached[1]
+        newest = max(generation + (deployed,))
+        modified = datetime.fromtimestamp(newest // 10**9, timezone.utc)
+        content = load(context)
+        if content is not None:
+            modified = max(modified, content.replace(tzinfo=timezone.utc, microsecond=0))
+        if context in self.contexts:
+            with self._lock:
+                self._modified[context] = (generation, modified)
+        return modified
+
+    def invalidate(self, context=ALL_CONTEXTS):
+        # Commits the stamp on its own, call it after the edit is committed
+        if context != ALL_CONTEXTS and context not in self.contexts:
+            # No page shows it, so nothing was cached
+            return
+        stamp = time.time_ns()
+        for retry in (False, True):
+            if not CacheStamp.query.filter_by(name=context).update({"stamp": stamp}, synchronize_session=False):
+                db.session.add(CacheStamp(name=context, stamp=stamp))
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                # Another node inserted the row first, update it instead
+                db.session.rollback()
+                if retry:
+                    raise
+        with self._lock:
+            for key in list(self._entries):
+                if context == ALL_CONTEXTS or key[1] == context:
+                    del self._entries[key]
+            self._stamps = dict(self._stamps, **{context: stamp})
+        for listener in self.listeners:
+            listener(context)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._modified.clear()
+
+
+page_cache = PageCache(max_entries=app.config["PAGE_CACHE_SIZE"])
+
+
+def _deployed():
+    # Templates and the asset manifest change with every deploy
+    paths = [os.path.join(app.static_folder, BUILD_DIR, MANIFEST)]
+    for root, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        paths.extend(os.path.join(root, name) for name in files)
+    newest = 0
+    for path in paths:
+        try:
+            newest = max(newest, os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            pass
+    return newest
+
+
+DEPLOYED = _deployed()
+
+
+def _conditional(html, modified, etag=None):
+    response = make_response(html)
+    if etag:
+        response.set_etag(etag, weak=True)
+    response.last_modified = modified
+    # Browsers keep the page but ask every time, the answer is usually a 304
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add("Accept-Language")
+    response.vary.add("Cookie")
+    return response.make_conditional(request)
+
+
+def cached_page(view):
+    # Anonymous GETs are served from the cache; admins, form posts and pages
+    # carrying flashed messages always get a live render.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if (request.method != "GET" or "_flashes" in session or current_user.is_authenticated
+                or g.get("static_page")):
+            return view(*args, **kwargs)
+
+        context = kwargs.get("context", "index")
+        modified = page_cache.last_modified(context, page_modified, DEPLOYED)
+        # If-None-Match takes precedence, without it nothing needs rendering
+        if (request.if_modified_since and not request.if_none_match
+                and modified <= request.if_modified_since):
+            return _conditional("", modified)
+
+        lang = negotiate_language()
+        key = (request.endpoint, context, lang, locales.version)
+        html = page_cache.get(key, context) if app.config["PAGE_CACHE_ENABLED"] else None
+        if html is None:
+            html = view(*args, **kwargs)
+            if not isinstance(html, str):
+                return html
+            if "csrf_token" in g:
+                cached = html.replace(g.csrf_token, CSRF_PLACEHOLDER)
+            else:
+                cached = html
+            if app.config["PAGE_CACHE_ENABLED"]:
+                page_cache.set(key, context, cached)
+        else:
+            cached = html
+            if CSRF_PLACEHOLDER in html:
+                html = html.replace(CSRF_PLACEHOLDER, generate_csrf())
+
+        # The per-session CSRF token is part of pages with a form
+        digest = hashlib.sha1(cached.encode())
+        if CSRF_PLACEHOLDER in cached:
+            digest.update(session.get("csrf_token", "").encode())
+        return _conditional(html, modified, digest.hexdigest())
+    return wrapper
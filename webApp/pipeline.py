@@ -0,0 +1,387 @@
+import os
+import re
+import socket
+import struct
+import threading
+import zipfile
+import zlib
+from concurrent.futures import Future
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from webApp import app, db, file_storage
+from webApp.mail import mail_queue
+from webApp.models import Candidate, Setting
+
+
+MAX_UNPACKED = 100 * 1024 * 1024
+MAX_TEXT = 200000
+
+PDF = "application/pdf"
+DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+ODT = "application/vnd.oasis.opendocument.text"
+DOC = "application/msword"
+RTF = "application/rtf"
+
+# What a broken or encrypted archive raises, the same file fails the same way every time
+ZIP_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError)
+
+
+class Rejected(Exception):
+    """The file must not be passed on, `reason` is shown to the administrator."""
+
+    def __init__(self, reason, infected=False):
+        super().__init__(reason, infected)
+        self.reason = reason
+        self.infected = infected
+
+
+### Stages, each one gets the stored path and the result collected so far.
+### They run in worker processes, so they have to be picklable.
+
+def sniff_type(path, result):
+    with open(path, "rb") as file:
+        head = file.read(8)
+    if head.startswith(b"%PDF-"):
+        result["type"] = PDF
+    elif head.startswith(b"PK\x03\x04"):
+        try:
+            with zipfile.ZipFile(path) as archive:
+                names = set(archive.namelist())
+                if "word/document.xml" in names:
+                    result["type"] = DOCX
+                elif "mimetype" in names and archive.read("mimetype").strip() == ODT.encode():
+                    result["type"] = ODT
+        except ZIP_ERRORS:
+            raise Rejected("Poškozený ZIP archiv.")
+    elif head.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
+        result["type"] = DOC
+    elif head.startswith(b"{\\rtf"):
+        result["type"] = RTF
+    if "type" not in result:
+        raise Rejected("Nepodporovaný formát souboru.")
+
+
+def validate_structure(path, result):
+    if result["type"] == PDF:
+        with open(path, "rb") as file:
+            data = file.read()
+        if b"%%EOF" not in data[-2048:] or b"/Root" not in data:
+            raise Rejected("Neplatný nebo neúplný PDF soubor.")
+    elif result["type"] in (DOCX, ODT):
+        try:
+            with zipfile.ZipFile(path) as archive:
+                members = archive.infolist()
+                if sum(member.file_size for member in members) > MAX_UNPACKED:
+                    raise Rejected("Dokument je po rozbalení příliš velký.")
+                if any(member.filename.lower().endswith("vbaproject.bin") for member in members):
+                    raise Rejected("Dokument obsahuje makra.")
+                if archive.testzip() is not None:
+                    raise Rejected("Poškozený dokument.")
+        except ZIP_ERRORS:
+            raise Rejected("Poškozený dokument.")
+
+
+class ClamdScanner:
+    """INSTREAM scan through a clamd compatible socket, a unix path or host:port."""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, address, timeout=30):
+        self.address = address
+        self.timeout = timeout
+
+    def _connect(self):
+        if ":" in self.address and not self.address.startswith("/"):
+            host, port = self.address.rsplit(":", 1)
+            return socket.create_connection((host, int(port)), timeout=self.timeout)
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(self.timeout)
+        conn.connect(self.address)
+        return conn
+
+    def __call__(self, path, result):
+        with self._connect() as conn, open(path, "rb") as file:
+            conn.sendall(b"zINSTREAM\0")
+            for chunk in iter(lambda: file.read(self.chunk_size), b""):
+                conn.sendall(struct.pack("!L", len(chunk)) + chunk)
+            conn.sendall(struct.pack("!L", 0))
+            reply = b""
+            while not reply.endswith(b"\0"):
+                data = conn.recv(4096)
+                if not data:
+                    break
+                reply += data
+        reply = reply.rstrip(b"\0").decode("utf-8", "replace")
+        if reply.endswith("FOUND"):
+            raise Rejected(f"Antivirus: {reply.split(':', 1)[-1].strip()}", infected=True)
+        if not reply.endswith("OK"):
+            # Scanner trouble is not the candidate's fault, the file is retried later
+            raise OSError(f"Unexpected clamd reply: {reply!r}")
+
+
+PDF_STREAM = re.compile(rb"<<(.*?)>>\s*stream\r?\n(.*?)\r?\n?endstream", re.S)
+PDF_TEXT = re.compile(rb"\(((?:\\.|[^\\)])*)\)\s*Tj|\[((?:\\.|[^\]])*)\]\s*TJ", re.S)
+PDF_STRING = re.compile(rb"\(((?:\\.|[^\\)])*)\)", re.S)
+PDF_ESCAPE = re.compile(rb"\\([0-7]{1,3}|.)", re.S)
+PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+
+
+def _pdf_string(raw):
+    def unescape(match):
+        value = match.group(1)
+        if value.isdigit():
+            return bytes([int(value, 8) & 0xFF])
+        return PDF_ESCAPES.get(value, value)
+    return PDF_ESCAPE.sub(unescape, raw).decode("latin-1")
+
+
+def _pdf_text(path):
+    # Best effort: literal strings shown by Tj/TJ in plain or Flate streams.
+    # Fonts with custom encodings come out as noise and are left to search.
+    with open(path, "rb") as file:
+        data = file.read()
+    parts = []
+    for header, stream in PDF_STREAM.findall(data):
+        if b"/FlateDecode" in header:
+            try:
+                stream = zlib.decompressobj().decompress(stream, MAX_UNPACKED)
+            except zlib.error:
+                continue
+        elif b"/Filter" in header:
+            continue
+        for shown, array in PDF_TEXT.findall(stream):
+            if shown:
+                parts.append(_pdf_string(shown))
+            else:
+                parts.append("".join(_pdf_string(item) for item in PDF_STRING.findall(array)))
+    return " ".join(parts)
+
+
+def _xml_text(path, member, paragraph):
+    from xml.etree import ElementTree
+
+    try:
+        with zipfile.ZipFile(path) as archive:
+            root = ElementTree.fromstring(archive.read(member))
+    except (ElementTree.ParseError, KeyError) + ZIP_ERRORS:
+        raise Rejected("Text dokumentu nelze přečíst.")
+    lines = ("".join(node.itertext()) for node in root.iter(paragraph))
+    return "\n".join(line for line in lines if line.strip())
+
+
+def extract_text(path, result):
+    if result["type"] == PDF:
+        try:
+            text = _pdf_text(path)
+        except (ValueError, RecursionError, MemoryError):
+            raise Rejected("Text dokumentu nelze přečíst.")
+    elif result["type"] == DOCX:
+        text = _xml_text(path, "word/document.xml",
+                         "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}p")
+    elif result["type"] == ODT:
+        text = _xml_text(path, "content.xml", "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}p")
+    else:
+        return
+    result["text"] = re.sub(r"[ \t\x00-\x08\x0b-\x1f]+", " ", text).strip()[:MAX_TEXT]
+
+
+def run_stages(path, stages):
+    result = {}
+    for stage in stages:
+        stage(path, result)
+    return result
+
+
+def default_stages(scan_socket=""):
+    stages = [sniff_type]
+    if scan_socket:
+        stages.append(ClamdScanner(scan_socket))
+    return stages + [validate_structure, extract_text]
+
+
+### Background processing of pending candidates
+
+class CVPipeline:
+    """Runs `stages` over the CV of every pending candidate.
+
+    A dispatcher thread claims up to `batch_size` pending candidates with a
+    conditional UPDATE of `lease_until`, like MailQueue does for messages,
+    and checks their files in parallel in a pool of `workers` processes.
+    Accepted CVs are indexed and mailed, rejected ones are mailed without
+    the attachment. A candidate whose check crashed stays pending and is
+    picked up again after the lease runs out, until it was claimed
+    `max_attempts` times; then it is marked unchecked and mailed without the
+    attachment too. With `workers=0` nothing is started and run_pending()
+    checks the files inline.
+    """
+
+    def __init__(self, stages, workers=2, lease=300, poll_interval=30, batch_size=None, max_attempts=5):
+        self.stages = stages
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size or max(4, 2 * workers)
+        self.timeout = lease / 2
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def _executor(self):
+        # A pool inherited through a gunicorn fork is unusable, start a new one
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _submit(self, path):
+        if self.workers:
+            return self._executor().submit(run_stages, path, self.stages)
+        future = Future()
+        try:
+            future.set_result(run_stages(path, self.stages))
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+    def _submit_stored(self, copies, key):
+        # Remote storage is fetched into a temporary file that lives until the batch is done
+        try:
+            path = copies.enter_context(file_storage.local_copy(key))
+        except OSError as err:
+            future = Future()
+            future.set_exception(err)
+            return future
+        return self._submit(path)
+
+    def _claim(self):
+        now = datetime.utcnow()
+        due = Candidate.query.filter(
+            Candidate.status == "pending",
+            or_(Candidate.lease_until.is_(None), Candidate.lease_until <= now)
+        ).order_by(Candidate.id).limit(self.batch_size).all()
+        claimed = []
+        for candidate in due:
+            updated = Candidate.query.filter_by(
+                id=candidate.id, status="pending", lease_until=candidate.lease_until
+            ).update({"lease_until": now + timedelta(seconds=self.lease),
+                      "attempts": Candidate.attempts + 1}, synchronize_session=False)
+            if updated:
+                claimed.append(candidate.id)
+        db.session.commit()
+        if not claimed:
+            return []
+        return Candidate.query.filter(Candidate.id.in_(claimed)).all()
+
+    def process_batch(self):
+        claimed = self._claim()
+        if not claimed:
+            return 0
+        recipient = Setting.query.filter_by(name="email").first().value
+        with ExitStack() as copies:
+            jobs = [(candidate, self._submit_stored(copies, candidate.file)) for candidate in claimed]
+            for candidate, future in jobs:
+                try:
+                    result = future.result(timeout=self.timeout)
+                except Rejected as err:
+                    self._rejected(candidate, err, recipient)
+                except FileNotFoundError:
+                    self._rejected(candidate, Rejected("Soubor nebyl nalezen."), recipient)
+                except Exception:
+                    if candidate.attempts >= self.max_attempts:
+                        app.logger.exception("Checking the CV of candidate %s failed, giving up", candidate.id)
+                        self._unchecked(candidate, recipient)
+                    else:
+                        app.logger.exception("Checking the CV of candidate %s failed, will retry", candidate.id)
+                else:
+                    candidate.status = "ready"
+                    candidate.file_type = result["type"]
+                    candidate.file_text = result.get("text")
+                    candidate.send_by_email(recipient, candidate.file)
+        db.session.commit()
+        mail_queue.notify()
+        return len(claimed)
+
+    def _rejected(self, candidate, err, recipient):
+        app.logger.warning("CV of candidate %s rejected: %s", candidate.id, err.reason)
+        candidate.status = "rejected"
+        candidate.status_note = err.reason
+        if err.infected:
+            shared = Candidate.query.filter(Candidate.file == candidate.file, Candidate.id != candidate.id,
+                                            Candidate.status != "rejected").first()
+            if not shared:
+                file_storage.delete(candidate.file)
+        candidate.send_by_email(recipient, None, note=f"Životopis nebyl přiložen: {err.reason}")
+
+    def _unchecked(self, candidate, recipient):
+        # HR still gets the application, the unchecked file only through the administration
+        candidate.status = "unchecked"
+        candidate.status_note = f"Kontrola selhala {candidate.attempts}×."
+        candidate.send_by_email(recipient, None, note="Životopis se nepodařilo zkontrolovat, "
+                                                      "je ke stažení v administraci.")
+
+    def run_pending(self):
+        # Drains the backlog right now, used by the CLI and tests
+        processed = 0
+        with app.app_context():
+            try:
+                while True:
+                    count = self.process_batch()
+                    if not count:
+                        break
+                    processed += count
+            finally:
+                db.session.remove()
+        return processed
+
+    def _run(self):
+        while not self._stop.is_set():
+            with app.app_context():
+                try:
+                    busy = self.process_batch()
+                except Exception:
+                    app.logger.exception("CV pipeline failed")
+                    busy = False
+                finally:
+                    db.session.remove()
+            if not busy:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def start(self):
+        with self._lock:
+            if self._thread or not self.workers:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="cv-pipeline", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def notify(self):
+        self._wake.set()
+
+
+cv_pipeline = CVPipeline(
+    default_stages(app.config["CV_SCAN_SOCKET"]),
+    workers=app.config["CV_CHECK_WORKERS"],
+    max_attempts=app.config["CV_CHECK_ATTEMPTS"])
+
+
+@app.before_first_request
+def start_cv_pipeline():
+    cv_pipeline.start()
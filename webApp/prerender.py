@@ -0,0 +1,213 @@
+import gzip
+import os
+import queue
+import tempfile
+import threading
+
+from flask import flash, g
+from flask_login import current_user
+
+from webApp import app, db
+from webApp.lang import LANGUAGES
+from webApp.pagecache import ALL_CONTEXTS, PAGE_CONTEXTS, page_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def page_path(root, lang, context):
+    # <root>/cs/index.html and <root>/cs/pages/prodejny.html mirror the public URLs
+    if context == "index":
+        return os.path.join(root, lang, "index.html")
+    return os.path.join(root, lang, "pages", f"{context}.html")
+
+
+def render_page(context, lang):
+    """Render a public page the way an anonymous visitor would get it.
+
+    A fresh app context keeps g (and the CSRF token in it) apart from the
+    admin request that may be running. The token is left out of the HTML,
+    the page fetches it with the flashed messages from /fragment.
+    """
+    path = "/" if context == "index" else f"/pages/{context}"
+    with app.app_context(), app.test_request_context(path, headers={"Accept-Language": lang}):
+        g.static_page = True
+        if context == "index":
+            html = app.view_functions["index"]()
+        else:
+            html = app.view_functions["mainpage"](context=context)
+        if "csrf_token" in g:
+            html = html.replace(g.csrf_token, "")
+        return html
+
+
+def _write(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".page-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_page(path, html):
+    # Unchanged pages keep their mtime, so the front server's validators stay valid
+    data = html.encode("utf-8")
+    try:
+        with open(path, "rb") as current:
+            if current.read() == data:
+                return False
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _write(path + ".br", brotli.compress(data))
+    _write(path, data)
+    return True
+
+
+def export_pages(root, contexts=None):
+    """Render every context in every language below `root`.
+
+    Returns the number of files that changed. Pages are written atomically,
+    a front server never sees half of one.
+    """
+    if contexts is None:
+        contexts = PAGE_CONTEXTS
+    written = 0
+    for context in contexts:
+        for lang in LANGUAGES:
+            written += write_page(page_path(root, lang, context), render_page(context, lang))
+    return written
+
+
+class StaticExporter:
+    """Rewrites the static copies of edited pages in a background thread.
+
+    Rendering inside the admin request would share its database session,
+    and the app context of the render removes that session on teardown.
+    Contexts whose export failed stay in `failed` until a later export of
+    them succeeds, administrators are told on their next page.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.failed = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def export(self, context):
+        self._queue.put(context)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="static-export", daemon=True)
+                self._thread.start()
+
+    def join(self):
+        # Blocks until every queued context was exported
+        self._queue.join()
+
+    def export_now(self, context):
+        contexts = PAGE_CONTEXTS if context == ALL_CONTEXTS else (context,)
+        try:
+            written = export_pages(self.root, contexts)
+        except Exception as err:
+            app.logger.exception("Static export of %s failed, run `flask prerender`", context)
+            with self._lock:
+                self.failed[context] = f"{type(err).__name__}: {err}"
+            return 0
+        with self._lock:
+            for name in (list(self.failed) if context == ALL_CONTEXTS else (context,)):
+                self.failed.pop(name, None)
+        return written
+
+    def pop_failed(self):
+        with self._lock:
+            failed, self.failed = self.failed, {}
+        return failed
+
+    def _run(self):
+        while True:
+            context = self._queue.get()
+            try:
+                self.export_now(context)
+            finally:
+                self._queue.task_done()
+
+
+static_exporter = StaticExporter(app.config["STATIC_EXPORT_DIR"])
+
+
+class ExportWatcher:
+    """Re-exports the pages whose stamps changed since the last look.
+
+    Visitors of this node get the static copies from the front server, so
+    an edit made on another node would otherwise never reach them. The
+    first look only records the stamps, `flask prerender` covers startup.
+    """
+
+    def __init__(self, root, interval=5):
+        self.root = root
+        self.interval = interval
+        self._seen = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        with app.app_context():
+            try:
+                stamps = dict(page_cache.stamps(fresh=True))
+            finally:
+                db.session.remove()
+        seen, self._seen = self._seen, stamps
+        if seen is None:
+            return 0
+        changed = {name for name, stamp in stamps.items() if seen.get(name) != stamp}
+        if ALL_CONTEXTS in changed:
+            return export_pages(self.root)
+        contexts = tuple(context for context in PAGE_CONTEXTS if context in changed)
+        return export_pages(self.root, contexts) if contexts else 0
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                app.logger.exception("Static export watcher failed")
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        if self._thread or not self.interval:
+            return
+        self._thread = threading.Thread(target=self._run, name="export-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+export_watcher = ExportWatcher(app.config["STATIC_EXPORT_DIR"], interval=app.config["STATIC_EXPORT_POLL"])
+
+
+if app.config["STATIC_EXPORT_DIR"]:
+    # Admin edits invalidate the page cache, the static copies follow right after
+    page_cache.listeners.append(static_exporter.export)
+
+    @app.before_request
+    def report_failed_exports():
+        if current_user.is_authenticated and static_exporter.failed:
+            pages = ", ".join(sorted(static_exporter.pop_failed()))
+            flash(f"Statické kopie stránek ({pages}) se nepodařilo obnovit, spusťte prosím `flask prerender`.",
+                  category="danger")
+
+    @app.before_first_request
+    def start_export_watcher():
+        export_watcher.start()
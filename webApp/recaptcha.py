@@ -0,0 +1,200 @@
+import hashlib
+import http.client
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode, urlsplit
+
+from flask import current_app, request
+from flask_wtf import Recaptcha
+from wtforms import ValidationError
+
+from webApp import app
+
+
+VERIFIED = "verified"
+REJECTED = "rejected"
+UNAVAILABLE = "unavailable"
+
+
+class CircuitBreaker:
+    """Opens after `failures` failed calls in a row and rejects calls for
+    `cooldown` seconds, then lets a single trial call through."""
+
+    def __init__(self, failures=3, cooldown=30):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._count = 0
+        self._open_until = None
+        self._trial = False
+
+    def allow(self):
+        with self._lock:
+            if self._open_until is None:
+                return True
+            if time.monotonic() >= self._open_until and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._count = 0
+            self._open_until = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self._trial or self._count >= self.failures:
+                self._open_until = time.monotonic() + self.cooldown
+                self._trial = False
+
+
+class ReplayCache:
+    # Digests of tokens seen in the last `ttl` seconds, a token is accepted once
+    def __init__(self, ttl=300, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+
+    def seen(self, token):
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.monotonic()
+        with self._lock:
+            while self._seen and (next(iter(self._seen.values())) < now or len(self._seen) >= self.max_entries):
+                self._seen.popitem(last=False)
+            if digest in self._seen:
+                return True
+            self._seen[digest] = now + self.ttl
+            return False
+
+
+class RecaptchaClient:
+    """siteverify client with pooled keep-alive connections.
+
+    Every socket operation is bounded by `timeout`. At most `pool_size`
+    verifications run at once, a caller that cannot get a slot within the
+    timeout is answered UNAVAILABLE. Errors, timeouts and 5xx answers count
+    against the circuit breaker, which then answers UNAVAILABLE right away.
+    """
+
+    def __init__(self, url, secret, timeout=3.0, pool_size=4, breaker=None):
+        parts = urlsplit(url)
+        self.connection_class = (http.client.HTTPSConnection if parts.scheme == "https"
+                                 else http.client.HTTPConnection)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or "/"
+        self.secret = secret
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def _post(self, body):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        reused = conn is not None
+        if not reused:
+            conn = self.connection_class(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request("POST", self.path, body, {"Content-Type": "application/x-www-form-urlencoded"})
+            response = conn.getresponse()
+            data = response.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+            # The server dropped an idle keep-alive connection, one retry on a new one
+            with self._lock:
+                idle, self._idle = self._idle, []
+            for stale in idle:
+                stale.close()
+            return self._post(body)
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            with self._lock:
+                self._idle.append(conn)
+        if response.status >= 500:
+            raise http.client.HTTPException(f"siteverify answered {response.status}")
+        if response.status != 200:
+            return {"success": False}
+        return json.loads(data)
+
+    def verify(self, token, remote_ip):
+        if not self.breaker.allow():
+            return UNAVAILABLE
+        if not self._slots.acquire(timeout=self.timeout):
+            self.breaker.failure()
+            return UNAVAILABLE
+        try:
+            result = self._post(urlencode({"secret": self.secret, "response": token, "remoteip": remote_ip}))
+        except (OSError, http.client.HTTPException, ValueError) as err:
+            self.breaker.failure()
+            app.logger.warning("reCAPTCHA verification unavailable: %s: %s", type(err).__name__, err)
+            return UNAVAILABLE
+        finally:
+            self._slots.release()
+        self.breaker.success()
+        return VERIFIED if result.get("success") else REJECTED
+
+
+class StandInVerifier:
+    # Local answer for tests and benchmarks, e.g. RECAPTCHA_VERIFIER=pass:50
+    def __init__(self, result, delay=0.0):
+        self.result = result
+        self.delay = delay
+
+    def verify(self, token, remote_ip):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.result
+
+
+def make_verifier(config):
+    name, _, delay = config["RECAPTCHA_VERIFIER"].partition(":")
+    stand_ins = {"pass": VERIFIED, "fail": REJECTED, "down": UNAVAILABLE}
+    if name in stand_ins:
+        return StandInVerifier(stand_ins[name], float(delay or 0) / 1000)
+    return RecaptchaClient(
+        config["RECAPTCHA_VERIFY_URL"], config["RECAPTCHA_PRIVATE_KEY"],
+        timeout=config["RECAPTCHA_TIMEOUT"], pool_size=config["RECAPTCHA_POOL_SIZE"],
+        breaker=CircuitBreaker(config["RECAPTCHA_FAILURES"], config["RECAPTCHA_COOLDOWN"]))
+
+
+verifier = make_verifier(app.config)
+replay_cache = ReplayCache()
+
+
+class PooledRecaptcha(Recaptcha):
+    """Recaptcha validator that goes through `verifier` and `replay_cache`.
+
+    When the verifier is unavailable the form still validates, but the
+    field gets `degraded = True` and the application is held for review.
+    """
+
+    def __call__(self, form, field):
+        field.degraded = False
+        if current_app.testing and not current_app.config["RECAPTCHA_VERIFIER"]:
+            return True
+        token = request.form.get("g-recaptcha-response", "")
+        if not token:
+            raise ValidationError(field.gettext(self.message))
+        if replay_cache.seen(token):
+            field.recaptcha_error = "timeout-or-duplicate"
+            raise ValidationError(field.gettext(self.message))
+        result = verifier.verify(token, request.remote_addr)
+        if result == UNAVAILABLE:
+            field.degraded = True
+        elif result != VERIFIED:
+            field.recaptcha_error = "incorrect-captcha-sol"
+            raise ValidationError(field.gettext(self.message))
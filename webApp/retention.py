@@ -0,0 +1,152 @@
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from webApp import app, db, file_storage
+from webApp.models import Candidate, OutboxMessage
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Content-addressed keys from store_upload and the flat names CVs had before
+# them. Anything else in the storage was not put there for a candidate.
+CV_KEY = re.compile(r"^(?:[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}[^/]*|[^/]+)$")
+
+
+def purge_candidates(cutoff, batch_size=500, dry_run=False):
+    # Deletes applications created before `cutoff`, one short transaction per batch
+    purged = 0
+    last_id = 0
+    while True:
+        ids = [row.id for row in db.session.query(Candidate.id).filter(
+            Candidate.created < cutoff, Candidate.id > last_id
+        ).order_by(Candidate.id).limit(batch_size)]
+        if not ids:
+            return purged
+        last_id = ids[-1]
+        purged += len(ids)
+        if not dry_run:
+            Candidate.query.filter(Candidate.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+
+def sweep_files(storage, grace=3600, dry_run=False, cutoff=None):
+    """Remove stored files that no candidate or pending mail refers to.
+
+    Only CV keys (see CV_KEY) older than `grace` seconds are touched. store_upload stores a
+    duplicate CV again, which refreshes its modification time, and every
+    file is checked again right before it is deleted: first for a new
+    candidate or mail using it, then for a fresh modification time. A CV
+    being attached to a new application while the sweep runs is kept.
+    Returns the number of files removed and the bytes reclaimed. Candidates
+    created before `cutoff` are treated as gone already, which is what a dry
+    run needs.
+    """
+    query = db.session.query(Candidate.file.distinct().label("file"))
+    if cutoff is not None:
+        query = query.filter(Candidate.created >= cutoff)
+    referenced = {row.file for row in query}
+    for row in db.session.query(OutboxMessage.attachment_key, OutboxMessage.attachment_path).filter(
+            OutboxMessage.status == "pending"):
+        if row.attachment_key:
+            referenced.add(row.attachment_key)
+        elif row.attachment_path and storage.local:
+            referenced.add(os.path.relpath(row.attachment_path, storage.root).replace(os.sep, "/"))
+
+    deadline = time.time() - grace
+    removed = reclaimed = 0
+    for key, size, mtime in list(storage.list()):
+        if key in referenced or mtime > deadline or not CV_KEY.match(key):
+            continue
+        if not _unused(storage, key, deadline, cutoff):
+            continue
+        if not dry_run:
+            storage.delete(key)
+        removed += 1
+        reclaimed += size
+    return removed, reclaimed
+
+
+def _unused(storage, key, deadline, cutoff):
+    # A fresh snapshot each time. store_upload puts the file before the candidate
+    # is committed, so the rows are looked at first and the modification time after them.
+    db.session.rollback()
+    candidates = db.session.query(Candidate.id).filter(Candidate.file == key)
+    if cutoff is not None:
+        candidates = candidates.filter(Candidate.created >= cutoff)
+    if candidates.first() or db.session.query(OutboxMessage.id).filter(
+            OutboxMessage.status == "pending", OutboxMessage.attachment_key == key).first():
+        return False
+    stat = storage.stat(key)
+    return stat is not None and stat[1] <= deadline
+
+
+def run_retention(max_age_days=None, batch_size=500, grace=3600, dry_run=False):
+    if max_age_days is None:
+        max_age_days = app.config["RETENTION_DAYS"]
+    cutoff = datetime.now() - timedelta(days=max_age_days) if max_age_days else None
+    purged = purge_candidates(cutoff, batch_size, dry_run) if cutoff else 0
+    removed, reclaimed = sweep_files(file_storage, grace, dry_run, cutoff if dry_run else None)
+    app.logger.info("Retention%s: %d candidates purged, %d files removed, %.1f MB reclaimed",
+                    " (dry run)" if dry_run else "", purged, removed, reclaimed / 2**20)
+    return {"candidates": purged, "files": removed, "bytes": reclaimed}
+
+
+class RetentionWorker:
+    """Runs run_retention() every `interval` seconds in a background thread.
+
+    An exclusive lock on `lock_path` lets only one worker process do the
+    work, the others skip that round. Every run is safe to repeat.
+    """
+
+    def __init__(self, lock_path, interval=24 * 3600):
+        self.lock_path = lock_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None
+            with app.app_context():
+                try:
+                    return run_retention(batch_size=app.config["RETENTION_BATCH"],
+                                         grace=app.config["RETENTION_GRACE"])
+                finally:
+                    db.session.remove()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                app.logger.exception("Retention worker failed")
+
+    def start(self):
+        if self._thread or not self.interval:
+            return
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+retention_worker = RetentionWorker(
+    os.path.join(app.instance_path, "retention.lock"),
+    interval=app.config["RETENTION_INTERVAL"])
+
+
+@app.before_first_request
+def start_retention_worker():
+    retention_worker.start()
@@ -0,0 +1,187 @@
+import json
+import os
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from webApp import app
+from webApp.images import SECTION_WIDTHS, make_variants
+from webApp.lang import LANGUAGES
+
+
+# What CKEditor produces for section bodies, everything else is dropped
+ALLOWED_TAGS = {
+    "p", "br", "hr", "strong", "b", "em", "i", "u", "s", "strike", "sub", "sup", "span",
+    "h2", "h3", "h4", "h5", "h6", "blockquote", "ul", "ol", "li", "a", "img",
+    "table", "thead", "tbody", "tr", "th", "td", "caption", "figure", "figcaption",
+}
+ALLOWED_ATTRIBUTES = {
+    "a": {"href", "title", "target"},
+    "img": {"src", "alt", "title", "width", "height"},
+    "ol": {"start"},
+    "th": {"colspan", "rowspan"},
+    "td": {"colspan", "rowspan"},
+}
+URL_ATTRIBUTES = {"href", "src"}
+URL_SCHEMES = {"", "http", "https", "mailto", "tel"}
+VOID_TAGS = {"br", "hr", "img"}
+# Dropped together with everything inside them
+SKIPPED_TAGS = {"script", "style", "iframe", "object", "embed", "template", "noscript", "textarea", "select"}
+BLOCK_TAGS = ALLOWED_TAGS - {"strong", "b", "em", "i", "u", "s", "strike", "sub", "sup", "span", "a", "img"}
+
+TEXT_ALIGN = re.compile(r"^\s*text-align\s*:\s*(left|right|center|justify)\s*;?\s*$", re.I)
+WHITESPACE = re.compile(r"[ \t\r\n\f]+")
+AROUND_BLOCKS = re.compile(r" ?(</?(?:%s)\b[^>]*>) ?" % "|".join(sorted(BLOCK_TAGS)))
+UNSAFE_URL_CHARS = re.compile(r"[\x00-\x20\x7f]+")
+NUMBER = re.compile(r"^\d{1,4}$")
+
+IMAGE_SIZES = "(max-width: 1279px) 90vw, 560px"
+
+
+def safe_url(url):
+    # Browsers ignore whitespace and control characters in schemes, "java\tscript:" included
+    compact = UNSAFE_URL_CHARS.sub("", url)
+    try:
+        scheme = urlsplit(compact).scheme.lower()
+    except ValueError:
+        return None
+    return compact if scheme in URL_SCHEMES else None
+
+
+def _attributes(pairs):
+    return "".join(f' {name}="{escape(value)}"' for name, value in pairs)
+
+
+class Sanitizer(HTMLParser):
+    """Rebuilds HTML from the allowlist above, balanced and minified.
+
+    Local images are replaced by a responsive <picture> when `static_root`
+    and `image_widths` are given, see webApp.images.
+    """
+
+    def __init__(self, static_root=None, image_widths=None, static_url="/static"):
+        super().__init__(convert_charrefs=True)
+        self.static_root = static_root
+        self.image_widths = image_widths
+        self.static_url = static_url.rstrip("/")
+        self.out = []
+        self.open = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+            return
+        if self.skipping or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        kept = []
+        for name, value in attrs:
+            value = value or ""
+            if name == "style" and TEXT_ALIGN.match(value):
+                kept.append((name, f"text-align:{TEXT_ALIGN.match(value).group(1).lower()}"))
+            elif name not in allowed:
+                continue
+            elif name in URL_ATTRIBUTES:
+                value = safe_url(value)
+                if value is not None:
+                    kept.append((name, value))
+            elif name in ("width", "height", "start", "colspan", "rowspan"):
+                if NUMBER.match(value.strip()):
+                    kept.append((name, value.strip()))
+            elif name == "target":
+                if value == "_blank":
+                    kept.extend([(name, value), ("rel", "noopener noreferrer")])
+            else:
+                kept.append((name, value))
+        if tag == "img":
+            self.out.append(self._image(dict(kept)))
+            return
+        self.out.append(f"<{tag}{_attributes(kept)}>")
+        if tag not in VOID_TAGS:
+            self.open.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+            return
+        if self.skipping or tag not in self.open:
+            return
+        while self.open:
+            opened = self.open.pop()
+            self.out.append(f"</{opened}>")
+            if opened == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.out.append(escape(WHITESPACE.sub(" ", data), quote=False))
+
+    def _local_image(self, src):
+        if not (self.static_root and self.image_widths) or urlsplit(src).netloc:
+            return None
+        path = src.split("?", 1)[0].lstrip("./")
+        prefix = self.static_url.lstrip("/") + "/"
+        if not path.startswith(prefix):
+            return None
+        filename = path[len(prefix):]
+        if not os.path.isfile(os.path.join(self.static_root, *filename.split("/"))):
+            return None
+        return filename
+
+    def _image(self, attrs):
+        src = attrs.get("src")
+        filename = self._local_image(src) if src else None
+        if filename is None:
+            return f"<img{_attributes(attrs.items())}>"
+        try:
+            width, height, variants = make_variants(self.static_root, filename, self.image_widths, reuse=True)
+        except (OSError, ValueError):
+            return f"<img{_attributes(attrs.items())}>"
+        variants = json.loads(variants)
+        if not ("width" in attrs and "height" in attrs):
+            attrs["width"], attrs["height"] = str(width), str(height)
+
+        def srcset(entries):
+            return ", ".join(f"{self.static_url}/{url} {size}w" for size, url in entries)
+
+        sources = "".join(
+            f'<source type="{source["type"]}" sizes="{IMAGE_SIZES}" srcset="{escape(srcset(source["entries"]))}">'
+            for source in variants["sources"])
+        attrs.update(src=f"{self.static_url}/{variants['fallback'][-1][1]}",
+                     srcset=srcset(variants["fallback"]), sizes=IMAGE_SIZES,
+                     loading="lazy", decoding="async")
+        return f"<picture>{sources}<img{_attributes(attrs.items())}></picture>"
+
+    def result(self):
+        self.close()
+        while self.open:
+            self.out.append(f"</{self.open.pop()}>")
+        return AROUND_BLOCKS.sub(r"\1", "".join(self.out)).strip()
+
+
+def clean_html(source, static_root=None, image_widths=None, static_url="/static"):
+    """Sanitized, minified HTML of a rich-text field, ready to be emitted as is."""
+    sanitizer = Sanitizer(static_root, image_widths, static_url)
+    sanitizer.feed(source or "")
+    return sanitizer.result()
+
+
+def text_html(source):
+    # Plain text from a textarea: escaped, paragraphs on blank lines, <br> on single newlines
+    paragraphs = re.split(r"\n\s*\n", (source or "").replace("\r\n", "\n").strip())
+    return "".join("<p>" + "<br>".join(escape(line.strip()) for line in paragraph.split("\n")) + "</p>"
+                   for paragraph in paragraphs if paragraph.strip())
+
+
+def process_section(section, images=True):
+    # Fills html_cs and html_sk from the CKEditor bodies, call before every commit that changes them
+    static_root = app.static_folder if images else None
+    for lang in LANGUAGES:
+        setattr(section, f"html_{lang}", clean_html(getattr(section, f"body_{lang}"), static_root,
+                                                    SECTION_WIDTHS, app.static_url_path))
+
+
+def process_candidate(candidate):
+    candidate.message_html = text_html(candidate.message)
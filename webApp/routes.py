@@ -1,27 +1,64 @@
-import os
-from datetime import datetime
-from random import randint
+from datetime import datetime, timedelta
 
-from flask import flash, json, redirect, render_template, request, send_file, url_for
+from flask import (Response, abort, flash, get_flashed_messages, jsonify, redirect, render_template,
+                   request, stream_with_context, url_for)
 from flask_login import current_user, login_required, login_user, logout_user
-from werkzeug.security import check_password_hash, generate_password_hash
-from werkzeug.utils import secure_filename
-
-from webApp import app, db
+from flask_wtf.csrf import generate_csrf, validate_csrf
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import defer
+from wtforms import ValidationError
+
+from webApp import app, db, file_storage, image_storage, locales
+from webApp.bulk import BulkError, OPERATIONS, file_remover, parse_form, parse_json, run_batch
+from webApp.export import Link, csv_stream, xlsx_stream
 from webApp.forms import (ContactForm, LoginForm, PasswordForm, PersonaForm,
                           SectionForm, SetEmail, SetJson, UploadPersonaImg,
                           UploadSectionImg, UserForm, VideoForm)
-from webApp.models import Candidate, Persona, Section, Setting, User, Video
+from webApp.identity import identity_cache
+from webApp.images import PERSONA_WIDTHS, SECTION_WIDTHS, process_stored_image
+from webApp.lang import negotiate_language
+from webApp.models import Candidate, Persona, Section, Setting, User, Video, load_page, next_position
+from webApp.pagecache import PAGE_CONTEXTS, PUBLIC_CONTEXTS, cached_page, page_cache
+from webApp.pipeline import cv_pipeline
+from webApp.richtext import process_candidate, process_section, text_html
+from webApp.security import HashingBusy, login_throttle, password_hasher
+from webApp.storage import store_upload, zip_stream
+
+
+@app.template_global()
+def media_url(key):
+    # Uploaded images are static files unless they live in shared storage. They
+    # can be replaced under the same name, so they never use the asset manifest.
+    if image_storage.local:
+        return url_for("static", filename=key, fingerprint=False)
+    return image_storage.url(key)
+
+
+# Forms that are not a FlaskForm render the token themselves, as with CSRFProtect
+app.add_template_global(generate_csrf, "csrf_token")
+
+
+def check_csrf():
+    # Admin posts outside FlaskForm send the token in a hidden field or in X-CSRFToken
+    if app.config.get("WTF_CSRF_ENABLED", True):
+        validate_csrf(request.headers.get("X-CSRFToken") or request.form.get("csrf_token"))
+
+
+def page_url(context):
+    # Sections of the index are edited on the index itself
+    if context == "index":
+        return url_for("index")
+    return url_for("mainpage", context=context)
+
+
+# Unknown pages are a 404 from the router, before the page cache sees them
+PAGE = f"<any({', '.join(PAGE_CONTEXTS)}):context>"
+PUBLIC_PAGE = f"<any({', '.join(PUBLIC_CONTEXTS)}):context>"
 
 
 def set_language():
-    lang = request.accept_languages.best_match(['cs', 'sk'])
-    if not lang:
-        lang = "cs"
-    basedir = os.path.abspath(os.path.dirname(__file__))
-    with open(os.path.join(basedir, "static", "lang.json"), encoding="utf-8") as json_data:
-        data = json.load(json_data)
-    return lang, data
+    lang = negotiate_language()
+    return lang, locales.get(lang)
 
 
 ### Frontend routes
@@ -29,51 +66,56 @@ def set_language():
 @app.route('/')
 @app.route('/home')
 @app.route('/index')
+@cached_page
 def index():
     lang, locale = set_language()
-    sections = Section.query.filter_by(context="index")
-    persona_list = Persona.query.all()
-    return render_template("index.html", lang=lang, loc=locale, sections=sections, persona_list=persona_list)
+    page = load_page("index", with_personas=True)
+    return render_template("index.html", lang=lang, loc=locale, sections=page.sections,
+                           persona_list=page.persona_list)
 
 
-@app.route('/pages/<context>', methods=["GET", "POST"])
+@app.route(f'/pages/{PUBLIC_PAGE}', methods=["GET", "POST"])
+@cached_page
 def mainpage(context):
     lang, locale = set_language()
     form = ContactForm()
-    sections = Section.query.filter_by(context=context)
-    video = Video.query.filter_by(video_context=context).first()
     if form.validate_on_submit():
-        filename = secure_filename(form.file.data.filename)
-
-        basedir = os.path.abspath(os.path.dirname(__file__))
-        path = os.path.join(basedir, "files")
-        if not os.path.exists(path):
-            os.makedirs(path)
-
-        fullpath = os.path.join(path, filename)
-        while os.path.isfile(fullpath):
-            extension = filename[-4:]
-            filename = filename[:-4] + str(randint(1000, 9999)) + extension
-            fullpath = os.path.join(path, filename)
-        form.file.data.save(fullpath)
+        relpath, filename = store_upload(form.file.data, file_storage)
 
         new_candidate = Candidate(
-            timestamp=datetime.now().strftime("%d-%m-%Y %H:%M"),
             fullname=f"{form.surname.data} {form.name.data}",
             email=form.email.data,
-            file=filename,
-            message=form.message.data
+            file=relpath,
+            filename=filename,
+            message=form.message.data,
+            status="review" if form.recaptcha.degraded else "pending"
         )
-        recipient = Setting.query.filter_by(name="email").first().value
-        new_candidate.send_by_email(recipient, fullpath)
+        process_candidate(new_candidate)
+        # The CV is checked and mailed by the background pipeline. When reCAPTCHA
+        # could not be verified an administrator has to approve the application first.
         db.session.add(new_candidate)
         db.session.commit()
-        flash(locale["alerts"]["email_sent"][lang])
+        if new_candidate.status == "pending":
+            cv_pipeline.notify()
+        flash(locale["alerts"]["email_sent"])
         return redirect(url_for('mainpage', context=context))
     if form.errors != {}:
         for err_msg in form.errors.values():
             flash(err_msg[0], category='danger')
-    return render_template("mainpage.html", lang=lang, loc=locale, sections=sections, video=video, form=form, context=context)
+    page = load_page(context)
+    return render_template("mainpage.html", lang=lang, loc=locale, sections=page.sections, video=page.video,
+                           form=form, context=context)
+
+
+@app.route('/fragment')
+def page_fragment():
+    # The per-visitor parts of prerendered pages: flashed messages and the CSRF token
+    data = {"messages": get_flashed_messages()}
+    if request.args.get("form"):
+        data["csrf_token"] = generate_csrf()
+    response = jsonify(data)
+    response.cache_control.no_store = True
+    return response
 
 
 ### Admin routes for administrators
@@ -88,17 +130,38 @@ def login():
     if form.validate_on_submit():
         email = form.email.data
         password = form.password.data
+        if not login_throttle.allow(request.remote_addr, email):
+            flash("Příliš mnoho pokusů o přihlášení, zkuste to prosím za několik minut.", category="danger")
+            return redirect(url_for("login"))
         user = User.query.filter_by(email=email).first()
         if not user or user.active == False:
+            login_throttle.failed(email)
             flash("Tento administrátor neexistuje nebo byl zrušen!", category="danger")
             return redirect(url_for("login"))
-        elif not check_password_hash(user.password, password):
+        try:
+            valid = password_hasher.check(user.password, password)
+        except HashingBusy:
+            flash("Server je momentálně přetížen, zkuste to prosím za chvíli.", category="danger")
+            return redirect(url_for("login"))
+        if not valid:
+            login_throttle.failed(email)
             flash("Zadali jste špatné heslo, zkuste to prosím znovu!", category="danger")
             return redirect(url_for("login"))
         else:
+            login_throttle.succeeded(email)
+            if password_hasher.needs_rehash(user.password):
+                try:
+                    user.password = password_hasher.hash(password)
+                    db.session.commit()
+                except HashingBusy:
+                    pass
             login_user(user)
             flash(f"Jste přihlášen(a) jako: {user.name}")
-            return redirect(url_for("index"))
+            response = redirect(url_for("index"))
+            if app.config["STATIC_EXPORT_DIR"]:
+                # Tells the front server to pass public pages through to Flask
+                response.set_cookie(app.config["STATIC_EXPORT_COOKIE"], "1", httponly=True, samesite="Lax")
+            return response
     return render_template("admin/form.html", form=form, title=form_title)
 
 
@@ -107,7 +170,9 @@ def login():
 def logout():
     logout_user()
     flash(f"Byl(a) jste úspěšně odhlášen(a).")
-    return redirect(url_for('index'))
+    response = redirect(url_for('index'))
+    response.delete_cookie(app.config["STATIC_EXPORT_COOKIE"])
+    return response
 
 
 @app.route('/admin/update/<int:user_id>', methods=["GET", "POST"])
@@ -121,13 +186,22 @@ def password(user_id):
     form_title = f"Změnit heslo pro uživatele {user.name}"
     if form.validate_on_submit():
         old_password = form.old_password.data
-        if not check_password_hash(user.password, old_password):
+        if not login_throttle.allow(request.remote_addr, user.email):
+            flash("Příliš mnoho pokusů, zkuste to prosím za několik minut.", category="danger")
+            return redirect(url_for('password', user_id=user_id))
+        try:
+            valid = password_hasher.check(user.password, old_password)
+            hashed_password = password_hasher.hash(form.new_password.data) if valid else None
+        except HashingBusy:
+            flash("Server je momentálně přetížen, zkuste to prosím za chvíli.", category="danger")
+            return redirect(url_for('password', user_id=user_id))
+        if not valid:
+            login_throttle.failed(user.email)
             flash("Původní heslo nesouhlasí, zkuste to prosím znovu!", category="danger")
             return redirect(url_for('password', user_id=user_id))
-        hashed_password = generate_password_hash(
-            form.new_password.data, method="pbkdf2:sha256", salt_length=8)
         user.password = hashed_password
         db.session.commit()
+        identity_cache.invalidate(user.id)
         flash("Vaše heslo bylo úspěšně změněno.")
         return redirect(url_for('index'))
     return render_template("admin/form.html", form=form, title=form_title)
@@ -140,6 +214,17 @@ def administrators():
     return render_template("admin/admins.html", users=users_list)
 
 
+def send_credentials(user, new_password):
+    # The password is saved already, a failed mail only needs another try
+    try:
+        User.send_password(user.email, new_password)
+    except OSError:
+        app.logger.exception("Credentials for %s could not be mailed", user.email)
+        flash(f"Heslo pro {user.email} se nepodařilo odeslat, pošlete prosím nové heslo znovu.", category="danger")
+        return False
+    return True
+
+
 @app.route('/admin/add-user', methods=["GET", "POST"])
 @login_required
 def register():
@@ -149,14 +234,21 @@ def register():
         if User.query.filter_by(email=form.email.data).first():
             flash("Tento administrátor již existuje v naší databázi!", category="info")
             return redirect(url_for("register"))
+        try:
+            new_password, hashed_password = User.generate_password()
+        except HashingBusy:
+            flash("Server je momentálně přetížen, zkuste to prosím za chvíli.", category="danger")
+            return redirect(url_for("register"))
         new_user = User(
             email=form.email.data,
-            password=User.generate_password(form.email.data),
+            password=hashed_password,
             name=form.name.data,
             active=True
         )
         db.session.add(new_user)
         db.session.commit()
+        if not send_credentials(new_user, new_password):
+            return redirect(url_for("administrators"))
         flash(f"Nový uživatel byl úspěšně vytvořen, přihlašovací údaje byly zaslány na email: {new_user.email}", category="success")
         return redirect(url_for("index"))
     return render_template("admin/form.html", form=form, title=form_title)
@@ -166,8 +258,15 @@ def register():
 @login_required
 def send_passwrd(user_id):
     user = User.query.get(user_id)
-    user.password = user.generate_password(user.email)
+    try:
+        new_password, user.password = User.generate_password()
+    except HashingBusy:
+        flash("Server je momentálně přetížen, zkuste to prosím za chvíli.", category="danger")
+        return redirect(url_for('administrators'))
     db.session.commit()
+    identity_cache.invalidate(user.id)
+    if not send_credentials(user, new_password):
+        return redirect(url_for('administrators'))
     flash(f"Přihlašovací údaje s novým heslem byly zaslány na email: {user.email}", category="success")
     return redirect(url_for('administrators'))
 
@@ -183,6 +282,7 @@ def switch(user_id):
     else:
         user.active = False
     db.session.commit()
+    identity_cache.invalidate(user.id)
     if user_id == current_user.id:
         return redirect(url_for('logout'))
     flash(f"Status uživatele {user.name} byl úspěšně změněn.", category="success")
@@ -198,6 +298,7 @@ def del_user(user_id):
     user = User.query.get(user_id)
     db.session.delete(user)
     db.session.commit()
+    identity_cache.invalidate(user_id)
     if user_id == current_user.id:
         return redirect(url_for('logout'))
     flash(f"Uživatel {user.name} byl nenávratně odstraněn z databáze.", category="success")
@@ -229,40 +330,140 @@ def set_email():
 @app.route('/admin/set-json', methods=["GET", "POST"])
 @login_required
 def set_json():
-    basedir = os.path.abspath(os.path.dirname(__file__))
-    with open(os.path.join(basedir, "static", "lang.json"), encoding="utf-8") as json_data:
-        lang_data = json_data.read()
     form = SetJson()
     form_title = "Nastavení jazykového JSONu, buďte maximálně opatrní!"
     if form.validate_on_submit():
-        new_json = form.json.data
-        with open(os.path.join(basedir, "static", "lang.json"), "w", encoding="utf-8") as json_data:
-            json_data.write(new_json)
+        try:
+            locales.save(form.json.data)
+        except ValueError as err:
+            flash(f"Jazykový JSON není platný a nebyl uložen: {err}", category="danger")
+            return render_template("admin/form.html", form=form, title=form_title)
+        page_cache.invalidate()
         flash("Jazykový JSON byl úspěšně uložen.", category="success")
         return redirect(url_for("settings"))
-    form.json.data = lang_data
+    form.json.data = locales.raw
     return render_template("admin/form.html", form=form, title=form_title)
 
 
 ### Admin routes for candidates
 
+CANDIDATES_PER_PAGE = 50
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+
+def filter_candidates(args):
+    # Shared search and date range filters, returns the query and the active filters
+    filters = {}
+    query = Candidate.query
+    term = args.get("q", "").strip()
+    if term:
+        query = query.filter(Candidate.search_clause(term))
+        filters["q"] = term
+    date_from = parse_date(args.get("od"))
+    if date_from:
+        query = query.filter(Candidate.created >= date_from)
+        filters["od"] = args.get("od")
+    date_to = parse_date(args.get("do"))
+    if date_to:
+        query = query.filter(Candidate.created < date_to + timedelta(days=1))
+        filters["do"] = args.get("do")
+    return query, filters
+
+
+def make_cursor(candidate):
+    return f"{candidate.created.isoformat()}_{candidate.id}"
+
+
+def parse_cursor(value):
+    try:
+        created, candidate_id = value.rsplit("_", 1)
+        return datetime.fromisoformat(created), int(candidate_id)
+    except (AttributeError, ValueError):
+        return None
+
 @app.route('/admin/candidates', methods=["GET", "POST"])
 @login_required
 def candidates():
-    candidates_list = Candidate.query.all()
-    return render_template("admin/candidates.html", candidates=candidates_list)
+    query, filters = filter_candidates(request.args)
+    query = query.options(defer(Candidate.message), defer(Candidate.message_html), defer(Candidate.file_text))
+    newest_first = (Candidate.created.desc(), Candidate.id.desc())
+    after = parse_cursor(request.args.get("after"))
+    before = parse_cursor(request.args.get("before"))
+    if before:
+        created, candidate_id = before
+        candidates_list = query.filter(or_(
+            Candidate.created > created,
+            and_(Candidate.created == created, Candidate.id > candidate_id)
+        )).order_by(Candidate.created, Candidate.id).limit(CANDIDATES_PER_PAGE + 1).all()
+        has_newer = len(candidates_list) > CANDIDATES_PER_PAGE
+        candidates_list = candidates_list[:CANDIDATES_PER_PAGE][::-1]
+        has_older = True
+    else:
+        if after:
+            created, candidate_id = after
+            query = query.filter(or_(
+                Candidate.created < created,
+                and_(Candidate.created == created, Candidate.id < candidate_id)
+            ))
+        candidates_list = query.order_by(*newest_first).limit(CANDIDATES_PER_PAGE + 1).all()
+        has_older = len(candidates_list) > CANDIDATES_PER_PAGE
+        candidates_list = candidates_list[:CANDIDATES_PER_PAGE]
+        has_newer = after is not None
+    newer = older = None
+    if candidates_list:
+        if has_newer:
+            newer = make_cursor(candidates_list[0])
+        if has_older:
+            older = make_cursor(candidates_list[-1])
+    return render_template("admin/candidates.html", candidates=candidates_list,
+                           filters=filters, newer=newer, older=older)
+
+
+@app.route('/admin/candidate-message/<int:candidate_id>')
+@login_required
+def candidate_message(candidate_id):
+    candidate = Candidate.query.get_or_404(candidate_id)
+    # Rows written around process_candidate (bulk inserts, old imports) have no HTML yet
+    if candidate.message_html is None:
+        return text_html(candidate.message)
+    return candidate.message_html
+
+
+@app.route('/admin/approve-candidate/<int:candidate_id>', methods=["POST"])
+@login_required
+def approve_candidate(candidate_id):
+    try:
+        check_csrf()
+    except ValidationError:
+        flash("Platnost formuláře vypršela, zkuste to prosím znovu.", category="danger")
+        return redirect(request.referrer or url_for('candidates'))
+    approved = Candidate.query.filter_by(id=candidate_id, status="review").update(
+        {"status": "pending"}, synchronize_session=False)
+    db.session.commit()
+    if approved:
+        cv_pipeline.notify()
+        flash("Přihláška byla schválena a odeslána ke kontrole.", category="success")
+    return redirect(request.referrer or url_for('candidates'))
 
 
 @app.route('/admin/del-candidate/<int:candidate_id>', methods=["GET", "POST"])
 @login_required
 def del_candidate(candidate_id):
+    # Like the delete buttons on the candidate list, only the superadmin may remove applications
+    if current_user.id != 1:
+        abort(403)
     candidate = Candidate.query.get(candidate_id)
     name = candidate.fullname
-    basedir = os.path.abspath(os.path.dirname(__file__))
-    path = os.path.join(basedir, "files")
-    os.remove(os.path.join(path, candidate.file))
     db.session.delete(candidate)
     db.session.commit()
+    # The same CV may be shared by several applications after deduplication, the remover checks
+    file_remover.remove([candidate.file])
     flash(f"Uchazeč {name} byl odstraněn z databáze.", category="success")
     return redirect(url_for('candidates'))
 
@@ -271,14 +472,69 @@ def del_candidate(candidate_id):
 @login_required
 def download(candidate_id):
     candidate = Candidate.query.get(candidate_id)
-    basedir = os.path.abspath(os.path.dirname(__file__))
-    path = os.path.join(basedir, "files")
-    return send_file(os.path.join(path, candidate.file), as_attachment=True)
+    try:
+        return file_storage.download(candidate.file, candidate.download_name)
+    except FileNotFoundError:
+        flash(f"Životopis uchazeče {candidate.fullname} nebyl nalezen.", category="danger")
+        return redirect(url_for('candidates'))
+
+
+@app.route('/admin/download-zip')
+@login_required
+def download_zip():
+    ids = request.args.getlist("ids", type=int)
+    candidates_list = Candidate.query.filter(Candidate.id.in_(ids)).all()
+    if not candidates_list:
+        flash("Nevybrali jste žádné uchazeče.", category="info")
+        return redirect(url_for('candidates'))
+    entries = [
+        (candidate.file, f"{candidate.id}-{candidate.download_name}")
+        for candidate in candidates_list
+    ]
+    response = Response(zip_stream(file_storage, entries), mimetype="application/zip")
+    response.headers.set("Content-Disposition", "attachment", filename="zivotopisy.zip")
+    return response
+
+
+EXPORT_HEADER = ["Čas uložení", "Jméno uchazeče", "Kontaktní email", "Stav", "Zpráva", "Životopis"]
+EXPORT_STATUS = {"review": "Čeká na schválení", "pending": "Kontroluje se", "ready": "V pořádku",
+                 "rejected": "Životopis odmítnut", "unchecked": "Nezkontrolováno"}
+
+
+@app.route('/admin/candidates/export')
+@login_required
+def export_candidates():
+    # Streams the filtered list, rows are fetched in batches through a server side cursor
+    query, filters = filter_candidates(request.args)
+    rows = query.with_entities(
+        Candidate.id, Candidate.created, Candidate.fullname, Candidate.email,
+        Candidate.status, Candidate.message, Candidate.filename, Candidate.file
+    ).order_by(Candidate.created.desc(), Candidate.id.desc()).execution_options(
+        stream_results=True).yield_per(1000)
+
+    def candidate_rows():
+        for row in rows:
+            link = Link(url_for("download", candidate_id=row.id, _external=True), row.filename or row.file)
+            yield [row.created, row.fullname, row.email, EXPORT_STATUS.get(row.status, row.status),
+                   row.message, link]
+
+    name = f"uchazeci-{datetime.now():%Y-%m-%d}"
+    if request.args.get("format") == "xlsx":
+        body = xlsx_stream("Uchazeči", EXPORT_HEADER, candidate_rows())
+        mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        name += ".xlsx"
+    else:
+        body = csv_stream(EXPORT_HEADER, candidate_rows())
+        mimetype = "text/csv"
+        name += ".csv"
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers.set("Content-Disposition", "attachment", filename=name)
+    return response
 
 
 ### Admin routes for frontend sections
 
-@app.route('/admin/add-section/<context>', methods=["GET", "POST"])
+@app.route(f'/admin/add-section/{PAGE}', methods=["GET", "POST"])
 @login_required
 def add_section(context):
     form = SectionForm()
@@ -289,11 +545,14 @@ def add_section(context):
             title_sk=form.title_sk.data,
             body_cs=form.body_cs.data,
             body_sk=form.body_sk.data,
-            context=context
+            context=context,
+            position=next_position(Section.position, Section.context == context)
         )
+        process_section(new_section)
         db.session.add(new_section)
         db.session.flush()
         db.session.commit()
+        page_cache.invalidate(context)
         return redirect(url_for("upload_section_img", section_id=new_section.id))
     return render_template("admin/form.html", form=form, title=form_title)
 
@@ -306,13 +565,10 @@ def upload_section_img(section_id):
     context = section.context
     form_title = f"Nahrej obrázek pro odstavec: {section.title_cs}"
     if form.validate_on_submit():
-        img_name = secure_filename(form.image.data.filename)
-        img_file = f"images/{img_name}"
-        basedir = os.path.abspath(os.path.dirname(__file__))
-        form.image.data.save(os.path.join(basedir, f"static/{img_file}"))
-        section.image_url = img_file.replace("./static/", "")
+        process_stored_image(section, image_storage, SECTION_WIDTHS, upload=form.image.data)
         db.session.commit()
-        return redirect(url_for("mainpage", context=context))
+        page_cache.invalidate(context)
+        return redirect(page_url(context))
     return render_template("admin/form.html", form=form, title=form_title)
 
 
@@ -328,8 +584,10 @@ def edit_section(section_id):
         section.title_sk = form.title_sk.data
         section.body_cs = form.body_cs.data
         section.body_sk = form.body_sk.data
+        process_section(section)
         db.session.commit()
-        return redirect(url_for("mainpage", context=context))
+        page_cache.invalidate(context)
+        return redirect(page_url(context))
     return render_template("admin/form.html", form=form, title=form_title)
 
 
@@ -340,10 +598,11 @@ def delete_section(section_id):
     context = section.context
     db.session.delete(section)
     db.session.commit()
-    return redirect(url_for("mainpage", context=context))
+    page_cache.invalidate(context)
+    return redirect(page_url(context))
 
 
-@app.route('/admin/add-video/<context>', methods=["GET", "POST"])
+@app.route(f'/admin/add-video/{PUBLIC_PAGE}', methods=["GET", "POST"])
 @login_required
 def add_video(context):
     video = Video.query.filter_by(video_context=context).first()
@@ -363,6 +622,7 @@ def add_video(context):
             )
             db.session.add(new_video)
             db.session.commit()
+        page_cache.invalidate(context)
         return redirect(url_for("mainpage", context=context))
     return render_template("admin/form.html", form=form, title=form_title)
 
@@ -374,6 +634,7 @@ def delete_video(video_id):
     context = video.video_context
     db.session.delete(video)
     db.session.commit()
+    page_cache.invalidate(context)
     return redirect(url_for("mainpage", context=context))
 
 
@@ -394,11 +655,13 @@ def add_persona():
             position_sk=form.position_sk.data,
             phone=form.phone.data,
             email=form.email.data,
-            area=form.area.data
+            area=form.area.data,
+            position=next_position(Persona.position)
         )
         db.session.add(new_persona)
         db.session.flush()
         db.session.commit()
+        page_cache.invalidate("index")
         return redirect(url_for("upload_persona_img", pers_id=new_persona.id))
     return render_template("admin/form.html", form=form, title=form_title)
 
@@ -410,12 +673,9 @@ def upload_persona_img(pers_id):
     persona = Persona.query.get(pers_id)
     form_title = f"Nahrej fotografii pro {persona.fullname}"
     if form.validate_on_submit():
-        img_name = secure_filename(form.image.data.filename)
-        img_file = f"images/{img_name}"
-        basedir = os.path.abspath(os.path.dirname(__file__))
-        form.image.data.save(os.path.join(basedir, f"static/{img_file}"))
-        persona.image_url = img_file.replace("./static/", "")
+        process_stored_image(persona, image_storage, PERSONA_WIDTHS, upload=form.image.data)
         db.session.commit()
+        page_cache.invalidate("index")
         return redirect(url_for("index"))
     return render_template("admin/form.html", form=form, title=form_title)
 
@@ -434,6 +694,7 @@ def edit_persona(pers_id):
         persona.email = form.email.data
         persona.area = form.area.data
         db.session.commit()
+        page_cache.invalidate("index")
         return redirect(url_for("index"))
     return render_template("admin/form.html", form=form, title=form_title)
 
@@ -444,4 +705,46 @@ def delete_persona(pers_id):
     persona = Persona.query.get(pers_id)
     db.session.delete(persona)
     db.session.commit()
+    page_cache.invalidate("index")
     return redirect(url_for("index"))
+
+
+### Admin batch operations
+
+BULK_MESSAGES = {
+    "deleted": "Smazáno záznamů: {}.",
+    "approved": "Schváleno přihlášek: {}.",
+    "ordered": "Přeřazeno záznamů: {}.",
+    "updated": "Upraveno záznamů: {}.",
+}
+
+
+@app.route('/admin/bulk/<kind>', methods=["POST"])
+@login_required
+def bulk_update(kind):
+    # JSON in, JSON out for scripts; the admin forms get a flash and a redirect back
+    if kind not in OPERATIONS:
+        abort(404)
+    as_json = request.is_json
+    try:
+        check_csrf()
+    except ValidationError as err:
+        if as_json:
+            return jsonify(error=str(err)), 400
+        flash("Platnost formuláře vypršela, zkuste to prosím znovu.", category="danger")
+        return redirect(request.referrer or url_for('index'))
+    try:
+        batch = parse_json(kind, request.get_json()) if as_json else parse_form(kind, request.form)
+        if kind == "candidates" and batch.get("delete") and current_user.id != 1:
+            abort(403)
+        counts = run_batch(kind, batch)
+    except BulkError as err:
+        if as_json:
+            return jsonify(error=str(err)), 400
+        flash(str(err), category="danger")
+        return redirect(request.referrer or url_for('index'))
+    if as_json:
+        return jsonify(counts)
+    for name, count in counts.items():
+        flash(BULK_MESSAGES[name].format(count), category="success")
+    return redirect(request.referrer or url_for('index'))
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from webApp import app
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs pbkdf2 hashing in a small process pool next to the web worker.
+
+    At most `queue_depth` hashes may be pending at once, further calls fail
+    immediately with HashingBusy instead of queueing up behind a flood of
+    login attempts. With `workers=0` hashing runs inline.
+    """
+
+    def __init__(self, method, salt_length, workers=2, queue_depth=8, timeout=10):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_depth)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def _executor(self):
+        # A pool inherited through a gunicorn fork is unusable, start a new one
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            if not self.workers:
+                return func(*args)
+            return self._executor().submit(func, *args).result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HashingBusy()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        method, _, rest = pwhash.partition("$")
+        salt = rest.partition("$")[0]
+        return method != self.method or len(salt) != self.salt_length
+
+
+class LoginThrottle:
+    """Sliding window limits checked before any password is hashed.
+
+    Every attempt counts against the client IP, failed ones also against
+    the account. Counters live in this worker process only.
+    """
+
+    def __init__(self, ip_attempts=20, account_failures=5, window=300):
+        self.ip_attempts = ip_attempts
+        self.account_failures = account_failures
+        self.window = window
+        self._lock = threading.Lock()
+        self._ips = defaultdict(deque)
+        self._accounts = defaultdict(deque)
+        self._swept = time.monotonic()
+
+    def _trim(self, events, now):
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        return len(events)
+
+    def allow(self, ip, account):
+        now = time.monotonic()
+        with self._lock:
+            account = account.lower()
+            if self._trim(self._accounts[account], now) >= self.account_failures:
+                return False
+            if self._trim(self._ips[ip], now) >= self.ip_attempts:
+                return False
+            self._ips[ip].append(now)
+            if now - self._swept > self.window:
+                # Drop expired windows so the maps do not grow with every visitor
+                for table in (self._ips, self._accounts):
+                    for key in [key for key, events in table.items() if not self._trim(events, now)]:
+                        del table[key]
+                self._swept = now
+            return True
+
+    def failed(self, account):
+        with self._lock:
+            self._accounts[account.lower()].append(time.monotonic())
+
+    def succeeded(self, account):
+        with self._lock:
+            self._accounts.pop(account.lower(), None)
+
+
+password_hasher = PasswordHasher(
+    app.config["PASSWORD_HASH_METHOD"],
+    app.config["PASSWORD_SALT_LENGTH"],
+    workers=app.config["PASSWORD_HASH_WORKERS"],
+    queue_depth=app.config["PASSWORD_HASH_QUEUE"])
+
+login_throttle = LoginThrottle(
+    ip_attempts=app.config["LOGIN_IP_ATTEMPTS"],
+    account_failures=app.config["LOGIN_ACCOUNT_FAILURES"],
+    window=app.config["LOGIN_WINDOW"])
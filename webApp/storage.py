@@ -0,0 +1,409 @@
+import calendar
+import errno
+import hashlib
+import hmac
+import http.client
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urlsplit
+
+from flask import Response, current_app, redirect, request, send_file
+from werkzeug.utils import secure_filename
+
+
+CHUNK_SIZE = 64 * 1024
+HASHED_NAME = re.compile(r"^[0-9a-f]{64}(\.|$)")
+
+
+def store_upload(upload, storage):
+    """Stream an uploaded file into content-addressed `storage`.
+
+    The file is copied in chunks and hashed on the way, then stored as
+    `ab/cd/<sha256><ext>`. Identical uploads end up under the same key, so a
+    CV submitted twice is stored once, and storing it again refreshes its
+    modification time for the retention sweep. Returns the key and the
+    sanitized original filename.
+    """
+    filename = secure_filename(upload.filename) or "file"
+    extension = os.path.splitext(filename)[1].lower()
+    if storage.scratch_dir:
+        os.makedirs(storage.scratch_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=storage.scratch_dir, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: upload.stream.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                out.write(chunk)
+        key = digest.hexdigest()
+        relpath = f"{key[:2]}/{key[2:4]}/{key}{extension}"
+        storage.put(relpath, tmp_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return relpath, filename
+
+
+def stored_path(root, relpath):
+    return os.path.join(root, *relpath.split("/"))
+
+
+def _etag(relpath, stat):
+    # Content-addressed files carry their hash in the name already
+    name = relpath.rsplit("/", 1)[-1]
+    if HASHED_NAME.match(name):
+        return name[:64]
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def send_stored_file(root, relpath, download_name):
+    """Answer a download of a stored file, honouring ETag and Range headers.
+
+    With FILES_SENDFILE set to "x-accel" only the X-Accel-Redirect header is
+    returned and nginx streams the bytes (internal location mapped by
+    FILES_ACCEL_PREFIX); "x-sendfile" does the same through Flask's
+    USE_X_SENDFILE. Raises FileNotFoundError when the file is gone.
+    """
+    fullpath = stored_path(root, relpath)
+    stat = os.stat(fullpath)
+    etag = _etag(relpath, stat)
+    if current_app.config["FILES_SENDFILE"] == "x-accel":
+        response = Response(mimetype=mimetypes.guess_type(download_name)[0] or "application/octet-stream")
+        response.headers["X-Accel-Redirect"] = current_app.config["FILES_ACCEL_PREFIX"] + relpath
+        response.headers.set("Content-Disposition", "attachment", filename=download_name)
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    response = send_file(fullpath, as_attachment=True, download_name=download_name,
+                         conditional=True, etag=etag, max_age=0)
+    response.cache_control.private = True
+    return response
+
+
+class _ZipBuffer:
+    # Write-only sink for ZipFile, the pending bytes are drained by zip_stream
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_stream(storage, entries):
+    """Yield a ZIP archive of (key, arcname) entries while it is being built.
+
+    Files are stored without recompression (CVs are PDFs and DOCX archives
+    already), so memory use is bounded by CHUNK_SIZE whatever the total.
+    Missing files are skipped.
+    """
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for key, arcname in entries:
+            try:
+                source = storage.open(key)
+            except FileNotFoundError:
+                continue
+            with source, archive.open(arcname, "w", force_zip64=True) as target:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    target.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+### Storage backends, keys are relative paths with forward slashes
+
+class LocalStorage:
+    """Files below a directory on this node."""
+
+    local = True
+
+    def __init__(self, root):
+        self.root = root
+        self.location = "file://" + os.path.abspath(root).replace(os.sep, "/").rstrip("/") + "/"
+        # Uploads are staged next to their target, so moving them in is atomic
+        self.scratch_dir = root
+
+    def path(self, key):
+        return stored_path(self.root, key)
+
+    def put(self, key, source_path, move=True):
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not move:
+            shutil.copyfile(source_path, target)
+            return
+        try:
+            os.replace(source_path, target)
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+            shutil.move(source_path, target)
+
+    def open(self, key):
+        return open(self.path(key), "rb")
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def stat(self, key):
+        # (size, mtime) of a stored file, None when it is gone
+        try:
+            stat = os.stat(self.path(key))
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            return
+        # Content-addressed keys leave ab/cd/ directories behind
+        directory = os.path.dirname(self.path(key))
+        while os.path.abspath(directory) != os.path.abspath(self.root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+    def list(self, prefix=""):
+        # Yields (key, size, mtime) of every file whose key starts with `prefix`
+        for directory, _, names in os.walk(self.path(prefix.rstrip("/")) if prefix else self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield key, stat.st_size, stat.st_mtime
+
+    @contextmanager
+    def local_copy(self, key):
+        path = self.path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        yield path
+
+    def download(self, key, download_name):
+        return send_stored_file(self.root, key, download_name)
+
+
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+S3_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
+
+def _uri_quote(value, safe="-_.~"):
+    return quote(value, safe=safe)
+
+
+def _content_disposition(filename):
+    fallback = filename.encode("ascii", "ignore").decode().replace('"', "") or "file"
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{_uri_quote(filename)}"
+
+
+class S3Storage:
+    """Objects in a bucket of an S3-compatible service (AWS, MinIO, ...).
+
+    Requests are signed with AWS Signature Version 4 and use path-style
+    URLs. Uploads and downloads are streamed. Downloads are redirects to
+    presigned URLs valid for `url_ttl` seconds, so the bytes never pass
+    through the app. `public_url` is where the objects are readable by
+    anyone, e.g. a CDN in front of the bucket.
+    """
+
+    local = False
+    scratch_dir = None
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, region="us-east-1", prefix="",
+                 public_url=None, url_ttl=300, timeout=30):
+        parts = urlsplit(endpoint)
+        self.endpoint = f"{parts.scheme}://{parts.netloc}"
+        self.connection_class = (http.client.HTTPSConnection if parts.scheme == "https"
+                                 else http.client.HTTPConnection)
+        self.netloc = parts.netloc
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.location = f"{self.endpoint}/{bucket}/{self.prefix}"
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.public_url = public_url.rstrip("/") + "/" if public_url else None
+        self.url_ttl = url_ttl
+        self.timeout = timeout
+
+    def _path(self, key=None):
+        if key is None:
+            return f"/{self.bucket}"
+        return f"/{self.bucket}/" + _uri_quote(self.prefix + key, safe="/-_.~")
+
+    def _signing_key(self, date):
+        key = f"AWS4{self.secret_key}".encode()
+        for part in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        return key
+
+    def _signature(self, method, path, query, headers, payload_hash, amz_date):
+        canonical_query = "&".join(f"{_uri_quote(name)}={_uri_quote(value)}"
+                                   for name, value in sorted(query.items()))
+        values = {name.lower(): " ".join(str(value).split()) for name, value in headers.items()}
+        signed = ";".join(sorted(values))
+        canonical = "\n".join([method, path, canonical_query,
+                               "".join(f"{name}:{values[name]}\n" for name in sorted(values)),
+                               signed, payload_hash])
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+        to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope,
+                             hashlib.sha256(canonical.encode()).hexdigest()])
+        signature = hmac.new(self._signing_key(amz_date[:8]), to_sign.encode(), hashlib.sha256).hexdigest()
+        return scope, signed, signature
+
+    def _request(self, method, key=None, query=None, headers=None, body=None, length=None):
+        query = query or {}
+        path = self._path(key)
+        amz_date = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        headers = dict(headers or {}, Host=self.netloc)
+        headers["x-amz-date"] = amz_date
+        headers["x-amz-content-sha256"] = "UNSIGNED-PAYLOAD" if body is not None else EMPTY_SHA256
+        if length is not None:
+            headers["Content-Length"] = str(length)
+        scope, signed, signature = self._signature(method, path, query, headers,
+                                                   headers["x-amz-content-sha256"], amz_date)
+        headers["Authorization"] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope},"
+                                    f"SignedHeaders={signed},Signature={signature}")
+        target = path + ("?" + "&".join(f"{_uri_quote(name)}={_uri_quote(value)}"
+                                        for name, value in sorted(query.items())) if query else "")
+        conn = self.connection_class(self.netloc, timeout=self.timeout, blocksize=CHUNK_SIZE)
+        conn.request(method, target, body=body, headers=headers)
+        response = conn.getresponse()
+        if response.status == 404:
+            response.close()
+            raise FileNotFoundError(errno.ENOENT, "No such object", key)
+        if response.status >= 300:
+            detail = response.read(500).decode("utf-8", "replace")
+            response.close()
+            raise OSError(f"S3 {method} {key or self.bucket} answered {response.status}: {detail}")
+        return response
+
+    def put(self, key, source_path, move=True):
+        with open(source_path, "rb") as source:
+            self._request("PUT", key, body=source, length=os.fstat(source.fileno()).st_size,
+                          headers={"Content-Type": mimetypes.guess_type(key)[0] or "application/octet-stream"}
+                          ).close()
+        if move:
+            os.remove(source_path)
+
+    def open(self, key):
+        return self._request("GET", key)
+
+    def exists(self, key):
+        try:
+            self._request("HEAD", key).close()
+        except FileNotFoundError:
+            return False
+        return True
+
+    def stat(self, key):
+        try:
+            response = self._request("HEAD", key)
+        except FileNotFoundError:
+            return None
+        with response:
+            modified = parsedate_to_datetime(response.getheader("Last-Modified")).timestamp()
+            return int(response.getheader("Content-Length")), modified
+
+    def delete(self, key):
+        self._request("DELETE", key).close()
+
+    def list(self, prefix=""):
+        from xml.etree import ElementTree
+
+        query = {"list-type": "2", "prefix": self.prefix + prefix}
+        while True:
+            with self._request("GET", query=query) as response:
+                root = ElementTree.fromstring(response.read())
+            for item in root.iter(f"{S3_NAMESPACE}Contents"):
+                modified = item.findtext(f"{S3_NAMESPACE}LastModified")
+                yield (item.findtext(f"{S3_NAMESPACE}Key")[len(self.prefix):],
+                       int(item.findtext(f"{S3_NAMESPACE}Size")),
+                       calendar.timegm(time.strptime(modified[:19], "%Y-%m-%dT%H:%M:%S")))
+            if root.findtext(f"{S3_NAMESPACE}IsTruncated") != "true":
+                return
+            query["continuation-token"] = root.findtext(f"{S3_NAMESPACE}NextContinuationToken")
+
+    @contextmanager
+    def local_copy(self, key):
+        # Pillow and the CV checks need a real file
+        fd, path = tempfile.mkstemp(prefix=".s3-", suffix=os.path.splitext(key)[1])
+        try:
+            with os.fdopen(fd, "wb") as out, self.open(key) as source:
+                shutil.copyfileobj(source, out, CHUNK_SIZE)
+            yield path
+        finally:
+            os.remove(path)
+
+    def presigned_url(self, key, download_name=None, expires=None):
+        amz_date = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{amz_date[:8]}/{self.region}/s3/aws4_request",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(expires or self.url_ttl),
+            "X-Amz-SignedHeaders": "host",
+        }
+        if download_name:
+            query["response-content-disposition"] = _content_disposition(download_name)
+        path = self._path(key)
+        signature = self._signature("GET", path, query, {"host": self.netloc}, "UNSIGNED-PAYLOAD", amz_date)[2]
+        query["X-Amz-Signature"] = signature
+        return self.endpoint + path + "?" + "&".join(
+            f"{_uri_quote(name)}={_uri_quote(value)}" for name, value in sorted(query.items()))
+
+    def url(self, key):
+        return self.public_url + _uri_quote(key, safe="/-_.~") if self.public_url else self.presigned_url(key)
+
+    def download(self, key, download_name):
+        response = redirect(self.presigned_url(key, download_name))
+        response.cache_control.private = True
+        response.cache_control.no_store = True
+        return response
+
+
+def make_storage(url, local_root, config, public_url=None):
+    # "" keeps files in `local_root`, "s3://bucket/prefix" puts them in a bucket
+    if not url:
+        return LocalStorage(local_root)
+    parts = urlsplit(url)
+    if parts.scheme != "s3":
+        raise ValueError(f"Unknown storage {url!r}, use an empty value or s3://bucket/prefix")
+    return S3Storage(config["S3_ENDPOINT"], parts.netloc, config["S3_ACCESS_KEY"], config["S3_SECRET_KEY"],
+                     region=config["S3_REGION"], prefix=parts.path, public_url=public_url,
+                     url_ttl=config["STORAGE_URL_TTL"])
+
+
+def check_separate(file_storage, image_storage):
+    # The retention sweep removes unreferenced CVs, it must never see the images
+    first, second = sorted((file_storage.location, image_storage.location), key=len)
+    if second.startswith(first):
+        raise ValueError(f"FILES_STORAGE ({file_storage.location}) and IMAGES_STORAGE "
+                         f"({image_storage.location}) overlap, give them separate prefixes")